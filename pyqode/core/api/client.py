@@ -6,14 +6,24 @@ user throught the backend manager (
 """
 import os
 import locale
-import json
 import logging
+import shutil
 import socket
 import struct
 import sys
+import tempfile
+import time
 import uuid
+from functools import partial
 from weakref import ref
 from qtpy import QtCore, QtNetwork
+from pyqode.core.backend import batch
+from pyqode.core.backend import cancellation
+from pyqode.core.backend import codec
+from pyqode.core.backend import documents
+from pyqode.core.backend import metrics
+from pyqode.core.backend import results as result_cache
+from pyqode.core.backend import snapshots
 
 
 def _logger():
@@ -161,40 +171,280 @@ else:
             return self._obj is not None and self._obj() is None
 
 
-class JsonTcpClient(QtNetwork.QTcpSocket):
+def _weak_callback(callback):
     """
-    A json tcp client socket used to start and communicate with the pyqode
-    backend.
+    Returns a weak reference to ``callback`` (a bound method or a free
+    function), or None if there is no callback.
+    """
+    if not callback:
+        return None
+    try:
+        return WeakMethod(callback)
+    except TypeError:
+        # unbound method (i.e. free function)
+        return ref(callback)
+
+
+class DocumentSync(QtCore.QObject):
+    """
+    Keeps track of the changes made to a QTextDocument, so that the backend
+    copies of the document (see :mod:`pyqode.core.backend.documents`) can be
+    updated with the changes instead of the whole text.
+
+    Every change increments the document revision. Changes are line based:
+    each change replaces ``count`` lines starting at ``start`` with the new
+    text of the modified blocks. The last changes are kept in a log, a client
+    whose copy is too old to be updated from the log gets the full text.
+
+    There is one sync object per document (clones share it), use
+    :meth:`DocumentSync.get` to get it.
+    """
+    #: Maximum number of changes kept in the log
+    MAX_CHANGES = 100
+    _OBJECT_NAME = 'pyqode_document_sync'
+
+    @classmethod
+    def get(cls, document):
+        """
+        Returns the sync object of a QTextDocument, creates it if needed.
+        """
+        sync = document.findChild(QtCore.QObject, cls._OBJECT_NAME)
+        if sync is None:
+            sync = cls(document)
+        return sync
+
+    def __init__(self, document):
+        super(DocumentSync, self).__init__(document)
+        self.setObjectName(self._OBJECT_NAME)
+        self._document = document
+        #: Unique id of the document
+        self.id = str(uuid.uuid4())
+        #: Path of the document, sent to the backend with the updates.
+        self.path = None
+        #: Current revision of the document
+        self.revision = 0
+        self._block_count = document.blockCount()
+        self._changes = []
+        self._log_lines = 0
+        # contentsChange is only emitted by documents that have a layout
+        document.documentLayout()
+        document.contentsChange.connect(self._on_contents_change)
+
+    @staticmethod
+    def _block_text(block):
+        # QTextDocument.toPlainText converts nbsp to spaces
+        return block.text().replace(u'\xa0', ' ')
+
+    def _on_contents_change(self, position, _, added):
+        doc = self._document
+        start_block = doc.findBlock(position)
+        if not start_block.isValid():
+            start_block = doc.lastBlock()
+        end_block = doc.findBlock(position + added)
+        if not end_block.isValid():
+            end_block = doc.lastBlock()
+        end = end_block.blockNumber()
+        lines = []
+        block = start_block
+        while block.isValid() and block.blockNumber() <= end:
+            lines.append(self._block_text(block))
+            block = block.next()
+        block_count = doc.blockCount()
+        count = len(lines) - (block_count - self._block_count)
+        self._block_count = block_count
+        self.revision += 1
+        self._changes.append(
+            (self.revision, (start_block.blockNumber(), count, lines)))
+        self._log_lines += len(lines)
+        while self._changes and (
+                len(self._changes) > self.MAX_CHANGES or
+                self._log_lines > max(1000, block_count)):
+            self._log_lines -= len(self._changes.pop(0)[1][2])
+
+    def text(self):
+        """ Returns the document text """
+        return self._document.toPlainText()
+
+    def update(self, base_revision):
+        """
+        Returns the data of the update request that brings a backend copy of
+        the document from ``base_revision`` to the current revision (see
+        :func:`pyqode.core.backend.documents.update_document`).
+
+        :param base_revision: revision of the backend copy, None if the
+            backend has no copy of the document.
+        :returns: The request data or None if the copy is up to date.
+        """
+        if base_revision == self.revision:
+            return None
+        data = {'id': self.id, 'path': self.path, 'revision': self.revision}
+        if (base_revision is not None and self._changes and
+                self._changes[0][0] <= base_revision + 1):
+            data['base_revision'] = base_revision
+            data['changes'] = [change for revision, change in self._changes
+                               if revision > base_revision]
+            data['line_count'] = self._block_count
+        else:
+            data['text'] = self.text()
+        return data
+
+
+class _Request(object):
+    """
+    A request sent by the client and waiting for its response.
+    """
+    def __init__(self, request_id, worker, args, callback, owner, document,
+                 supersede=None, priority=None, partial_callback=None):
+        self.id = request_id
+        self.worker = worker
+        self.args = args
+        self.callback = callback
+        self.owner = owner
+        #: (DocumentSync, field) or None
+        self.document = document
+        #: True if the document has already been resynced for this request
+        self.resynced = False
+        #: Key used to find the requests superseded by a new request
+        self.supersede = supersede
+        #: Priority of the request, None for the default priority
+        self.priority = priority
+        #: The _Batch the request has been sent with, if any
+        self.batch = None
+        #: Callback called with each chunk of results
+        self.partial_callback = partial_callback
+        #: Chunks of results received so far (streamed requests)
+        self.partial_results = None
+        #: True if the results of the request can be cached (pure workers)
+        self.cacheable = False
+        #: Key of the request in the result cache, computed from the document
+        #: revision the request is sent with.
+        self.cache_key = None
+        #: True if the request is answered from the result cache
+        self.cache_hit = False
+        #: Time the request has been issued, for the round trip metrics
+        self.time = time.time()
+
+
+class _Batch(object):
+    """
+    A batch of requests sent by the client, see
+    :meth:`_JsonClient.request_batch`.
+    """
+    def __init__(self, batch_id, requests, callback, sync, priority):
+        self.id = batch_id
+        #: The _Request of the batch, in order
+        self.requests = requests
+        self.callback = callback
+        #: DocumentSync of the document shared by the requests, or None
+        self.sync = sync
+        self.priority = priority
+        #: True if the document has already been resynced for this batch
+        self.resynced = False
+        #: True if one of the requests has been cancelled
+        self.cancelled = False
+        self.results = [None] * len(requests)
+        self.remaining = len(requests)
+        for request in requests:
+            request.batch = self
+
+
+class _JsonClient(object):
+    """
+    Implements the client side of the backend protocol on top of a Qt socket,
+    see :class:`JsonTcpClient` and :class:`JsonLocalClient`.
+
+    There is one client per backend process. The client connects as soon as
+    it is created and stays connected for the whole lifetime of the process.
+    Many requests can be in flight on the same connection: each request has
+    a unique ``request_id`` which the server echoes back in the response, the
+    client uses it to dispatch the results to the right callback.
+
+    Requests sent before the connection is established are queued and
+    written as soon as the client is connected.
 
     It uses a simple message protocol. A message is made up of two parts.
     parts:
       - header: contains the length of the payload. (4bytes)
-      - payload: data as a json string.
+      - payload: data encoded with the connection codec (json by default).
+
+    Once connected, the client negotiates the codec with the server (see
+    :mod:`pyqode.core.backend.codec`), using the first codec of
+    :attr:`codecs` that both sides support.
+
+    Requests can use a synced document instead of sending the editor text
+    (see :class:`DocumentSync`): the client sends the changes made to the
+    document since the last request before the request itself. If the
+    server lost track of the document, it asks for a resync and the client
+    resends the request with the full text. The full text of very large
+    documents is handed over in a memory mapped file (see
+    :attr:`snapshot_threshold`).
+
+    Pending requests can be cancelled (see :meth:`cancel`), e.g. when they
+    are superseded by a newer request: their results are dropped and the
+    server skips them (or asks the running worker to stop).
+
+    Several requests on the same document can be sent in a single message
+    (see :meth:`request_batch`), the document is then synced only once.
+
+    The results of generator workers can be streamed: the server sends each
+    chunk of results as soon as it is available and the client passes it to
+    the ``on_partial`` callback of the request (see :meth:`request`).
+
+    The results of pure workers are cached (see
+    :mod:`pyqode.core.backend.results`): a request whose results are in
+    :attr:`result_cache` is answered without being sent to the server.
+
+    The round trip latency of the requests answered by the server is recorded
+    per worker in :attr:`metrics` (see :mod:`pyqode.core.backend.metrics`).
 
     """
-    #: Internal signal emitted when the backend request finished and the
-    #: socket can be removed from the list of sockets maintained by the
-    #: backend manager
-    finished = QtCore.Signal(QtNetwork.QTcpSocket)
+    #: Names of the codecs the client offers to the server, in order of
+    #: preference. Defaults to all the codecs available on the client.
+    codecs = codec.available_codecs()
+    #: Socket errors after which the client tries to connect again (the
+    #: server is not listening yet).
+    _RETRY_ERRORS = (0, )
+    #: Maximum number of results of pure workers kept in cache (0 to
+    #: disable the cache).
+    result_cache_size = 64
+    #: Weight of the last request in the moving average :attr:`latency`
+    LATENCY_SMOOTHING = 0.2
+    #: Documents with more characters are synced through a memory mapped
+    #: snapshot instead of the socket when their full text has to be sent
+    #: (see :mod:`pyqode.core.backend.snapshots`), 0 to disable snapshots.
+    snapshot_threshold = 1024 * 1024
 
-    def __init__(self, parent, port, worker_class_or_function, args,
-                 on_receive=None):
-        super(JsonTcpClient, self).__init__(parent)
-        self._port = port
-        self._worker = worker_class_or_function
-        self._args = args
+    def _setup(self):
+        """ Initialises the client, then connects to the server. """
         self._header_complete = False
         self._header_buf = bytes()
         self._to_read = 0
-        self._data_buf = bytes()
-        if on_receive:
-            try:
-                self._callback = WeakMethod(on_receive)
-            except TypeError:
-                # unbound method (i.e. free function)
-                self._callback = ref(on_receive)
-        else:
-            self._callback = None
+        #: Receive buffer, allocated from the size given by the header
+        self._data_buf = bytearray()
+        self._data_pos = 0
+        #: Requests waiting for a response: request_id -> _Request
+        self._pending = {}
+        #: Batches with requests waiting for a response: batch id -> _Batch
+        self._batches = {}
+        #: Cache of the results of the pure workers
+        self.result_cache = result_cache.ResultCache(self.result_cache_size)
+        #: Round trip latency of the requests, per worker (see
+        #: :mod:`pyqode.core.backend.metrics`)
+        self.metrics = metrics.Metrics()
+        #: Recent round trip latency (exponential moving average, in
+        #: seconds), 0 until a request has been answered.
+        self.latency = 0.0
+        #: Messages and requests waiting for the connection to be established
+        self._queue = []
+        #: Codec of the connection, None until the handshake is done.
+        self.codec = None
+        #: Optional protocol features supported by the server.
+        self.features = []
+        #: Revision of the documents known by the server: id -> revision
+        self._documents = {}
+        self._handshake_id = None
+        #: Directory of the document snapshots, created when needed
+        self._snapshot_dir = None
         self.is_connected = False
         self._closed = False
         self.connected.connect(self._on_connected)
@@ -203,92 +453,448 @@ class JsonTcpClient(QtNetwork.QTcpSocket):
         self.readyRead.connect(self._on_ready_read)
         self._connect()
 
-    def close(self):
+    def shutdown(self):
+        """
+        Closes the client for good: it won't try to reconnect and the
+        pending requests are dropped.
+        """
         self._closed = True  # fix issue with QTimer.singleShot
-        super(JsonTcpClient, self).close()
-        self._callback = None
+        super(_JsonClient, self).close()
+        self._pending.clear()
+        self._batches.clear()
+        self._queue[:] = []
+        if self._snapshot_dir is not None:
+            shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+            self._snapshot_dir = None
+
+    def close(self):
+        self.shutdown()
+
+    @property
+    def pending_count(self):
+        """ Returns the number of requests waiting for a response. """
+        return len(self._pending)
 
-    def _send_request(self):
+    def request(self, worker_class_or_function, args, on_receive=None,
+                owner=None, document=None, supersede=None, priority=None,
+                on_partial=None):
         """
-        Sends the request to the backend.
+        Sends a work request to the backend.
+
+        :param worker_class_or_function: Worker class or function (or its
+            fully qualified name).
+        :param args: worker args, any Json serializable objects
+        :param on_receive: an optional callback executed when we receive the
+            worker's results. Only a weak reference to the callback is kept.
+        :param owner: an optional object used to identify the requester, see
+            :meth:`forget`.
+        :param document: an optional (DocumentSync, field) tuple. The worker
+            will receive the document text in ``args[field]``.
+        :param supersede: an optional key (any hashable object, e.g. the mode
+            that sends the request). The pending requests sent by the same
+            ``owner`` with the same key are superseded by the new request,
+            they are cancelled.
+        :param priority: an optional priority (``'interactive'``,
+            ``'normal'`` or ``'background'``, see
+            :mod:`pyqode.core.backend.scheduler`).
+        :param on_partial: an optional callback executed with each chunk of
+            results of a generator worker, as soon as the chunk is available
+            (``on_receive`` is still called with all the results at the end).
+            The results of other workers (or of servers that do not stream
+            results) are passed in a single chunk. Only a weak reference to
+            the callback is kept.
+        :returns: The request id.
         """
-        if isinstance(self._worker, str):
-            classname = self._worker
+        request = self._create_request(
+            worker_class_or_function, args, on_receive, owner, document,
+            supersede, priority, on_partial)
+        if (on_partial is None and self.result_cache.max_size and
+                result_cache.is_pure(worker_class_or_function)):
+            request.cacheable = True
+            request.cache_key = self._cache_key(request)
+            if request.cache_key is not None:
+                try:
+                    results = self.result_cache.get(request.cache_key)
+                except KeyError:
+                    pass
+                else:
+                    # the callback is called later, as for any other request
+                    comm('results of request %r found in cache', request.id)
+                    request.cache_hit = True
+                    QtCore.QTimer.singleShot(0, partial(
+                        self._dispatch,
+                        {'request_id': request.id, 'results': results}))
+                    return request.id
+        if self.codec is None:
+            # the document may change before the request is written, the key
+            # is computed again when the request is sent.
+            request.cache_key = None
+            self._queue.append(request)
         else:
-            classname = '%s.%s' % (self._worker.__module__,
-                                   self._worker.__name__)
-        self.request_id = str(uuid.uuid4())
-        self.send({'request_id': self.request_id, 'worker': classname,
-                   'data': self._args})
+            self._send_request(request)
+        return request.id
+
+    def request_batch(self, requests, on_receive=None, owner=None,
+                      sync=None, priority=None):
+        """
+        Sends several work requests to the backend in a single message (see
+        :mod:`pyqode.core.backend.batch`). The document shared by the
+        requests is synced once and its text is given to every request that
+        asks for it. The requests are then answered one by one, as if they
+        had been sent with :meth:`request`.
+
+        If the server does not support batches, the requests are sent one by
+        one.
+
+        :param requests: list of dicts, one per request, with the following
+            keys (see :meth:`request`):
+
+                - ``worker``: worker class or function (or its fully
+                  qualified name).
+                - ``args``: worker args
+                - ``on_receive`` (optional): callback called with the results
+                  of the request
+                - ``on_partial`` (optional): callback called with each chunk
+                  of results
+                - ``document`` (optional): name of the ``args`` field that
+                  receives the text of the shared document (``args`` must be
+                  a dict).
+                - ``supersede`` (optional): supersede key of the request
+                - ``priority`` (optional): priority of the request, defaults
+                  to the priority of the batch.
+        :param on_receive: an optional callback called with the list of the
+            results of the requests (in order), once every request has been
+            answered. It is not called if one of the requests is cancelled.
+        :param owner: an optional object used to identify the requester, see
+            :meth:`forget`.
+        :param sync: the DocumentSync of the shared document, required if a
+            request uses the document.
+        :param priority: an optional priority for the requests of the batch.
+        :returns: The list of the request ids.
+        """
+        batch_requests = []
+        for entry in requests:
+            field = entry.get('document')
+            batch_requests.append(self._create_request(
+                entry['worker'], entry['args'], entry.get('on_receive'),
+                owner, None if field is None else (sync, field),
+                entry.get('supersede'), entry.get('priority', priority),
+                entry.get('on_partial')))
+        request_batch = _Batch(str(uuid.uuid4()), batch_requests,
+                               _weak_callback(on_receive), sync, priority)
+        if batch_requests:
+            self._batches[request_batch.id] = request_batch
+            if self.codec is None:
+                self._queue.append(request_batch)
+            else:
+                self._send_batch(request_batch)
+        return [request.id for request in batch_requests]
+
+    @staticmethod
+    def _cache_key(request):
+        """
+        Returns the result cache key of a request, None if the data cannot be
+        hashed. The document of a request is identified by its id and
+        revision, its text is not read.
+        """
+        args = request.args
+        if request.document is not None:
+            sync, field = request.document
+            args = dict(args)
+            args['document'] = {'id': sync.id, 'revision': sync.revision,
+                                'field': field}
+        return result_cache.content_key(request.worker, args)
+
+    def _create_request(self, worker_class_or_function, args, on_receive,
+                        owner, document, supersede, priority,
+                        on_partial=None):
+        """
+        Creates a pending request, cancels the requests it supersedes.
+        """
+        if supersede is not None:
+            self.supersede(owner, supersede)
+        if isinstance(worker_class_or_function, str):
+            classname = worker_class_or_function
+        else:
+            classname = '%s.%s' % (worker_class_or_function.__module__,
+                                   worker_class_or_function.__name__)
+        request = _Request(str(uuid.uuid4()), classname, args,
+                           _weak_callback(on_receive), owner, document,
+                           supersede, priority, _weak_callback(on_partial))
+        self._pending[request.id] = request
+        return request
+
+    def forget(self, owner):
+        """
+        Cancels every pending request sent by ``owner``, the corresponding
+        results will be silently dropped.
+        """
+        self.cancel([request.id for request in self._pending.values()
+                     if request.owner is owner])
+
+    def supersede(self, owner, key):
+        """
+        Cancels the pending requests sent by ``owner`` with the supersede
+        ``key`` (see :meth:`request`).
+        """
+        self.cancel([request.id for request in self._pending.values()
+                     if request.owner is owner and request.supersede == key])
+
+    def cancel(self, request_ids):
+        """
+        Cancels pending requests: their callbacks won't be called. Requests
+        that have not been written yet are simply dropped, the server is
+        asked to skip the other ones (or to stop the workers that are
+        running them, see :mod:`pyqode.core.backend.cancellation`).
+
+        :param request_ids: ids of the requests to cancel, unknown ids (e.g.
+            requests already answered) are ignored.
+        """
+        sent = []
+        for request_id in request_ids:
+            request = self._pending.pop(request_id, None)
+            if request is None:
+                continue
+            if request.batch is not None:
+                request.batch.cancelled = True
+                self._request_done(request, None)
+            if request in self._queue:
+                self._queue.remove(request)
+            elif request.cache_hit:
+                continue
+            elif request.batch is None or request.batch not in self._queue:
+                sent.append(request_id)
+        if sent and 'cancel' in self.features:
+            comm('cancelling requests: %r', sent)
+            self.send({'request_id': str(uuid.uuid4()),
+                       'worker': cancellation.CANCEL_WORKER,
+                       'data': {'request_ids': sent}})
+
+    def close_document(self, sync):
+        """
+        Removes a document from the backend document store.
+
+        :param sync: the DocumentSync of the document.
+        """
+        if self._documents.pop(sync.id, None) is not None:
+            self.send({'request_id': str(uuid.uuid4()),
+                       'worker': documents.CLOSE_WORKER,
+                       'data': {'id': sync.id}})
 
-    def send(self, obj, encoding='utf-8'):
+    def send(self, obj):
         """
         Sends a python object to the backend. The object **must be JSON
         serialisable**.
 
+        The object is queued if the connection is not ready yet.
+
         :param obj: object to send
-        :param encoding: encoding used to encode the json message into a
-            bytes array, this should match CodeEdit.file.encoding.
         """
+        if self.codec is None:
+            self._queue.append(obj)
+        else:
+            self._write(obj, self.codec)
+
+    def _send_request(self, request):
+        args = request.args
+        if request.document is not None:
+            sync, field = request.document
+            args = dict(args)
+            try:
+                if 'documents' in self.features:
+                    args['document'] = self._sync_document(sync, field)
+                else:
+                    args[field] = sync.text()
+            except RuntimeError:
+                # document deleted
+                self._pending.pop(request.id, None)
+                return
+        if request.cacheable and request.cache_key is None:
+            request.cache_key = self._cache_key(request)
+        message = {'request_id': request.id, 'worker': request.worker,
+                   'data': args}
+        if request.priority is not None:
+            message['priority'] = request.priority
+        if request.partial_callback is not None and 'stream' in self.features:
+            message['stream'] = True
+        self.send(message)
+
+    def _send_batch(self, request_batch):
+        requests = [request for request in request_batch.requests
+                    if request.id in self._pending]
+        if 'batch' not in self.features:
+            for request in requests:
+                self._send_request(request)
+            return
+        if not requests:
+            return
+        handle = None
+        if request_batch.sync is not None:
+            try:
+                handle = self._sync_document(request_batch.sync, None)
+            except RuntimeError:
+                # document deleted
+                for request in requests:
+                    self._pending.pop(request.id, None)
+                self._batches.pop(request_batch.id, None)
+                return
+            del handle['field']
+        messages = []
+        for request in requests:
+            message = {'request_id': request.id, 'worker': request.worker,
+                       'data': request.args}
+            if request.document is not None:
+                message['data'] = dict(request.args)
+                message['field'] = request.document[1]
+            if request.priority is not None:
+                message['priority'] = request.priority
+            if request.partial_callback is not None and \
+                    'stream' in self.features:
+                message['stream'] = True
+            messages.append(message)
+        message = {'request_id': request_batch.id,
+                   'worker': batch.BATCH_WORKER,
+                   'data': {'document': handle, 'requests': messages}}
+        if request_batch.priority is not None:
+            message['priority'] = request_batch.priority
+        self.send(message)
+
+    def _request_done(self, request, results):
+        """
+        Records the results of a request sent in a batch, calls the batch
+        callback once every request of the batch is done.
+        """
+        request_batch = request.batch
+        request_batch.results[request_batch.requests.index(request)] = results
+        request_batch.remaining -= 1
+        if request_batch.remaining:
+            return
+        self._batches.pop(request_batch.id, None)
+        callback = request_batch.callback
+        if not request_batch.cancelled and callback and callback():
+            callback()(request_batch.results)
+
+    def _on_batch_response(self, request_batch, obj):
+        """
+        Handles the response to a batch: the server only answers a batch when
+        the shared document is out of sync.
+        """
+        if not obj.get('resync') or request_batch.sync is None:
+            return
+        if not request_batch.resynced:
+            comm('resyncing document for batch %r', request_batch.id)
+            request_batch.resynced = True
+            self._documents.pop(request_batch.sync.id, None)
+            self._send_batch(request_batch)
+            return
+        _logger().warning('failed to sync document with the backend')
+        for request in request_batch.requests:
+            if request.id in self._pending:
+                self._dispatch({'request_id': request.id, 'results': []})
+
+    def _sync_document(self, sync, field):
+        """
+        Sends the document changes the server does not know about yet and
+        returns the document handle.
+        """
+        update = sync.update(self._documents.get(sync.id))
+        if update is not None:
+            text = update.get('text')
+            if (text is not None and self.snapshot_threshold and
+                    len(text) >= self.snapshot_threshold and
+                    'snapshot' in self.features):
+                if self._snapshot_dir is None:
+                    self._snapshot_dir = tempfile.mkdtemp(prefix='pyqode-')
+                update['snapshot'] = snapshots.write_snapshot(
+                    self._snapshot_dir, sync.id, update.pop('text'),
+                    sync.revision)
+            self.send({'request_id': str(uuid.uuid4()),
+                       'worker': documents.UPDATE_WORKER, 'data': update})
+            self._documents[sync.id] = sync.revision
+        return {'id': sync.id, 'revision': sync.revision, 'field': field}
+
+    def _write(self, obj, msg_codec):
         comm('sending request: %r', obj)
-        msg = json.dumps(obj)
-        msg = msg.encode(encoding)
+        msg = msg_codec.dumps(obj)
         header = struct.pack('=I', len(msg))
-        self.write(header)
-        self.write(msg)
+        self.write(header + msg)
 
-    @staticmethod
-    def pick_free_port():
-        """ Picks a free port """
-        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        test_socket.bind(('127.0.0.1', 0))
-        free_port = int(test_socket.getsockname()[1])
-        test_socket.close()
-        return free_port
+    def _address(self):
+        """ Returns the address of the server, for logging purpose. """
+        raise NotImplementedError()
 
     def _connect(self):
         """ Connects our client socket to the backend socket """
-        if self is None:
-            return
-        comm('connecting to 127.0.0.1:%d', self._port)
-        address = QtNetwork.QHostAddress('127.0.0.1')
-        self.connectToHost(address, self._port)
+        raise NotImplementedError()
 
     def _on_connected(self):
-        comm('connected to backend: %s:%d', self.peerName(), self.peerPort())
+        comm('connected to backend: %s', self._address())
         self.is_connected = True
-        self._send_request()
+        # the handshake is always encoded in json, the other requests wait
+        # for the handshake response.
+        self._handshake_id = str(uuid.uuid4())
+        self._write({'request_id': self._handshake_id,
+                     'worker': codec.HANDSHAKE_WORKER,
+                     'data': {'codecs': self.codecs}}, codec.JsonCodec)
+
+    def _on_handshake(self, results):
+        self._handshake_id = None
+        try:
+            name = results['codec']
+            self.features = results['features']
+        except (KeyError, TypeError):
+            # older server
+            name = results
+            self.features = []
+        self.codec = codec.get_codec(name)
+        comm('codec: %s, features: %r', self.codec.name, self.features)
+        for item in self._queue:
+            if isinstance(item, _Request):
+                self._send_request(item)
+            elif isinstance(item, _Batch):
+                self._send_batch(item)
+            else:
+                self._write(item, self.codec)
+        self._queue[:] = []
 
     def _on_error(self, error):
         if error not in SOCKET_ERROR_STRINGS:  # pragma: no cover
             error = -1
-        if error == 1 and self.is_connected or (
-                not self.is_connected and error == 0 and not self._closed):
+        retry = (error in self._RETRY_ERRORS and not self.is_connected and
+                 not self._closed)
+        if error == 1 and self.is_connected or retry:
             log_fct = comm
         else:
             log_fct = _logger().warning
 
-        if error == 0 and not self.is_connected and not self._closed:
+        if retry:
             QtCore.QTimer.singleShot(100, self._connect)
 
         log_fct(SOCKET_ERROR_STRINGS[error])
 
     def _on_disconnected(self):
         try:
-            comm('disconnected from backend: %s:%d', self.peerName(),
-                 self.peerPort())
+            comm('disconnected from backend: %s', self._address())
         except (AttributeError, RuntimeError):
             # logger might be None if for some reason qt deletes the socket
             # after python global exit
             pass
         try:
             self.is_connected = False
+            self.codec = None
+            self._documents.clear()
+            # the responses to the requests in flight will never come
+            self._pending.clear()
+            self._batches.clear()
+            self._header_complete = False
+            self._header_buf = bytes()
+            self._data_buf = bytearray()
         except AttributeError:
             pass
 
     def _read_header(self):
         comm('reading header')
-        self._header_buf += self.read(4)
+        self._header_buf += self.read(4 - len(self._header_buf))
         if len(self._header_buf) == 4:
             self._header_complete = True
             try:
@@ -298,6 +904,9 @@ class JsonTcpClient(QtNetwork.QTcpSocket):
                 header = struct.unpack('=I', self._header_buf.data())
             self._to_read = header[0]
             self._header_buf = bytes()
+            # the payload is copied in place, the buffer is never resized
+            self._data_buf = bytearray(self._to_read)
+            self._data_pos = 0
             comm('header content: %d', self._to_read)
 
     def _read_payload(self):
@@ -307,28 +916,98 @@ class JsonTcpClient(QtNetwork.QTcpSocket):
         data_read = self.read(self._to_read)
         nb_bytes_read = len(data_read)
         comm('%d bytes read', nb_bytes_read)
-        self._data_buf += data_read
+        end = self._data_pos + nb_bytes_read
+        try:
+            self._data_buf[self._data_pos:end] = data_read
+        except TypeError:
+            # pyside
+            self._data_buf[self._data_pos:end] = data_read.data()
+        self._data_pos = end
         self._to_read -= nb_bytes_read
         if self._to_read <= 0:
-            try:
-                data = self._data_buf.decode('utf-8')
-            except AttributeError:
-                data = bytes(self._data_buf.data()).decode('utf-8')
-            comm('payload read: %r', data)
-            comm('payload length: %r', len(self._data_buf))
-            comm('decoding payload as json object')
-            obj = json.loads(data)
-            comm('response received: %r', obj)
-            try:
-                results = obj['results']
-            except (KeyError, TypeError):
-                results = None
-            # possible callback
-            if self._callback and self._callback():
-                self._callback()(results)
+            data = self._data_buf
+            comm('payload length: %r', len(data))
             self._header_complete = False
-            self._data_buf = bytes()
-            self.finished.emit(self)
+            self._data_buf = bytearray()
+            if self.codec is None:
+                obj = codec.JsonCodec.loads(data)
+            else:
+                obj = self.codec.loads(data)
+            comm('response received: %r', obj)
+            self._dispatch(obj)
+
+    def _dispatch(self, obj):
+        """ Routes a response to the callback of the matching request """
+        try:
+            request_id = obj['request_id']
+            results = obj['results']
+        except (KeyError, TypeError):
+            _logger().warning('invalid response: %r', obj)
+            return
+        if request_id == self._handshake_id:
+            self._on_handshake(results)
+            return
+        if request_id in self._batches:
+            self._on_batch_response(self._batches[request_id], obj)
+            return
+        if obj.get('partial'):
+            self._on_partial_results(request_id, results)
+            return
+        try:
+            request = self._pending.pop(request_id)
+        except KeyError:
+            comm('no pending request for id %r', request_id)
+            return
+        if obj.get('cancelled'):
+            return
+        if obj.get('resync') and request.document is not None:
+            if not request.resynced:
+                # the server lost track of the document, resend the request
+                # with the full text.
+                comm('resyncing document for request %r', request_id)
+                request.resynced = True
+                # the text may have changed since the request was sent
+                request.cache_key = None
+                self._documents.pop(request.document[0].id, None)
+                self._pending[request_id] = request
+                self._send_request(request)
+                return
+            _logger().warning('failed to sync document with the backend')
+        elif request.cache_key is not None and not request.cache_hit:
+            self.result_cache.put(request.cache_key, results)
+        if not request.cache_hit:
+            elapsed = time.time() - request.time
+            self.metrics.record(request.worker, metrics.ROUND_TRIP, elapsed)
+            self.latency += self.LATENCY_SMOOTHING * (elapsed - self.latency)
+        if request.partial_results is not None:
+            # streamed results, the last response only marks the end
+            request.partial_results.extend(results)
+            results = request.partial_results
+        elif request.partial_callback and results:
+            # the results were not streamed: they form a single chunk
+            partial_callback = request.partial_callback()
+            if partial_callback:
+                partial_callback(results)
+        # possible callback
+        callback = request.callback
+        if callback and callback():
+            callback()(results)
+        if request.batch is not None:
+            self._request_done(request, results)
+
+    def _on_partial_results(self, request_id, results):
+        """ Handles a chunk of the results of a streamed request """
+        try:
+            request = self._pending[request_id]
+        except KeyError:
+            comm('no pending request for id %r', request_id)
+            return
+        if request.partial_results is None:
+            request.partial_results = []
+        request.partial_results.extend(results)
+        callback = request.partial_callback
+        if callback and callback():
+            callback()(results)
 
     def _on_ready_read(self):
         """ Read bytes when ready read """
@@ -339,6 +1018,85 @@ class JsonTcpClient(QtNetwork.QTcpSocket):
                 self._read_payload()
 
 
+class JsonTcpClient(_JsonClient, QtNetwork.QTcpSocket):
+    """
+    A json client socket that connects to the backend on a local tcp port
+    (see :class:`_JsonClient` for the protocol).
+    """
+    def __init__(self, parent, port):
+        super(JsonTcpClient, self).__init__(parent)
+        self._port = port
+        self._setup()
+
+    @staticmethod
+    def pick_free_port():
+        """ Picks a free port """
+        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        test_socket.bind(('127.0.0.1', 0))
+        free_port = int(test_socket.getsockname()[1])
+        test_socket.close()
+        return free_port
+
+    def _address(self):
+        return '127.0.0.1:%d' % self._port
+
+    def _connect(self):
+        """ Connects our client socket to the backend socket """
+        if self is None or self._closed:
+            return
+        comm('connecting to 127.0.0.1:%d', self._port)
+        address = QtNetwork.QHostAddress('127.0.0.1')
+        self.connectToHost(address, self._port)
+
+
+class JsonLocalClient(_JsonClient, QtNetwork.QLocalSocket):
+    """
+    A json client socket that connects to the backend on a unix domain socket
+    (see :class:`_JsonClient` for the protocol).
+
+    Local sockets avoid the overhead of the tcp stack and do not need a free
+    port, they are only available on unix platforms (see
+    :func:`local_sockets_supported`).
+    """
+    # the socket file does not exist until the server is listening
+    _RETRY_ERRORS = (0, 2)
+
+    def __init__(self, parent, path):
+        super(JsonLocalClient, self).__init__(parent)
+        self._path = path
+        self._setup()
+
+    @staticmethod
+    def pick_socket_path():
+        """
+        Returns the path of a new unix domain socket, in a private temporary
+        directory.
+        """
+        return os.path.join(tempfile.mkdtemp(prefix='pyqode-'), 'backend')
+
+    def close(self):
+        # QLocalSocket closes itself when a connection attempt fails, the
+        # client must not stop retrying: use shutdown to close the client.
+        QtNetwork.QLocalSocket.close(self)
+
+    def _address(self):
+        return self._path
+
+    def _connect(self):
+        """ Connects our client socket to the backend socket """
+        if self is None or self._closed:
+            return
+        comm('connecting to %s', self._path)
+        self.connectToServer(self._path)
+
+
+def local_sockets_supported():
+    """
+    Tells whether the backend can use unix domain sockets on this platform.
+    """
+    return hasattr(socket, 'AF_UNIX') and sys.platform != 'win32'
+
+
 class BackendProcess(QtCore.QProcess):
     """
     Extends QProcess with methods to easily manipulate the backend process.
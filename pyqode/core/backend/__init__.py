@@ -11,12 +11,41 @@ Protocol
 
 We use a worker based json messaging server using the TCP/IP transport.
 
+The client opens one single, persistent connection per backend process and
+sends all its requests on it. Several requests may be in flight at the same
+time, responses are matched with their request using the ``request_id``.
+
 We build our own, very simple protocol where each message is made up of two
 parts:
 
   - a header: simply contains the length of the payload
   - a payload: a json formatted string, the content of the message.
 
+JSON is the default encoding, the client and the server may agree on a more
+compact codec when the connection is established (see
+:mod:`pyqode.core.backend.codec`).
+
+Instead of sending the editor text with every request, the client can keep a
+copy of the document in the backend up to date and send a document handle
+(see :mod:`pyqode.core.backend.documents`).
+
+Requests whose results are not needed anymore can be cancelled (see
+:mod:`pyqode.core.backend.cancellation`).
+
+Several requests on the same document can be sent in a single message, the
+document being shipped once (see :mod:`pyqode.core.backend.batch`).
+
+The server records the latency and the payload sizes of the requests of each
+worker (see :mod:`pyqode.core.backend.metrics`).
+The requests can be recorded in a trace file and replayed later (see
+:mod:`pyqode.core.backend.traces`).
+
+The word completion can include the words of the project files, indexed in
+the background (see :mod:`pyqode.core.backend.workspace`).
+The files of a project directory can be searched by a pool of processes, the
+occurrences are streamed as they are found (see
+:mod:`pyqode.core.backend.find_in_files`).
+
 There are two type of json object: a request and a response.
 
 Request
@@ -50,6 +79,24 @@ E.g::
         'results': ['some code', 0]
     }
 
+Streaming
++++++++++
+
+A worker may be a generator that yields its results by chunks (lists). By
+default the server concatenates the chunks and sends a single response. If
+the request sets ``'stream': True``, every chunk is sent as soon as it is
+yielded, in a partial response::
+
+    {
+        'request_id': 'a97285af-cc88-48a4-ac69-7459b9c7fa66',
+        'results': [chunk items],
+        'partial': True
+    }
+
+followed by a regular response with an empty result list once the worker is
+done. The client concatenates the chunks (see the ``on_partial`` parameter of
+:meth:`pyqode.core.managers.BackendManager.send_request`).
+
 Server script
 -------------
 
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains an implementation of the backend server based on asyncio
+streams, an alternative to :class:`pyqode.core.backend.server.JsonServer`.
+
+:class:`JsonServer` serves every connection with its own thread and checks
+the heartbeat with a thread that wakes up every second.
+:class:`AsyncJsonServer` serves all the connections from a single event loop:
+reading and decoding the messages does not need a thread per editor and the
+heartbeat is a timer of the loop. Workers, which may block, are still run by a
+thread pool.
+
+Both servers speak the same protocol and accept the same arguments (see
+:func:`pyqode.core.backend.server.default_parser`), the asyncio server is
+selected with ``--server asyncio``::
+
+    editor.backend.start(server_script, args=['--server', 'asyncio'])
+
+.. warning:: This module requires python 3.5 or newer, it is only imported
+    when the asyncio server is selected: server scripts run with python 2
+    must keep the default server.
+"""
+import asyncio
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+
+from pyqode.core.backend import codec
+from pyqode.core.backend.server import (
+    DISPATCH_CONCURRENT, FEATURES, HEARTBEAT_DELAY, TRANSPORT_UNIX,
+    RequestDispatcher, default_parser, futures)
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+class _Connection(object):
+    """
+    A client connection of the asyncio server.
+    """
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        #: Codec used to encode/decode messages, json until the client
+        #: negotiates another codec.
+        self.codec = codec.JsonCodec
+
+    async def read(self):
+        """
+        Reads a message and decodes it, returns the message and its size.
+        """
+        header = await self.reader.readexactly(4)
+        size = struct.unpack('=I', header)[0]
+        data = self.codec.loads(await self.reader.readexactly(size))
+        return data, size + 4
+
+    def send(self, obj):
+        """
+        Sends a python obj on the connection, encoded with the connection
+        codec. May be called from any thread: the message is encoded by the
+        calling thread and written by the event loop.
+
+        :returns: the number of bytes sent
+        """
+        msg = self.codec.dumps(obj)
+        _logger().log(1, 'sending %d bytes for the payload', len(msg))
+        self.server.loop.call_soon_threadsafe(
+            self._write, struct.pack('=I', len(msg)) + msg)
+        return len(msg) + 4
+
+    def _write(self, frame):
+        if not self.writer.is_closing():
+            self.writer.write(frame)
+
+    async def serve(self):
+        """
+        Handles the messages sent on the connection until the client
+        disconnects.
+        """
+        try:
+            while True:
+                data, size = await self.read()
+                if data.get('worker') == codec.HANDSHAKE_WORKER:
+                    self._handshake(data)
+                    continue
+                self.server.handle_message(data, self.send, size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            _logger().log(1, 'client disconnected')
+        finally:
+            self.server.connections.discard(self)
+            self.writer.close()
+
+    def _handshake(self, data):
+        """
+        Answers the codec handshake, then switches to the negotiated codec.
+        """
+        name = codec.negotiate(data['data'])
+        _logger().log(1, 'codec: %s', name)
+        self.send({'request_id': data['request_id'],
+                   'results': {'codec': name, 'features': FEATURES}})
+        self.codec = codec.get_codec(name)
+
+
+class AsyncJsonServer(RequestDispatcher):
+    """
+    Backend server based on asyncio streams (see
+    :class:`pyqode.core.backend.server.JsonServer` for the features, they
+    are the same).
+
+    The server listens as soon as it is created, :meth:`serve_forever` then
+    runs its event loop in the calling thread.
+
+    In serial dispatch mode, the workers are run by a single thread, in
+    concurrent mode by ``--threads`` threads.
+    """
+    def __init__(self, args=None):
+        """
+        :param args: Argument parser args. If None, the server will setup and
+            use its own argument parser (using
+            :meth:`pyqode.core.backend.default_parser`)
+        """
+        if not args:
+            args = default_parser().parse_args()
+        dispatch = self.setup_dispatcher(args)
+        threads = 1
+        if dispatch == DISPATCH_CONCURRENT:
+            threads = getattr(args, 'threads', 4)
+        self.executor = futures.ThreadPoolExecutor(max_workers=threads)
+        #: The event loop of the server
+        self.loop = asyncio.new_event_loop()
+        #: The open connections
+        self.connections = set()
+        self._heartbeat_handle = None
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._server = self.loop.run_until_complete(self._listen())
+        if self.transport == TRANSPORT_UNIX:
+            print('started on %s' % self.port)
+        else:
+            print('started on 127.0.0.1:%d' % int(self.port))
+        print('running with python %d.%d.%d' % (sys.version_info[:3]))
+        print('dispatch mode: %s (asyncio)' % dispatch)
+
+    async def _listen(self):
+        if self.transport == TRANSPORT_UNIX:
+            if os.path.exists(self.port):
+                # stale socket of a previous server
+                os.remove(self.port)
+            return await asyncio.start_unix_server(
+                self._on_connection, path=self.port)
+        return await asyncio.start_server(
+            self._on_connection, '127.0.0.1', int(self.port))
+
+    async def _on_connection(self, reader, writer):
+        connection = _Connection(self, reader, writer)
+        self.connections.add(connection)
+        await connection.serve()
+
+    def submit(self, fn):
+        """
+        Runs ``fn`` in the executor (called from the event loop).
+        """
+        # the loop does not wait for the result (the response is sent by the
+        # worker thread): run_in_executor would only add a wake up of the
+        # loop per request to complete its future.
+        self.executor.submit(fn)
+
+    def serve_forever(self):
+        """
+        Runs the event loop until :meth:`shutdown` is called or until the
+        heartbeat times out.
+        """
+        self._stopped.clear()
+        asyncio.set_event_loop(self.loop)
+        self._schedule_heartbeat(HEARTBEAT_DELAY)
+        try:
+            self.loop.run_forever()
+        finally:
+            self._heartbeat_handle.cancel()
+            self._stopped.set()
+
+    def shutdown(self):
+        """
+        Stops :meth:`serve_forever` (called from another thread), waits until
+        it returns.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._stopped.wait()
+
+    def server_close(self):
+        """
+        Closes the connections and releases the resources of the server.
+        """
+        self._server.close()
+        for connection in list(self.connections):
+            connection.writer.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        self.executor.shutdown(wait=False)
+        self.close_dispatcher()
+        if self.transport == TRANSPORT_UNIX:
+            try:
+                os.remove(self.port)
+            except OSError:
+                pass
+
+    def _schedule_heartbeat(self, delay):
+        self._heartbeat_handle = self.loop.call_later(delay, self.heartbeat)
+
+    def heartbeat(self):
+        """
+        Stops the server if the client did not send any request for too long
+        (the timer is set for the remaining time, instead of polling).
+        """
+        elapsed_time = time.time() - self.last_time
+        timeout = self.timeout
+        if self._running:
+            # make sure to have enough time to handle the requests
+            timeout = HEARTBEAT_DELAY * 10
+        if elapsed_time > timeout:
+            _logger().info('no heartbeat for %ds, stopping', elapsed_time)
+            self.loop.stop()
+            return
+        self._schedule_heartbeat(timeout - elapsed_time)
+
+
+def serve_forever(args=None):
+    """
+    Creates the asyncio server and serves forever (see
+    :func:`pyqode.core.backend.server.serve_forever`, which calls this
+    function when ``--server asyncio`` is passed).
+
+    :param args: Optional args if you decided to use your own
+        argument parser.
+    """
+    server = AsyncJsonServer(args=args)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
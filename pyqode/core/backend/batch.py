@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the server side support for batch requests.
+
+A batch bundles several work requests that apply to the same document (e.g.
+the checker, outline and occurrences requests sent by an editor after a pause
+in typing) in a single message. The document is shipped and resolved once,
+then every request of the batch is queued and answered as if it had been sent
+on its own::
+
+    {
+        'request_id': id of the batch,
+        'worker': BATCH_WORKER,
+        'data': {
+            # optional handle of the shared document
+            'document': {'id': document id, 'revision': revision},
+            'requests': [
+                {
+                    'request_id': id of the request,
+                    'worker': fully qualified name of the worker,
+                    'data': worker data,
+                    # optional, name of the data field that receives the
+                    # text of the shared document
+                    'field': 'code',
+                    # optional, defaults to the priority of the batch
+                    'priority': 'background'
+                },
+                ...
+            ]
+        },
+        'priority': optional priority of the requests of the batch
+    }
+
+The server answers each request of the batch with its own response, as soon
+as its worker has run (the requests run concurrently if the dispatch mode
+allows it). The batch itself is only answered if the shared document is out
+of sync: the server then asks for a resync (see
+:mod:`pyqode.core.backend.documents`) and none of the requests is run.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+from pyqode.core.backend import documents
+
+
+#: Name of the worker used to send a batch of requests (handled by the server
+#: itself).
+BATCH_WORKER = 'pyqode.core.backend.batch.run_batch'
+
+
+def split(data):
+    """
+    Splits a batch into its requests and gives them the text of the shared
+    document (the same string object is shared by all the requests).
+
+    :param data: the batch message.
+    :returns: the list of the request messages of the batch.
+    :raises: pyqode.core.backend.documents.OutOfSync if the shared document
+        is not available.
+    """
+    batch = data['data']
+    text = None
+    handle = batch.get('document')
+    if handle:
+        text = documents.get_document(handle).text
+    requests = []
+    for request in batch['requests']:
+        request = dict(request)
+        field = request.pop('field', None)
+        if field is not None and text is not None:
+            request['data'][field] = text
+        if request.get('priority') is None and data.get('priority'):
+            request['priority'] = data['priority']
+        requests.append(request)
+    return requests
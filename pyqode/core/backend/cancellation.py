@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the server side support for request cancellation.
+
+The client cancels the requests whose results are not needed anymore (e.g. a
+completion request superseded by a newer one) by sending a request to the
+:func:`cancel_requests` worker::
+
+    {
+        'request_ids': list of the ids of the requests to cancel
+    }
+
+The server keeps a :class:`CancellationToken` for every request it has
+received and not answered yet. Cancelling a request sets its token: a request
+that is still queued is skipped and the server answers it with an empty
+result flagged as cancelled::
+
+    {
+        'request_id': id of the cancelled request,
+        'results': [],
+        'cancelled': True
+    }
+
+Long running workers can stop early by checking the token of the request they
+are running, e.g.::
+
+    from pyqode.core.backend.cancellation import current_token
+
+    def my_worker(data):
+        token = current_token()
+        for item in data:
+            token.raise_if_cancelled()
+            ...
+
+.. note:: Workers run in the process pool (``cpu_bound`` workers) cannot see
+    the token: they are only skipped if they are cancelled while queued.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import threading
+
+
+#: Fully qualified name of the worker used to cancel requests.
+CANCEL_WORKER = 'pyqode.core.backend.cancellation.cancel_requests'
+
+
+class Cancelled(Exception):
+    """
+    Raised by :meth:`CancellationToken.raise_if_cancelled` when the request
+    has been cancelled.
+    """
+
+
+class CancellationToken(object):
+    """
+    Tells whether a request has been cancelled by the client.
+    """
+    def __init__(self, request_id=None):
+        #: Id of the request
+        self.request_id = request_id
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        """ True if the request has been cancelled """
+        return self._event.is_set()
+
+    def cancel(self):
+        """ Cancels the request """
+        self._event.set()
+
+    def raise_if_cancelled(self):
+        """
+        Raises :class:`Cancelled` if the request has been cancelled.
+        """
+        if self._event.is_set():
+            raise Cancelled(self.request_id)
+
+
+class TokenRegistry(object):
+    """
+    Thread safe registry of the tokens of the requests being processed.
+    """
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def register(self, request_id):
+        """
+        Creates the token of a request.
+        """
+        token = CancellationToken(request_id)
+        with self._lock:
+            self._tokens[request_id] = token
+        return token
+
+    def release(self, request_id):
+        """
+        Forgets the token of a request, once the request has been answered.
+        """
+        with self._lock:
+            self._tokens.pop(request_id, None)
+
+    def cancel(self, request_ids):
+        """
+        Cancels a list of requests, unknown ids (requests already answered)
+        are ignored.
+
+        :returns: the number of cancelled requests.
+        """
+        nb_cancelled = 0
+        with self._lock:
+            for request_id in request_ids:
+                try:
+                    self._tokens[request_id].cancel()
+                except KeyError:
+                    continue
+                nb_cancelled += 1
+        return nb_cancelled
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
+
+
+#: The token registry of the backend process.
+registry = TokenRegistry()
+
+#: Token returned by :func:`current_token` outside of a request, it is never
+#: cancelled.
+_NEVER_CANCELLED = CancellationToken()
+
+_local = threading.local()
+
+
+def current_token():
+    """
+    Returns the token of the request run by the calling thread. If the
+    thread is not running a request (e.g. the worker is called directly), a
+    token that is never cancelled is returned.
+    """
+    return getattr(_local, 'token', None) or _NEVER_CANCELLED
+
+
+def set_current_token(token):
+    """
+    Sets the token of the request run by the calling thread (used by the
+    server, None to reset).
+    """
+    _local.token = token
+
+
+def cancel_requests(data):
+    """
+    Worker that cancels requests.
+
+    :param data: Request data dict::
+        {
+            'request_ids': list of the ids of the requests to cancel
+        }
+    :returns: the number of requests that were still pending.
+    """
+    return registry.cancel(data['request_ids'])
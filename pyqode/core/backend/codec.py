@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the codecs used to encode the messages exchanged between
+the client and the server.
+
+See ``test/benchmarks/bench_codecs.py`` for a comparison of the codecs.
+
+JSON is always available and is used until the client and the server agree on
+a faster codec: right after connecting, the client sends a handshake request
+(a regular json request for the :func:`negotiate` worker) with the list of
+codecs it supports, ordered by preference. The server answers with the first
+codec it supports too and both sides switch to that codec for the rest of the
+connection. A server that does not know about codecs cannot import the
+handshake worker and answers with an empty result, the connection then keeps
+using JSON.
+
+Available codecs (in order of preference):
+
+    - ``marshal-X.Y``: the python marshal module, only used when both sides
+      run the same python version (X.Y) since the format is version specific
+    - ``msgpack``: requires the msgpack package
+    - ``orjson``: requires the orjson package (python 3 only)
+    - ``json``: always available
+
+.. note:: msgpack, orjson and json turn tuples into lists, marshal preserves
+    them.
+
+The ``loads`` functions accept ``bytes`` and ``bytearray`` objects (the
+receive buffers are bytearrays), without copying them.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import json
+import marshal
+import sys
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+PY2 = sys.version_info[0] == 2
+
+#: Fully qualified name of the worker used for the codec handshake.
+HANDSHAKE_WORKER = 'pyqode.core.backend.codec.negotiate'
+
+
+class JsonCodec(object):
+    """
+    Encodes messages as utf-8 json strings (the default codec).
+    """
+    name = 'json'
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data.decode('utf-8'))
+
+
+class MarshalCodec(object):
+    """
+    Encodes messages with the marshal module. The name of the codec contains
+    the python version since the marshal format is version specific.
+    """
+    name = 'marshal-%d.%d' % sys.version_info[:2]
+
+    @staticmethod
+    def dumps(obj):
+        return marshal.dumps(obj)
+
+    @staticmethod
+    def loads(data):
+        if PY2:
+            # python 2 marshal only accepts strings
+            data = bytes(data)
+        return marshal.loads(data)
+
+
+class MsgpackCodec(object):
+    """
+    Encodes messages with msgpack.
+    """
+    name = 'msgpack'
+
+    @staticmethod
+    def dumps(obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    @staticmethod
+    def loads(data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class OrjsonCodec(object):
+    """
+    Encodes messages as json using orjson.
+    """
+    name = 'orjson'
+
+    @staticmethod
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+def _available():
+    codecs = [MarshalCodec]
+    if msgpack is not None:
+        codecs.append(MsgpackCodec)
+    if orjson is not None:
+        codecs.append(OrjsonCodec)
+    codecs.append(JsonCodec)
+    return codecs
+
+
+#: The codecs available on this interpreter, in order of preference.
+CODECS = _available()
+
+
+def available_codecs():
+    """
+    Returns the names of the codecs available on this interpreter, in order
+    of preference.
+    """
+    return [c.name for c in CODECS]
+
+
+def get_codec(name):
+    """
+    Returns the codec with the given name, falls back to :class:`JsonCodec`
+    if the codec is not available.
+    """
+    for c in CODECS:
+        if c.name == name:
+            return c
+    return JsonCodec
+
+
+def negotiate(data):
+    """
+    Handshake worker: picks the first codec of the client list that is
+    also available on the server.
+
+    :param data: Request data dict::
+        {
+            'codecs': list of codec names, ordered by preference
+        }
+    :returns: the name of the chosen codec
+    """
+    available = available_codecs()
+    for name in data.get('codecs', []):
+        if name in available:
+            return name
+    return JsonCodec.name
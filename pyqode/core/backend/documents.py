@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the server side document store.
+
+Instead of sending the whole text of the editor with every request, the client
+keeps a copy of each document in the backend up to date by sending the edits
+made to the document (see :class:`pyqode.core.api.client.DocumentSync`).
+Requests then only carry a document handle::
+
+    {
+        'id': unique id of the document,
+        'revision': revision of the document the request was made for,
+        'field': name of the request data field that receives the text
+    }
+
+The server resolves the handle before running the worker: the document text
+is put in ``data[field]`` (e.g. ``data['code']``), so that workers do not need
+to know whether the document was synced or sent in full. Workers that need
+more than the text can get the :class:`Document` with :func:`get_document`.
+
+If the revision of the stored document does not match the one of the handle
+(e.g. the backend was restarted), the server asks the client to resync the
+document and the client automatically sends the full text and resends the
+request.
+
+Edits are line based: a change replaces ``count`` lines starting at line
+``start`` with a list of new lines.
+
+The full text of very large documents is not sent in the update message, it
+is read from a memory mapped file (see :mod:`pyqode.core.backend.snapshots`).
+
+The store keeps the last changes applied to each document (see
+:meth:`DocumentStore.changes`), so that the indexes built from a document
+(e.g. :mod:`pyqode.core.backend.words`) can be updated from the changed lines
+instead of being rebuilt from the whole text.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import logging
+import threading
+
+from pyqode.core.backend import snapshots
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+#: Fully qualified name of the worker used to update a document.
+UPDATE_WORKER = 'pyqode.core.backend.documents.update_document'
+#: Fully qualified name of the worker used to drop a document.
+CLOSE_WORKER = 'pyqode.core.backend.documents.close_document'
+
+
+class OutOfSync(Exception):
+    """
+    Raised when the stored document does not match the requested revision.
+    """
+
+
+class Document(object):
+    """
+    A document stored in the backend.
+    """
+    #: Maximum number of updates kept in the history of the document
+    MAX_HISTORY = 64
+
+    def __init__(self, doc_id, path=None):
+        #: Unique id of the document
+        self.id = doc_id
+        #: Path of the document, may be None or empty for new documents.
+        self.path = path
+        #: Current revision, None if the document is out of sync.
+        self.revision = None
+        self._lines = ['']
+        self._text = ''
+        # list of (base revision, changes), see changes_since
+        self._history = []
+
+    @property
+    def text(self):
+        """ The text of the document """
+        if self._text is None:
+            self._text = '\n'.join(self._lines)
+        return self._text
+
+    @property
+    def lines(self):
+        """ The list of lines of the document (do not modify) """
+        return self._lines
+
+    def set_text(self, text, revision):
+        """
+        Replaces the document text.
+        """
+        self._lines = text.split('\n')
+        self._text = text
+        self.revision = revision
+        self._history = []
+
+    def apply(self, changes, revision):
+        """
+        Applies a list of line based changes.
+
+        :param changes: list of (start, count, lines) tuples: replace
+            ``count`` lines starting at ``start`` with ``lines``.
+        :param revision: revision of the document after the changes.
+        """
+        for start, count, lines in changes:
+            self._lines[start:start + count] = lines
+        self._text = None
+        self._history.append((self.revision, changes))
+        del self._history[:-self.MAX_HISTORY]
+        self.revision = revision
+
+    def changes_since(self, revision, target=None):
+        """
+        Returns the changes applied to the document since ``revision``.
+
+        :param target: revision the changes lead to, None for the current
+            revision.
+        :returns: the list of (start, count, lines) changes, in the order
+            they were applied, or None if the history does not go back to
+            ``revision`` or does not contain ``target`` (e.g. the text was
+            replaced).
+        """
+        if target is None:
+            target = self.revision
+        if revision is None or target is None:
+            return None
+        changes = []
+        if revision == target:
+            return changes
+        # the changes applied after the target revision are skipped
+        collecting = target == self.revision
+        for base_revision, base_changes in reversed(self._history):
+            if not collecting:
+                collecting = base_revision == target
+                continue
+            changes[:0] = base_changes
+            if base_revision == revision:
+                return changes
+        return None
+
+
+class DocumentStore(object):
+    """
+    Thread safe store of the documents synced by the clients.
+    """
+    def __init__(self):
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def update(self, data):
+        """
+        Updates a document, see :func:`update_document`.
+
+        :returns: The revision of the stored document, None if the update
+            could not be applied.
+        """
+        if data.get('snapshot') is not None:
+            # read outside of the lock, the copy of a large snapshot takes
+            # some time.
+            data = dict(data)
+            try:
+                data['text'] = snapshots.read_snapshot(data['snapshot'])
+            except (IOError, OSError, ValueError):
+                _logger().exception('failed to read document snapshot')
+                # the document is out of sync until the next update
+                data['text'] = None
+        with self._lock:
+            doc_id = data['id']
+            try:
+                doc = self._documents[doc_id]
+            except KeyError:
+                doc = self._documents[doc_id] = Document(doc_id)
+            doc.path = data.get('path')
+            if data.get('text') is not None:
+                doc.set_text(data['text'], data['revision'])
+            elif doc.revision is not None and \
+                    doc.revision == data.get('base_revision'):
+                doc.apply(data['changes'], data['revision'])
+                if len(doc.lines) != data.get('line_count', len(doc.lines)):
+                    doc.revision = None
+            else:
+                doc.revision = None
+            return doc.revision
+
+    def close(self, doc_id):
+        """
+        Removes a document from the store.
+        """
+        with self._lock:
+            self._documents.pop(doc_id, None)
+
+    def get(self, doc_id, revision=None):
+        """
+        Gets a document.
+
+        :param doc_id: id of the document
+        :param revision: expected revision, None to accept any revision.
+        :raises: OutOfSync if the document is unknown or if its revision does
+            not match ``revision``.
+        """
+        with self._lock:
+            try:
+                doc = self._documents[doc_id]
+            except KeyError:
+                raise OutOfSync(doc_id)
+            if doc.revision is None or (
+                    revision is not None and doc.revision != revision):
+                raise OutOfSync(doc_id)
+            return doc
+
+    def changes(self, doc_id, revision, target=None):
+        """
+        Gets the changes of a document since a revision, to update an index
+        of the document.
+
+        :param doc_id: id of the document
+        :param revision: revision of the index, None if the index is empty.
+        :param target: revision the index must be updated to (e.g. the
+            revision of the request that uses the index), None for the
+            current revision of the document.
+        :returns: a tuple (revision, changes, lines): the target revision,
+            the changes from ``revision`` to the target revision (see
+            :meth:`Document.changes_since`) and, if the changes are not
+            available, a copy of the lines of the document (None otherwise).
+        :raises: OutOfSync if the document is unknown or out of sync, or if
+            the index cannot be updated to ``target`` (the document has
+            changed since then and its history does not cover the update).
+        """
+        with self._lock:
+            try:
+                doc = self._documents[doc_id]
+            except KeyError:
+                raise OutOfSync(doc_id)
+            if doc.revision is None:
+                raise OutOfSync(doc_id)
+            if target is None:
+                target = doc.revision
+            changes = doc.changes_since(revision, target)
+            if changes is not None:
+                return target, changes, None
+            if target != doc.revision:
+                raise OutOfSync(doc_id)
+            return target, None, list(doc.lines)
+
+    def find(self, path):
+        """
+        Returns the list of documents whose path is ``path``.
+        """
+        with self._lock:
+            return [doc for doc in self._documents.values()
+                    if doc.path == path]
+
+    def documents(self):
+        """
+        Returns the list of stored documents.
+        """
+        with self._lock:
+            return list(self._documents.values())
+
+
+#: The document store of the backend process.
+store = DocumentStore()
+
+
+def get_document(handle):
+    """
+    Returns the :class:`Document` that corresponds to a document handle.
+
+    :raises: OutOfSync if the document is not available at the handle
+        revision.
+    """
+    return store.get(handle['id'], handle.get('revision'))
+
+
+def resolve(data):
+    """
+    Resolves the document handle of a request data: puts the document text in
+    the field specified by the handle. Does nothing if there is no handle.
+
+    :raises: OutOfSync
+    """
+    try:
+        handle = data['document']
+    except (KeyError, TypeError, IndexError):
+        return
+    data[handle.get('field', 'code')] = get_document(handle).text
+
+
+def update_document(data):
+    """
+    Worker that updates a document of the store.
+
+    :param data: Request data dict::
+        {
+            'id': document id,
+            'path': document path,
+            'revision': revision after the update,
+            # either the full text:
+            'text': document text,
+            # or the location of a snapshot of the full text (see
+            # pyqode.core.backend.snapshots):
+            'snapshot': {'path': file path, 'offset': offset, 'size': size},
+            # or the changes since base_revision:
+            'base_revision': revision the changes apply to,
+            'changes': list of (start, count, lines),
+            'line_count': number of lines after the update
+        }
+    :returns: the revision of the stored document, None if the document is
+        out of sync.
+    """
+    return store.update(data)
+
+
+def close_document(data):
+    """
+    Worker that removes a document from the store.
+
+    :param data: Request data dict::
+        {
+            'id': document id
+        }
+    """
+    store.close(data['id'])
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the find in files worker: it searches the files of a
+directory and streams the occurrences it finds::
+
+    editor.backend.send_request(
+        find_in_files, {'root': project_dir, 'sub': 'foo', 'regex': False,
+                        'case_sensitive': False, 'whole_word': True,
+                        'ignore_patterns': ['*.pyc', 'build/']},
+        on_receive=on_finished, on_partial=on_hits)
+
+The worker is flagged ``background``: the server runs the searches in a
+dedicated thread, a search over a large tree does not delay the other
+requests of the editor (see :class:`pyqode.core.backend.server.JsonServer`).
+
+The directory tree is walked in the server process, the ignored files and
+directories are skipped using the gitwildmatch patterns of
+:class:`pyqode.core.widgets.FileSystemTreeView` (with the pathspec package,
+a simpler fnmatch based matching is used if it is not available).
+
+The files are scanned by a pool of :data:`PROCESSES` processes (or in the
+server process if concurrent.futures is not available): each file is mapped
+in memory and searched with a compiled bytes regex, the files are never
+decoded, only the lines of the occurrences are.
+
+An occurrence is a list ``[path, line, column, preview]``: the line and
+column are 0 based (the column is a number of characters), the preview is
+the text of the line (truncated to :data:`PREVIEW_LENGTH` characters). The
+occurrences are sent by chunks, as soon as a batch of files has been
+scanned, the chunks are in no particular order.
+
+.. note:: Files are assumed to be utf-8 encoded. Case insensitive searches
+    only ignore the case of ascii characters.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import fnmatch
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from pyqode.core.backend import cancellation
+from pyqode.core.backend import words
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+try:
+    import pathspec
+except ImportError:
+    pathspec = None
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+#: Number of processes used to scan the files (0 to scan the files in the
+#: server process).
+PROCESSES = min(4, multiprocessing.cpu_count())
+#: Number of files scanned by a task of the process pool
+BATCH_SIZE = 32
+#: Files larger than this size (bytes) are not searched
+MAX_FILE_SIZE = 64 * 1024 * 1024
+#: Maximum length of the preview of an occurrence (characters)
+PREVIEW_LENGTH = 200
+#: Maximum number of compiled patterns kept in cache (in each process)
+CACHE_SIZE = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+# compiled patterns of the current process, by search parameters (LRU)
+_patterns = OrderedDict()
+_patterns_lock = threading.Lock()
+
+
+def ignore_matcher(patterns):
+    """
+    Returns a function that checks if a path (relative to the searched
+    directory, directories end with a ``/``) matches one of the ignore
+    patterns.
+
+    :param patterns: list of gitwildmatch patterns (.gitignore syntax).
+    """
+    patterns = [p.strip() for p in patterns if p.strip()]
+    if pathspec is not None:
+        spec = pathspec.PathSpec.from_lines('gitwildmatch', patterns)
+        return spec.match_file
+
+    def match(path):
+        name = path.rstrip('/').split('/')[-1]
+        for pattern in patterns:
+            if pattern.endswith('/'):
+                if not path.endswith('/'):
+                    continue
+                pattern = pattern[:-1]
+            if fnmatch.fnmatch(name, pattern) or \
+                    fnmatch.fnmatch(path.rstrip('/'), pattern.lstrip('/')):
+                return True
+        return False
+    return match
+
+
+def list_files(root, ignore_patterns=()):
+    """
+    Generator that yields the paths of the files of a directory tree that do
+    not match the ignore patterns.
+
+    :param root: the directory.
+    :param ignore_patterns: list of gitwildmatch patterns.
+    """
+    ignored = ignore_matcher(ignore_patterns)
+    for directory, dirs, files in os.walk(root):
+        rel_dir = os.path.relpath(directory, root).replace(os.sep, '/')
+        rel_dir = '' if rel_dir == '.' else rel_dir + '/'
+        dirs[:] = sorted(name for name in dirs
+                         if not ignored(rel_dir + name + '/'))
+        for name in sorted(files):
+            if not ignored(rel_dir + name):
+                yield os.path.join(directory, name)
+
+
+def compile_pattern(sub, regex=False, case_sensitive=False, whole_word=False):
+    """
+    Compiles the bytes regex of a search (the search is utf-8 encoded), the
+    last :data:`CACHE_SIZE` patterns are cached.
+
+    :raises: re.error if ``sub`` is not a valid regular expression.
+    """
+    key = (sub, regex, case_sensitive, whole_word)
+    with _patterns_lock:
+        try:
+            pattern = _patterns.pop(key)
+        except KeyError:
+            pass
+        else:
+            _patterns[key] = pattern
+            return pattern
+    data = sub.encode('utf-8')
+    expression = data if regex else re.escape(data)
+    if regex:
+        expression = b'(?:' + expression + b')'
+    if whole_word:
+        # the files are not decoded: '\r' ends the words of CRLF lines
+        separators = b''.join(re.escape(sep.encode('utf-8'))
+                              for sep in words.SEPARATORS) + b'\r'
+        expression = (b'(?<![^' + separators + b'])' + expression +
+                      b'(?![^' + separators + b'])')
+    flags = re.MULTILINE
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+    pattern = re.compile(expression, flags)
+    with _patterns_lock:
+        _patterns[key] = pattern
+        while len(_patterns) > CACHE_SIZE:
+            _patterns.popitem(last=False)
+    return pattern
+
+
+def scan_file(path, pattern, max_hits=None):
+    """
+    Returns the occurrences of a pattern in a file, see the module
+    documentation. Binary files (that contain null bytes) are skipped.
+
+    :param path: path of the file.
+    :param pattern: compiled bytes pattern (see :func:`compile_pattern`).
+    :param max_hits: maximum number of occurrences.
+    """
+    hits = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size or size > MAX_FILE_SIZE:
+            return hits
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data.find(b'\0', 0, 8192) != -1:
+                return hits
+            line = 0
+            # end of the text whose lines have been counted
+            counted = 0
+            for match in pattern.finditer(data):
+                start = match.start()
+                # the newlines of a match that spans several lines are
+                # counted with the text that precedes the next match
+                line += data[counted:start].count(b'\n')
+                counted = start
+                line_start = data.rfind(b'\n', 0, start) + 1
+                line_end = data.find(b'\n', start)
+                if line_end == -1:
+                    line_end = size
+                column = len(data[line_start:start].decode('utf-8', 'replace'))
+                preview = data[line_start:min(
+                    line_end, line_start + 4 * PREVIEW_LENGTH)].decode(
+                        'utf-8', 'replace').rstrip('\r')[:PREVIEW_LENGTH]
+                hits.append([path, line, column, preview])
+                if max_hits is not None and len(hits) >= max_hits:
+                    break
+        finally:
+            data.close()
+    return hits
+
+
+def scan_files(paths, search, max_hits=None):
+    """
+    Scans a batch of files (task of the process pool).
+
+    :param paths: the paths of the files.
+    :param search: the search parameters: (sub, regex, case_sensitive,
+        whole_word).
+    :param max_hits: maximum number of occurrences.
+    """
+    pattern = compile_pattern(*search)
+    hits = []
+    for path in paths:
+        try:
+            hits += scan_file(path, pattern, max_hits)
+        except (IOError, OSError, ValueError):
+            # unreadable file, or file removed since the directory walk
+            continue
+        if max_hits is not None and len(hits) >= max_hits:
+            break
+    return hits
+
+
+def _batches(paths):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _get_executor():
+    """
+    Returns the process pool (created on first use), None if the files are
+    scanned in the server process.
+    """
+    global _executor
+    if futures is None or not PROCESSES:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ProcessPoolExecutor(max_workers=PROCESSES)
+        return _executor
+
+
+def find_in_files(data):
+    """
+    Generator worker that searches the files of a directory, it yields the
+    occurrences by chunks (see the module documentation).
+
+    :param data: Request data dict::
+        {
+            'root': path of the directory to search,
+            'sub': string to search,
+            'regex': True to consider sub as a regular expression,
+            'case_sensitive': True to match case,
+            'whole_word': True to match whole words only,
+            'ignore_patterns': optional list of gitwildmatch patterns,
+            'max_results': optional maximum number of occurrences
+        }
+    :return: generator of lists of occurrences.
+    """
+    if not data['sub']:
+        return
+    search = (data['sub'], data.get('regex', False),
+              data.get('case_sensitive', False),
+              data.get('whole_word', False))
+    # invalid regular expressions are reported right away
+    compile_pattern(*search)
+    max_results = data.get('max_results')
+    token = cancellation.current_token()
+    batches = _batches(list_files(data['root'],
+                                  data.get('ignore_patterns', [])))
+    executor = _get_executor()
+    found = 0
+    if executor is None:
+        for batch in batches:
+            token.raise_if_cancelled()
+            hits = scan_files(batch, search, max_results)
+            if hits:
+                if max_results is not None:
+                    hits = hits[:max_results - found]
+                found += len(hits)
+                yield hits
+                if max_results is not None and found >= max_results:
+                    return
+        return
+    pending = set()
+    try:
+        while True:
+            # keep a few tasks queued per process
+            while len(pending) < 2 * PROCESSES:
+                try:
+                    batch = next(batches)
+                except StopIteration:
+                    break
+                pending.add(executor.submit(
+                    scan_files, batch, search, max_results))
+            if not pending:
+                return
+            done, pending = futures.wait(
+                pending, return_when=futures.FIRST_COMPLETED)
+            token.raise_if_cancelled()
+            hits = []
+            for future in done:
+                hits += future.result()
+            if hits:
+                if max_results is not None:
+                    hits = hits[:max_results - found]
+                found += len(hits)
+                yield hits
+                if max_results is not None and found >= max_results:
+                    return
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+find_in_files.background = True
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains :class:`LineIndex`, which converts the offsets of a text
+into line and column numbers.
+
+Workers that report positions found by a regex search on the whole text
+(checkers, annotations,...) build the index once per request instead of
+counting the newlines that precede each position::
+
+    index = lines.LineIndex(code)
+    for match in pattern.finditer(code):
+        line, column = index.position(match.start())
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import bisect
+import re
+
+_NEWLINE = re.compile('\n')
+
+
+class LineIndex(object):
+    """
+    Offsets of the start of the lines of a text (lines are separated by
+    ``\\n``).
+    """
+    def __init__(self, text):
+        #: Offset of the first character of each line
+        self.starts = [0]
+        self.starts += [match.end() for match in _NEWLINE.finditer(text)]
+
+    def line(self, offset):
+        """
+        Returns the line (0 based) that contains an offset.
+        """
+        return bisect.bisect_right(self.starts, offset) - 1
+
+    def position(self, offset):
+        """
+        Returns the ``(line, column)`` of an offset (0 based).
+        """
+        line = bisect.bisect_right(self.starts, offset) - 1
+        return line, offset - self.starts[line]
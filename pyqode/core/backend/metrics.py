@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the latency and throughput metrics of the backend.
+
+The server records, for each worker:
+
+    - ``queue_wait``: time (in seconds) the requests waited in the queue
+      before being run;
+    - ``exec_time``: time (in seconds) spent to run the worker (or to find
+      its results in the result cache);
+    - ``request_size``: size (in bytes) of the encoded requests;
+    - ``response_size``: size (in bytes) of the encoded responses (partial
+      responses of a streamed request included).
+
+The client records the round trip latency (``round_trip``, in seconds) of
+the requests, from the moment they are issued to the moment their callback
+is called.
+
+Each metric is recorded in a :class:`Histogram` with fixed, exponential
+buckets: recording a value is cheap and the memory used does not depend on
+the number of requests. The statistics of the server can be requested with
+the :data:`METRICS_WORKER` worker, those of both sides with
+:meth:`pyqode.core.managers.BackendManager.stats`::
+
+    def on_stats(stats):
+        completion = stats['client']['workers'].get(
+            'pyqode.core.backend.workers.CodeCompletionWorker')
+        if completion and completion['round_trip']['p95'] > 0.2:
+            print('code completion is slow')
+
+    editor.backend.stats(on_receive=on_stats)
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import bisect
+import threading
+
+
+#: Name of the worker used to get the metrics of the server (handled by the
+#: server itself). The request data may set ``'reset': True`` to clear the
+#: metrics once they have been sent.
+METRICS_WORKER = 'pyqode.core.backend.metrics.stats'
+
+#: Time spent by a request in the queue (server)
+QUEUE_WAIT = 'queue_wait'
+#: Time spent to run a worker (server)
+EXEC_TIME = 'exec_time'
+#: Size of the encoded request (server)
+REQUEST_SIZE = 'request_size'
+#: Size of the encoded response (server)
+RESPONSE_SIZE = 'response_size'
+#: Time between a request and its results (client)
+ROUND_TRIP = 'round_trip'
+
+#: Upper bounds of the buckets of the durations: 100µs to ~55min.
+TIME_BUCKETS = [0.0001 * 2 ** i for i in range(25)]
+#: Upper bounds of the buckets of the sizes: 64 bytes to 1GB.
+SIZE_BUCKETS = [64 * 2 ** i for i in range(25)]
+
+#: Buckets used for each metric
+BUCKETS = {
+    QUEUE_WAIT: TIME_BUCKETS,
+    EXEC_TIME: TIME_BUCKETS,
+    ROUND_TRIP: TIME_BUCKETS,
+    REQUEST_SIZE: SIZE_BUCKETS,
+    RESPONSE_SIZE: SIZE_BUCKETS,
+}
+
+
+class Histogram(object):
+    """
+    Histogram of the values of a metric, with fixed buckets.
+
+    The values greater than the last bound are counted in an overflow bucket.
+    Percentiles are estimated from the buckets: the estimate is the upper
+    bound of the bucket of the percentile (capped by the maximum value).
+
+    This class is not thread safe, see :class:`Metrics`.
+    """
+    def __init__(self, bounds):
+        #: Upper bounds of the buckets, in increasing order
+        self.bounds = bounds
+        #: Number of values per bucket (the last one is the overflow bucket)
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """
+        Records a value.
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Returns an estimate of a percentile of the recorded values, None if
+        no value has been recorded.
+
+        :param percent: the percentile, between 0 and 100.
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        cumulated = 0
+        for i, count in enumerate(self.counts):
+            cumulated += count
+            if count and cumulated >= rank:
+                if i == len(self.bounds):
+                    return self.max
+                return min(self.bounds[i], self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Returns the statistics of the histogram::
+
+            {
+                'count': number of values,
+                'sum': sum of the values,
+                'min': minimum value,
+                'max': maximum value,
+                'mean': mean value,
+                'p50': median (estimate),
+                'p95': 95th percentile (estimate),
+                'p99': 99th percentile (estimate),
+                'buckets': [[upper bound, count], ...] (non empty buckets
+                            only, the bound of the overflow bucket is None)
+            }
+        """
+        buckets = []
+        for i, count in enumerate(self.counts):
+            if count:
+                bound = self.bounds[i] if i < len(self.bounds) else None
+                buckets.append([bound, count])
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': float(self.total) / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': buckets
+        }
+
+
+class Metrics(object):
+    """
+    Thread safe set of histograms, per worker and per metric.
+    """
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, worker_name, metric, value):
+        """
+        Records the value of a metric for a worker.
+
+        :param worker_name: fully qualified name of the worker.
+        :param metric: name of the metric (see :data:`BUCKETS`)
+        :param value: the value to record.
+        """
+        key = (worker_name, metric)
+        with self._lock:
+            try:
+                histogram = self._histograms[key]
+            except KeyError:
+                histogram = Histogram(BUCKETS.get(metric, TIME_BUCKETS))
+                self._histograms[key] = histogram
+            histogram.record(value)
+
+    def reset(self):
+        """ Clears the recorded values """
+        with self._lock:
+            self._histograms.clear()
+
+    def stats(self):
+        """
+        Returns the statistics of the histograms, by worker::
+
+            {
+                worker name: {
+                    'calls': number of calls,
+                    metric name: histogram statistics (see
+                                 :meth:`Histogram.to_dict`),
+                    ...
+                },
+                ...
+            }
+
+        The number of calls is the largest count of the worker histograms.
+        """
+        ret_val = {}
+        with self._lock:
+            for (worker_name, metric), histogram in self._histograms.items():
+                stats = ret_val.setdefault(worker_name, {'calls': 0})
+                stats[metric] = histogram.to_dict()
+                stats['calls'] = max(stats['calls'], histogram.count)
+        return ret_val
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the result cache of the pure workers.
+
+Many requests are sent again for a text that did not change (folding, focus
+changes, clones,...). Workers whose results only depend on their data can
+declare themselves pure::
+
+    def outline(data):
+        ...
+    outline.pure = True
+
+    class MyChecker(object):
+        pure = True
+
+The results of pure workers are cached on both sides of the connection,
+keyed by the worker name and a hash of the request data. The requests on a
+synced document (see :mod:`pyqode.core.backend.documents`) are keyed by the
+document id and revision instead of its text, which is not hashed:
+
+    - the client (see :class:`pyqode.core.api.client.JsonTcpClient`) answers
+      a request from its cache without sending it to the server;
+    - the server answers a request from its cache without running the worker.
+
+Both caches are LRU caches bounded by their number of entries. Their
+statistics are given by :meth:`ResultCache.stats`; the statistics of the
+server cache can be requested with the :data:`STATS_WORKER` worker.
+
+.. note:: Cached results are shared by all the requests that hit the cache,
+    callbacks must not modify them.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import collections
+import hashlib
+import json
+import threading
+
+
+#: Name of the worker used to get the statistics of the server result cache
+#: (handled by the server itself).
+STATS_WORKER = 'pyqode.core.backend.results.stats'
+
+
+def is_pure(worker):
+    """
+    Tells whether a worker class or function declared itself pure.
+    """
+    return bool(getattr(worker, 'pure', False))
+
+
+def content_key(worker_name, data):
+    """
+    Returns the cache key of a request.
+
+    :param worker_name: fully qualified name of the worker.
+    :param data: request data. If it contains the handle of a synced
+        document, the document text is identified by the id and revision of
+        the handle (the text field is ignored).
+    :returns: the key, or None if the data cannot be hashed.
+    """
+    document = None
+    if isinstance(data, dict) and 'document' in data:
+        handle = data['document']
+        data = dict(data)
+        del data['document']
+        if isinstance(handle, dict) and handle.get('revision') is not None:
+            data.pop(handle.get('field', 'code'), None)
+            document = (handle['id'], handle['revision'])
+    try:
+        content = json.dumps(data, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    return (worker_name, document,
+            hashlib.sha1(content.encode('utf-8')).hexdigest())
+
+
+class ResultCache(object):
+    """
+    Thread safe LRU cache of worker results.
+    """
+    def __init__(self, max_size=64):
+        #: Maximum number of cached results, 0 to disable the cache.
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached results for a key.
+
+        :raises: KeyError if the results are not cached.
+        """
+        with self._lock:
+            try:
+                results = self._results.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            # most recently used results are at the end
+            self._results[key] = results
+            self.hits += 1
+            return results
+
+    def put(self, key, results):
+        """
+        Caches the results of a request, evicts the least recently used
+        results if the cache is full.
+        """
+        if not self.max_size or key is None:
+            return
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = results
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Removes all the cached results """
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+    def stats(self):
+        """
+        Returns the statistics of the cache::
+
+            {
+                'size': number of cached results,
+                'max_size': maximum number of cached results,
+                'hits': number of requests answered from the cache,
+                'misses': number of lookups that missed,
+                'evictions': number of results evicted,
+                'hit_rate': hits / (hits + misses), 0 if no lookup
+            }
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._results),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0
+            }
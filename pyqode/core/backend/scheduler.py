@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the priority queue used by the server to schedule the
+requests.
+
+A request may specify its priority in an optional ``priority`` field::
+
+    {
+        'request_id': ...,
+        'worker': ...,
+        'data': ...,
+        'priority': 'interactive'
+    }
+
+Available priorities (from the highest to the lowest):
+
+    - ``interactive``: the user is waiting for the results (code completion,
+      search,...)
+    - ``normal``: the default priority
+    - ``background``: results that can wait (checkers, outline,...)
+
+The server runs the queued request with the highest priority first, in
+arrival order for a given priority. To prevent the starvation of the low
+priority requests, a request that waited more than ``starvation_delay``
+seconds is run before the requests of higher priority.
+
+The queue statistics can be requested with the :data:`STATS_WORKER` worker,
+the server answers with the statistics of its queue (see
+:meth:`RequestQueue.stats`).
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import collections
+import threading
+import time
+
+
+#: Highest priority, for requests whose results the user is waiting for.
+PRIORITY_INTERACTIVE = 'interactive'
+#: Default priority.
+PRIORITY_NORMAL = 'normal'
+#: Lowest priority, for requests whose results can wait.
+PRIORITY_BACKGROUND = 'background'
+#: The priorities, from the highest to the lowest.
+PRIORITIES = [PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BACKGROUND]
+
+#: Name of the worker used to get the queue statistics (handled by the
+#: server itself).
+STATS_WORKER = 'pyqode.core.backend.scheduler.stats'
+
+
+class RequestQueue(object):
+    """
+    Thread safe priority queue of the requests waiting to be run.
+    """
+    def __init__(self, starvation_delay=1.0):
+        #: Maximum time (in seconds) a request waits before being run
+        #: whatever its priority (if a thread is available).
+        self.starvation_delay = starvation_delay
+        self._queues = dict((p, collections.deque()) for p in PRIORITIES)
+        self._stats = dict((p, {'max_depth': 0, 'dispatched': 0,
+                                'promoted': 0, 'wait_time': 0.0})
+                           for p in PRIORITIES)
+        self._lock = threading.Lock()
+
+    def put(self, priority, item):
+        """
+        Queues an item.
+
+        :param priority: priority of the item, unknown priorities are turned
+            into :data:`PRIORITY_NORMAL`.
+        """
+        if priority not in self._queues:
+            priority = PRIORITY_NORMAL
+        with self._lock:
+            queue = self._queues[priority]
+            queue.append((time.time(), item))
+            stats = self._stats[priority]
+            stats['max_depth'] = max(stats['max_depth'], len(queue))
+
+    def pop(self, accept=None):
+        """
+        Removes and returns the next item to run.
+
+        :param accept: optional function called with the queued items, from
+            the next one to run to the last one, until it returns True. The
+            rejected items stay queued (e.g. the requests of a worker that
+            cannot run more requests).
+        :raises: IndexError if the queue is empty or if no item is accepted.
+        """
+        with self._lock:
+            now = time.time()
+            pending = [p for p in PRIORITIES if self._queues[p]]
+            if not pending:
+                raise IndexError('pop from an empty queue')
+            # starvation protection: the request that waited the longest is
+            # run first if it waited too long.
+            oldest = min(pending, key=lambda p: self._queues[p][0][0])
+            starved = (oldest != pending[0] and
+                       now - self._queues[oldest][0][0] >
+                       self.starvation_delay)
+            candidates = [(oldest, 0, True)] if starved else []
+            for priority in pending:
+                first = 1 if starved and priority == oldest else 0
+                candidates += [(priority, i, False) for i in range(
+                    first, len(self._queues[priority]))]
+            for priority, i, promoted in candidates:
+                queue = self._queues[priority]
+                queued_time, item = queue[i]
+                if accept is None or accept(item):
+                    break
+            else:
+                raise IndexError('no accepted item')
+            del queue[i]
+            stats = self._stats[priority]
+            stats['dispatched'] += 1
+            stats['wait_time'] += now - queued_time
+            if promoted:
+                stats['promoted'] += 1
+            return item
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def stats(self):
+        """
+        Returns the statistics of the queue, per priority::
+
+            {
+                'interactive': {
+                    'depth': number of queued requests,
+                    'max_depth': maximum number of queued requests,
+                    'dispatched': number of requests run so far,
+                    'promoted': number of requests run before requests of
+                        higher priority because they waited too long,
+                    'wait_time': total time the run requests waited (s)
+                },
+                'normal': {...},
+                'background': {...}
+            }
+        """
+        with self._lock:
+            ret_val = {}
+            for priority in PRIORITIES:
+                stats = dict(self._stats[priority])
+                stats['depth'] = len(self._queues[priority])
+                ret_val[priority] = stats
+            return ret_val
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the text search engine used by the
+:func:`pyqode.core.backend.workers.findall` workers.
+
+A search is compiled once into a :class:`Matcher` (see :func:`compile_search`,
+the matchers are kept in a small LRU cache) that scans the text with the
+regex engine:
+
+    - plain text searches use the fast literal search of the regex engine,
+      case insensitive ones search a lower case copy of the text (like
+      ``str.find`` did);
+    - whole word searches check the end of the occurrences in the regex
+      (lookahead), and only the start of the occurrences in python.
+
+Packed results
+--------------
+
+Large result sets are expensive to encode as a list of ``[start, end]``
+pairs. A request that sets ``'packed': True`` gets a flat list of integers
+instead, made of the gap between the start of an occurrence and the end of
+the previous one (the start of the text for the first occurrence), followed
+by the length of the occurrence::
+
+    [(2, 5), (10, 13)] -> [2, 3, 5, 3]
+
+The numbers are small, which keeps the encoded message short. The chunks of a
+streamed search continue the gaps of the previous chunks, so that the chunks
+can be concatenated. Use :func:`unpack` to get the ``(start, end)`` tuples.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import operator
+import re
+import threading
+from collections import OrderedDict
+
+from pyqode.core.backend import words
+
+try:
+    from itertools import imap
+except ImportError:
+    # python 3
+    imap = map
+
+
+#: Maximum number of compiled searches kept in cache
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+_SEPARATORS = frozenset(words.SEPARATORS)
+# the next character is a word separator, or the end of the text
+_WORD_END = '(?![^%s])' % ''.join(re.escape(sep) for sep in words.SEPARATORS)
+# the previous character is a word separator, or the start of the text
+_WORD_START = '(?<![^%s])' % ''.join(
+    re.escape(sep) for sep in words.SEPARATORS)
+
+_start = operator.methodcaller('start')
+_span = operator.methodcaller('span')
+
+
+def _overlaps(sub):
+    """ Checks if two occurrences of ``sub`` may overlap """
+    return any(sub[i:] == sub[:len(sub) - i] for i in range(1, len(sub)))
+
+
+class Matcher(object):
+    """
+    A compiled search, see :func:`compile_search`.
+    """
+    def __init__(self, sub, regex=False, case_sensitive=False,
+                 whole_word=False):
+        #: Length of the occurrences, None for a regular expression.
+        self.length = None if regex else len(sub)
+        self._whole_word = whole_word
+        self._overlaps = False
+        # a few characters have a longer lower case (e.g. the dotted
+        # capital I), the regex engine ignores the case of such searches
+        self._lower = (not regex and not case_sensitive and
+                       len(sub.lower()) == len(sub))
+        flags = re.MULTILINE
+        if not case_sensitive and not self._lower:
+            flags |= re.IGNORECASE
+        if regex:
+            expression = '(?:%s)' % sub
+            if whole_word:
+                expression = _WORD_START + expression + _WORD_END
+        else:
+            if self._lower:
+                sub = sub.lower()
+            expression = re.escape(sub)
+            if whole_word:
+                expression += _WORD_END
+            else:
+                # every occurrence is reported, even if they overlap (e.g.
+                # 'aa' in 'aaa')
+                self._overlaps = _overlaps(sub)
+        self._pattern = re.compile(expression, flags)
+
+    def starts(self, string):
+        """
+        Returns an iterator over the start of the occurrences of a plain
+        text search (see :attr:`length`).
+        """
+        if self._lower:
+            lower_string = string.lower()
+            # the offsets in the lower case copy must match the text
+            if len(lower_string) == len(string):
+                string = lower_string
+            else:
+                return self._ignore_case(string)
+        return self._starts(self._pattern, string)
+
+    def spans(self, string):
+        """
+        Returns an iterator over the ``(start, end)`` span of the
+        occurrences.
+        """
+        if self.length is None:
+            return imap(_span, self._pattern.finditer(string))
+        length = self.length
+        return ((start, start + length) for start in self.starts(string))
+
+    def _ignore_case(self, string):
+        return self._starts(re.compile(
+            self._pattern.pattern, self._pattern.flags | re.IGNORECASE),
+            string)
+
+    def _starts(self, pattern, string):
+        if self._overlaps:
+            return self._overlapping_starts(pattern, string)
+        starts = imap(_start, pattern.finditer(string))
+        if self._whole_word:
+            return self._word_starts(string, starts)
+        return starts
+
+    @staticmethod
+    def _overlapping_starts(pattern, string):
+        search = pattern.search
+        match = search(string)
+        while match is not None:
+            start = match.start()
+            yield start
+            match = search(string, start + 1)
+
+    @staticmethod
+    def _word_starts(string, starts):
+        separators = _SEPARATORS
+        for start in starts:
+            if not start or string[start - 1] in separators:
+                yield start
+
+
+def compile_search(sub, regex=False, case_sensitive=False, whole_word=False):
+    """
+    Returns the compiled :class:`Matcher` of a search (cached).
+
+    :param sub: the searched text or regular expression.
+    :param regex: True if ``sub`` is a regular expression.
+    :param case_sensitive: True to match case, False to ignore case.
+    :param whole_word: True to match whole words only: the occurrence must
+        be surrounded by word separators (or by the start/end of the text).
+    :raises: re.error if ``sub`` is not a valid regular expression.
+    """
+    key = (sub, regex, case_sensitive, whole_word)
+    with _lock:
+        try:
+            matcher = _cache.pop(key)
+        except KeyError:
+            pass
+        else:
+            _cache[key] = matcher
+            return matcher
+    matcher = Matcher(sub, regex, case_sensitive, whole_word)
+    with _lock:
+        _cache[key] = matcher
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return matcher
+
+
+def finditer(string, sub, regex=False, case_sensitive=False,
+             whole_word=False):
+    """
+    Returns an iterator over the ``(start, end)`` span of the occurrences of
+    ``sub`` in ``string``. See :func:`compile_search` for the parameters.
+    """
+    if not sub:
+        return iter([])
+    return compile_search(sub, regex, case_sensitive, whole_word).spans(
+        string)
+
+
+def pack(spans, end=0):
+    """
+    Packs a list of spans (see the module documentation).
+
+    :param spans: list of ``(start, end)`` tuples, in increasing order.
+    :param end: end of the occurrence that precedes the first span (0 for
+        the first chunk of a search).
+    :returns: the flat list of integers.
+    """
+    packed = []
+    append = packed.append
+    for start, stop in spans:
+        append(start - end)
+        append(stop - start)
+        end = stop
+    return packed
+
+
+def pack_starts(starts, length, end=0):
+    """
+    Packs the occurrences of a plain text search, given by their start.
+
+    :param starts: list of the start of the occurrences, in increasing
+        order.
+    :param length: length of the occurrences.
+    :param end: end of the occurrence that precedes the first one.
+    :returns: the flat list of integers.
+    """
+    if not starts:
+        return []
+    packed = [length] * (2 * len(starts))
+    packed[0::2] = [start - previous - length for previous, start in zip(
+        [end - length] + starts, starts)]
+    return packed
+
+
+def unpack(packed, end=0):
+    """
+    Unpacks the result of a packed search.
+
+    A list of spans (the result of a request that does not set ``packed``)
+    is returned as a list of tuples.
+
+    :param packed: the flat list of integers.
+    :param end: end of the occurrence that precedes the first packed span
+        (to unpack the chunks of a streamed search one by one).
+    :returns: the list of ``(start, end)`` tuples.
+    """
+    if packed and isinstance(packed[0], (list, tuple)):
+        return [tuple(span) for span in packed]
+    spans = []
+    append = spans.append
+    for i in range(0, len(packed) - 1, 2):
+        start = end + packed[i]
+        end = start + packed[i + 1]
+        append((start, end))
+    return spans
@@ -3,10 +3,13 @@
 This module contains the server socket definition.
 """
 import argparse
+import collections
+import contextlib
+import functools
 import inspect
 import logging
-import json
 import os
+import socket
 import struct
 import sys
 import time
@@ -21,6 +24,26 @@ except ImportError:
     import SocketServer as socketserver
     PY33 = False
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from concurrent import futures
+except ImportError:
+    # python 2 without the futures backport: only the serial dispatch mode is
+    # available.
+    futures = None
+
+from pyqode.core.backend import batch
+from pyqode.core.backend import cancellation
+from pyqode.core.backend import codec
+from pyqode.core.backend import documents
+from pyqode.core.backend import metrics
+from pyqode.core.backend import results
+from pyqode.core.backend import scheduler
+
 
 def _logger():
     """ Returns the module's logger """
@@ -29,6 +52,33 @@ def _logger():
 
 HEARTBEAT_DELAY = 60  # delay max without heartbeat signal
 
+#: Requests are handled one at a time, in arrival order, by a dedicated
+#: thread (default).
+DISPATCH_SERIAL = 'serial'
+#: Requests are handled concurrently by a pool of threads (and optionally a
+#: pool of processes for the workers flagged as ``cpu_bound``).
+DISPATCH_CONCURRENT = 'concurrent'
+
+#: The server listens on a local tcp port (default).
+TRANSPORT_TCP = 'tcp'
+#: The server listens on a unix domain socket (unix platforms only).
+TRANSPORT_UNIX = 'unix'
+
+#: Server based on socketserver, one thread per connection (default).
+SERVER_THREADS = 'threads'
+#: Server based on asyncio streams (python 3.5+), see
+#: :mod:`pyqode.core.backend.asyncio_server`.
+SERVER_ASYNCIO = 'asyncio'
+
+#: Optional protocol features supported by the server, announced to the
+#: client in the handshake response.
+FEATURES = ['documents', 'cancel', 'batch', 'stream', 'snapshot']
+
+#: Workers run directly by the connection thread, in arrival order, whatever
+#: the dispatch mode: they must be fast and thread safe.
+INLINE_WORKERS = [documents.UPDATE_WORKER, documents.CLOSE_WORKER,
+                  cancellation.CANCEL_WORKER]
+
 
 def import_class(klass):
     """
@@ -52,28 +102,812 @@ def import_class(klass):
         return klass
 
 
-class JsonServer(socketserver.TCPServer):
+class _WorkerInstance(object):
+    """
+    A persistent worker instance cached by :class:`WorkerCache`.
+    """
+    def __init__(self, name, worker_class):
+        self.name = name
+        self.worker_class = worker_class
+        self.instance = None
+        #: Number of requests using the instance
+        self.in_use = 0
+        #: Memory used by the instance, as reported by its ``memory_usage``
+        #: method.
+        self.memory = 0
+        #: Held while the instance is set up or torn down
+        self.lock = threading.Lock()
+
+
+class WorkerCache(object):
+    """
+    Caches the workers used by the server.
+
+    Worker classes and functions are imported once. By default, worker
+    classes are still instantiated for every request. Workers that need to
+    keep a state between requests (an index, a parsed dictionary, a loaded
+    model,...) can set ``persistent = True``: the instance is then created
+    once and reused, with the following lifecycle:
+
+        - ``setup()`` (optional): called once, after the instance has been
+          created and before its first request.
+        - ``__call__(data)``: called for every request.
+        - ``teardown()`` (optional): called when the instance is evicted from
+          the cache or when the server is closed.
+
+    The number of persistent instances is bounded (``max_instances``) and so
+    is the memory they use (``max_memory``), as reported by their optional
+    ``memory_usage()`` method (number of bytes, called after each request).
+    When a bound is exceeded, the least recently used instances that are not
+    running a request are torn down. E.g.::
+
+        class SpellCheckWorker(object):
+            persistent = True
+
+            def setup(self):
+                self.dictionary = load_dictionary()
+
+            def __call__(self, data):
+                ...
+
+            def teardown(self):
+                self.dictionary = None
+
+            def memory_usage(self):
+                return 50 * 1024 * 1024
+
+    .. note:: A persistent instance is shared by all the requests: if the
+        worker sets ``max_concurrency`` > 1, its ``__call__`` method must be
+        thread safe.
+    """
+    def __init__(self, max_instances=16, max_memory=512 * 1024 * 1024):
+        #: Maximum number of persistent instances
+        self.max_instances = max_instances
+        #: Maximum memory used by the persistent instances, in bytes.
+        self.max_memory = max_memory
+        self._workers = {}
+        self._instances = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, worker_name):
+        """
+        Returns the worker class or function, imports it the first time.
+
+        :raises: ImportError if the worker cannot be imported.
+        """
+        try:
+            return self._workers[worker_name]
+        except KeyError:
+            worker = import_class(worker_name)
+            self._workers[worker_name] = worker
+            return worker
+
+    @contextlib.contextmanager
+    def instance(self, worker_name, worker=None):
+        """
+        Context manager that gives the callable that runs a request: the
+        worker function, a new instance of the worker class or the cached
+        instance of a persistent worker.
+
+        :param worker_name: fully qualified name of the worker.
+        :param worker: the worker class or function, resolved if None.
+        """
+        if worker is None:
+            worker = self.resolve(worker_name)
+        if not inspect.isclass(worker):
+            yield worker
+        elif not getattr(worker, 'persistent', False):
+            yield worker()
+        else:
+            entry = self._acquire(worker_name, worker)
+            try:
+                yield entry.instance
+            finally:
+                self._release(entry)
+
+    def instances(self):
+        """
+        Returns the list of the names of the cached persistent instances, from
+        the least to the most recently used.
+        """
+        with self._lock:
+            return list(self._instances.keys())
+
+    def memory_usage(self):
+        """
+        Returns the memory used by the cached persistent instances.
+        """
+        with self._lock:
+            return sum(e.memory for e in self._instances.values())
+
+    def clear(self):
+        """
+        Tears down all the persistent instances that are not in use.
+        """
+        with self._lock:
+            entries = [e for e in self._instances.values() if not e.in_use]
+            for entry in entries:
+                del self._instances[entry.name]
+        for entry in entries:
+            self._teardown(entry)
+
+    def _acquire(self, worker_name, worker):
+        with self._lock:
+            entry = self._instances.pop(worker_name, None)
+            if entry is None or entry.worker_class is not worker:
+                entry = _WorkerInstance(worker_name, worker)
+            # most recently used instances are at the end
+            self._instances[worker_name] = entry
+            entry.in_use += 1
+        with entry.lock:
+            if entry.instance is None:
+                _logger().log(1, 'setting up worker %s', worker_name)
+                try:
+                    instance = worker()
+                    setup = getattr(instance, 'setup', None)
+                    if setup is not None:
+                        setup()
+                except Exception:
+                    with self._lock:
+                        entry.in_use -= 1
+                        if self._instances.get(worker_name) is entry:
+                            del self._instances[worker_name]
+                    raise
+                entry.instance = instance
+        return entry
+
+    def _release(self, entry):
+        memory_usage = getattr(entry.instance, 'memory_usage', None)
+        if memory_usage is not None:
+            try:
+                entry.memory = memory_usage()
+            except Exception:
+                _logger().exception('failed to get the memory usage of %s',
+                                    entry.name)
+        with self._lock:
+            entry.in_use -= 1
+            evicted = self._evict()
+        for evicted_entry in evicted:
+            self._teardown(evicted_entry)
+
+    def _evict(self):
+        """
+        Removes the least recently used idle instances until the cache is
+        within its bounds. Must be called with the lock held.
+
+        :returns: the list of evicted entries, to tear down.
+        """
+        evicted = []
+        memory = sum(e.memory for e in self._instances.values())
+        for entry in list(self._instances.values()):
+            if (len(self._instances) <= self.max_instances and
+                    memory <= self.max_memory):
+                break
+            if entry.in_use:
+                continue
+            del self._instances[entry.name]
+            memory -= entry.memory
+            evicted.append(entry)
+        return evicted
+
+    @staticmethod
+    def _teardown(entry):
+        _logger().log(1, 'tearing down worker %s', entry.name)
+        with entry.lock:
+            teardown = getattr(entry.instance, 'teardown', None)
+            entry.instance = None
+            if teardown is not None:
+                try:
+                    teardown()
+                except Exception:
+                    _logger().exception('failed to tear down worker %s',
+                                        entry.name)
+
+
+#: Worker cache of the process pool processes.
+_process_workers = None
+
+
+def _run_worker(worker_name, data):
+    """
+    Imports and runs a worker. Used to run ``cpu_bound`` workers in the
+    process pool (the worker is passed by name since it must be picklable).
+    """
+    global _process_workers
+    if _process_workers is None:
+        _process_workers = WorkerCache()
+    with _process_workers.instance(worker_name) as worker:
+        ret_val = worker(data)
+        if inspect.isgenerator(ret_val):
+            # generators cannot be sent back to the server process
+            ret_val = consume_chunks(ret_val)
+        return ret_val
+
+
+def consume_chunks(chunks, token=None, on_partial=None):
+    """
+    Runs a generator worker until it is exhausted.
+
+    :param chunks: the generator returned by the worker, it yields lists of
+        results.
+    :param token: optional cancellation token, checked after each chunk.
+    :param on_partial: optional callback called with each chunk. If None, the
+        chunks are concatenated.
+    :returns: the concatenated chunks, or an empty list if ``on_partial`` is
+        set.
+    """
+    results = []
+    try:
+        for chunk in chunks:
+            if token is not None:
+                token.raise_if_cancelled()
+            if on_partial is None:
+                results.extend(chunk)
+            elif chunk:
+                on_partial(chunk)
+    finally:
+        chunks.close()
+    return results
+
+
+class _SerialExecutor(object):
+    """
+    Runs the submitted calls one at a time, in submission order, in a
+    dedicated thread (the connection threads keep reading the requests, e.g.
+    to process cancellations, while a worker runs).
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        self._queue.put((fn, args))
+
+    def shutdown(self, wait=True):
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            fn, args = item
+            fn(*args)
+
+
+class RequestDispatcher(object):
+    """
+    Transport independent part of the backend server: dispatches the messages
+    received on a connection to the workers.
+
+    This is the base class of :class:`JsonServer` and of
+    :class:`pyqode.core.backend.asyncio_server.AsyncJsonServer`, which only
+    implement the connections: they decode the messages and pass them to
+    :meth:`handle_message`, with a function that sends a response on the
+    connection.
+    """
+    def setup_dispatcher(self, args):
+        """
+        Sets up the queue, the executors and the caches of the server.
+
+        :param args: Argument parser args (see :func:`default_parser`).
+        :returns: the dispatch mode
+        """
+        self.reset_heartbeat()
+        #: Tcp port or unix domain socket path the server listens on
+        self.port = args.port
+        #: Transport of the server: tcp or unix
+        self.transport = getattr(args, 'transport', TRANSPORT_TCP)
+        self.timeout = HEARTBEAT_DELAY
+        #: Executor that runs the workers: a single thread in serial mode, a
+        #: thread pool in concurrent mode.
+        self.executor = None
+        #: Process pool used for cpu bound workers in concurrent mode.
+        self.process_executor = None
+        #: Thread that runs the background workers, created on first use.
+        self.background_executor = None
+        self._background_lock = threading.Lock()
+        # number of running requests of each worker (see run_next)
+        self._limits = {}
+        self._limits_lock = threading.Lock()
+        # number of run_next calls that found no request to run
+        self._deferred = 0
+        self._running = 0
+        self._running_lock = threading.Lock()
+        #: Requests waiting for a thread, by priority.
+        self.queue = scheduler.RequestQueue(
+            starvation_delay=getattr(args, 'starvation_delay', 1.0))
+        #: Cache of the workers (see :class:`WorkerCache`)
+        self.workers = WorkerCache(
+            max_instances=getattr(args, 'worker_instances', 16),
+            max_memory=getattr(args, 'worker_memory', 512) * 1024 * 1024)
+        #: Results of the pure workers (see
+        #: :mod:`pyqode.core.backend.results`)
+        self.results = results.ResultCache(
+            max_size=getattr(args, 'result_cache', 64))
+        #: Latency and throughput metrics of the workers (see
+        #: :mod:`pyqode.core.backend.metrics`)
+        self.metrics = metrics.Metrics()
+        #: Records the handled messages if ``--record`` is set (see
+        #: :mod:`pyqode.core.backend.traces`)
+        self.recorder = None
+        if getattr(args, 'record', None):
+            from pyqode.core.backend import traces
+            self.recorder = traces.TraceRecorder(args.record)
+        #: Word index of the workspace if ``--workspace`` is set (see
+        #: :mod:`pyqode.core.backend.workspace`)
+        self.workspace = None
+        if getattr(args, 'workspace', None):
+            from pyqode.core.backend import workspace
+            self.workspace = workspace.start(
+                args.workspace, getattr(args, 'workspace_cache', None),
+                getattr(args, 'workspace_memory', 64) * 1024 * 1024)
+        dispatch = getattr(args, 'dispatch', DISPATCH_SERIAL)
+        if dispatch == DISPATCH_CONCURRENT and futures is None:
+            print('concurrent.futures not available, using serial dispatch')
+            dispatch = DISPATCH_SERIAL
+        if dispatch == DISPATCH_CONCURRENT:
+            processes = getattr(args, 'processes', 0)
+            if processes:
+                self.process_executor = futures.ProcessPoolExecutor(
+                    max_workers=processes)
+        return dispatch
+
+    def submit(self, fn):
+        """
+        Runs ``fn`` in the executor.
+        """
+        self.executor.submit(fn)
+
+    def handle_message(self, data, send, size=None):
+        """
+        Handles a message received on a connection (the codec handshake is
+        handled by the connection).
+
+        :param data: the decoded message.
+        :param send: function that sends a response on the connection, it
+            may be called from any thread. It returns the number of bytes
+            sent (or None).
+        :param size: size of the encoded message, recorded in the metrics.
+        """
+        if self.recorder is not None:
+            send = self.recorder.record_request(data, send)
+        worker = data.get('worker')
+        if worker == metrics.METRICS_WORKER:
+            send({'request_id': data.get('request_id'),
+                  'results': self.stats()})
+            if (data.get('data') or {}).get('reset'):
+                self.metrics.reset()
+            return
+        if size is not None:
+            self.metrics.record(worker, metrics.REQUEST_SIZE, size)
+        if worker == scheduler.STATS_WORKER:
+            send({'request_id': data.get('request_id'),
+                  'results': self.queue.stats()})
+            return
+        if worker == results.STATS_WORKER:
+            send({'request_id': data.get('request_id'),
+                  'results': self.results.stats()})
+            return
+        if worker in INLINE_WORKERS:
+            self.answer_request(data, send)
+            return
+        if worker == batch.BATCH_WORKER:
+            self._queue_batch(data, send)
+        else:
+            self._queue_request(data, send)
+        self.reset_heartbeat()
+
+    def _queue_request(self, data, send):
+        """
+        Queues a work request.
+        """
+        # the document text must be resolved now: later updates would
+        # change the document before a queued request is run.
+        try:
+            documents.resolve(data.get('data'))
+        except documents.OutOfSync:
+            _logger().log(1, 'document out of sync, resync requested')
+            send({'request_id': data.get('request_id'), 'results': [],
+                  'resync': True})
+            return
+        token = cancellation.registry.register(data.get('request_id'))
+        self.begin_request()
+        run = functools.partial(self._run_request, send, time.time())
+        if self._is_background(data.get('worker')):
+            self._get_background_executor().submit(run, data, token)
+            return
+        self.queue.put(data.get('priority'), (run, data, token))
+        # the executor runs the queued request with the highest priority,
+        # not necessarily this one.
+        self.submit(self.run_next)
+
+    def _queue_batch(self, data, send):
+        """
+        Handles a batch: the requests of the batch are queued one by one,
+        with the text of the shared document.
+        """
+        try:
+            requests = batch.split(data)
+        except documents.OutOfSync:
+            _logger().log(1, 'document out of sync, resync requested')
+            send({'request_id': data.get('request_id'), 'results': [],
+                  'resync': True})
+            return
+        for request in requests:
+            self._queue_request(request, send)
+
+    def _run_request(self, send, queued_time, data, token):
+        """
+        Runs a dispatched request (in the executor thread).
+        """
+        self.metrics.record(data['worker'], metrics.QUEUE_WAIT,
+                            time.time() - queued_time)
+        cancellation.set_current_token(token)
+        try:
+            self.answer_request(data, send, token)
+        finally:
+            cancellation.set_current_token(None)
+            cancellation.registry.release(token.request_id)
+            self.end_request()
+
+    def answer_request(self, data, send, token=None):
+        """
+        Runs the worker of a request and sends the response.
+        """
+        try:
+            _logger().log(1, 'handling request %r', data)
+            assert data['worker']
+            assert data['request_id']
+            assert data['data'] is not None
+            response = {'request_id': data['request_id'], 'results': []}
+            # number of bytes sent for the request, partial responses
+            # included
+            sent = [0]
+            on_partial = None
+            if data.get('stream'):
+                def on_partial(chunk):
+                    sent[0] += send({'request_id': data['request_id'],
+                                     'results': chunk, 'partial': True}) or 0
+            start = time.time()
+            try:
+                ret_val = self.run_worker(
+                    data['worker'], data['data'], token, on_partial)
+            except ImportError:
+                _logger().exception('Failed to import worker class')
+            except cancellation.Cancelled:
+                _logger().log(1, 'request cancelled: %r', data['request_id'])
+                response['cancelled'] = True
+            else:
+                response = {'request_id': data['request_id'],
+                            'results': ret_val}
+            finally:
+                self.metrics.record(data['worker'], metrics.EXEC_TIME,
+                                    time.time() - start)
+                _logger().log(1, 'sending response: %r', response)
+                try:
+                    sent[0] += send(response) or 0
+                except socket.error:
+                    pass
+                else:
+                    if sent[0]:
+                        self.metrics.record(data['worker'],
+                                            metrics.RESPONSE_SIZE, sent[0])
+        except:
+            _logger().warn('error with data=%r', data)
+            exc1, exc2, exc3 = sys.exc_info()
+            traceback.print_exception(exc1, exc2, exc3, file=sys.stderr)
+
+    def _is_background(self, worker_name):
+        """
+        Checks if a worker sets ``background = True``.
+        """
+        try:
+            return getattr(self.workers.resolve(worker_name), 'background',
+                           False)
+        except Exception:
+            # the error is reported when the request is run
+            return False
+
+    def _get_background_executor(self):
+        """
+        Returns the executor of the background workers (created on first
+        use).
+        """
+        with self._background_lock:
+            if self.background_executor is None:
+                self.background_executor = _SerialExecutor()
+            return self.background_executor
+
+    def _take_slot(self, item):
+        """
+        Takes a slot of the worker of a queued request, returns False if the
+        worker already runs ``max_concurrency`` requests. Called with the
+        limits lock held.
+        """
+        worker_name = item[1].get('worker')
+        try:
+            limit = getattr(self.workers.resolve(worker_name),
+                            'max_concurrency', 1)
+        except Exception:
+            # the error is reported when the request is run
+            limit = None
+        running = self._limits.get(worker_name, 0)
+        if limit is not None and running >= limit:
+            return False
+        self._limits[worker_name] = running + 1
+        return True
+
+    def _release_slot(self, worker_name):
+        """
+        Releases the slot of a finished request and runs a request that was
+        waiting for a slot, if any.
+        """
+        with self._limits_lock:
+            running = self._limits[worker_name] - 1
+            if running:
+                self._limits[worker_name] = running
+            else:
+                del self._limits[worker_name]
+            deferred = self._deferred > 0
+            if deferred:
+                self._deferred -= 1
+        if deferred:
+            self.submit(self.run_next)
+
+    def run_worker(self, worker_name, data, token=None, on_partial=None):
+        """
+        Runs a worker and returns its results.
+
+        Worker exceptions are logged and turned into an empty result.
+
+        The results of generator workers are concatenated, or passed chunk by
+        chunk to ``on_partial`` (the results are then empty).
+
+        :param worker_name: fully qualified name of the worker.
+        :param data: worker data.
+        :param token: optional cancellation token of the request, the worker
+            is not run (or its results are discarded) if the request is
+            cancelled.
+        :param on_partial: optional callback called with each chunk of
+            results of a generator worker.
+        :raises: ImportError if the worker cannot be imported.
+        :raises: pyqode.core.backend.cancellation.Cancelled if the request
+            has been cancelled.
+        """
+        worker = self.workers.resolve(worker_name)
+        cpu_bound = (self.process_executor is not None and
+                     getattr(worker, 'cpu_bound', False))
+        _logger().log(1, 'worker: %r', worker)
+        _logger().log(1, 'data: %r', data)
+        key = None
+        if (self.results.max_size and on_partial is None and
+                results.is_pure(worker)):
+            key = results.content_key(worker_name, data)
+        if key is not None:
+            try:
+                return self.results.get(key)
+            except KeyError:
+                pass
+        try:
+            if token is not None:
+                # skip the requests cancelled while they were queued
+                token.raise_if_cancelled()
+            if cpu_bound:
+                ret_val = self.process_executor.submit(
+                    _run_worker, worker_name, data).result()
+            else:
+                with self.workers.instance(worker_name, worker) as fn:
+                    ret_val = fn(data)
+                    if inspect.isgenerator(ret_val):
+                        ret_val = consume_chunks(ret_val, token, on_partial)
+            if token is not None:
+                token.raise_if_cancelled()
+        except cancellation.Cancelled:
+            raise
+        except Exception:
+            _logger().exception(
+                'something went bad with worker %r(data=%r)', worker, data)
+            ret_val = None
+        else:
+            if key is not None:
+                self.results.put(key, ret_val)
+        if ret_val is None:
+            ret_val = []
+        return ret_val
+
+    def stats(self):
+        """
+        Returns the statistics of the server (answer of the
+        :data:`pyqode.core.backend.metrics.METRICS_WORKER` worker)::
+
+            {
+                'workers': metrics of the workers,
+                'queue': statistics of the queue,
+                'result_cache': statistics of the result cache,
+                'running': number of requests dispatched to the executor,
+                'workspace': statistics of the workspace index (None if
+                             disabled)
+            }
+
+        See :meth:`pyqode.core.backend.metrics.Metrics.stats`,
+        :meth:`pyqode.core.backend.scheduler.RequestQueue.stats`,
+        :meth:`pyqode.core.backend.results.ResultCache.stats` and
+        :meth:`pyqode.core.backend.workspace.WorkspaceIndex.stats`.
+        """
+        return {
+            'workers': self.metrics.stats(),
+            'queue': self.queue.stats(),
+            'result_cache': self.results.stats(),
+            'running': self._running,
+            'workspace': (self.workspace.stats()
+                          if self.workspace is not None else None)
+        }
+
+    def close_dispatcher(self):
+        """
+        Releases the resources of the dispatcher (called when the server is
+        closed).
+        """
+        self.workers.clear()
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=False)
+        if self.background_executor is not None:
+            self.background_executor.shutdown(wait=False)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.workspace is not None:
+            from pyqode.core.backend import workspace
+            workspace.stop()
+
+    def run_next(self):
+        """
+        Runs the queued request with the highest priority (called by the
+        executor, once per queued request).
+
+        The ``max_concurrency`` of the workers is checked before a request
+        takes the executor thread: the requests of a worker that runs as many
+        requests as it can stay queued, they do not hold the threads the
+        other workers need. They are run when a request of the worker is
+        finished.
+        """
+        with self._limits_lock:
+            try:
+                run, data, token = self.queue.pop(self._take_slot)
+            except IndexError:
+                if len(self.queue):
+                    # all the queued requests wait for a slot
+                    self._deferred += 1
+                return
+        try:
+            run(data, token)
+        finally:
+            self._release_slot(data['worker'])
+
+    def begin_request(self):
+        """ Marks the start of a request dispatched to the executor. """
+        with self._running_lock:
+            self._running += 1
+
+    def end_request(self):
+        """ Marks the end of a request dispatched to the executor. """
+        with self._running_lock:
+            self._running -= 1
+        self.reset_heartbeat()
+
+    def reset_heartbeat(self):
+        self.last_time = time.time()
+        self.elapsed_time = 0
+
+
+class JsonServer(RequestDispatcher, socketserver.ThreadingMixIn,
+                 socketserver.TCPServer):
     """
     A server socket based on a json messaging system.
+
+    Connections are persistent: a client connects once and sends as many
+    requests as it wants on the same socket, each response is tagged with the
+    ``request_id`` of the request it answers. Every connection is served by
+    its own thread.
+
+    How workers are run depends on the dispatch mode (``--dispatch``):
+
+        - ``serial`` (default): workers are run one at a time, in arrival
+          order, by a dedicated thread.
+        - ``concurrent``: workers are run by a pool of ``--threads`` threads,
+          so that a slow worker (e.g. a linter) does not delay the requests
+          queued behind it. Workers that set ``cpu_bound = True`` are run in
+          a pool of ``--processes`` processes (if ``--processes`` is greater
+          than 0).
+
+    A worker can limit the number of requests it handles concurrently by
+    defining a ``max_concurrency`` attribute (default is 1, workers do not
+    need to be thread safe). E.g.::
+
+        def findall(data):
+            ...
+        findall.max_concurrency = 4
+
+        class MyLinter(object):
+            cpu_bound = True
+            max_concurrency = 2
+
+    .. note:: The process pool does not share any state with the server
+        process: workers that depend on a state set by another worker
+        should not be flagged as ``cpu_bound``.
+
+    Long running workers (e.g. a search in the files of a project) can set
+    ``background = True``: their requests are run one at a time by a
+    dedicated thread, whatever the dispatch mode, so they never hold the
+    executor that runs the requests of the editor. Their priority and
+    ``max_concurrency`` are ignored.
+
+    Requests can be cancelled by the client while they are queued or running
+    (see :mod:`pyqode.core.backend.cancellation`).
+
+    Requests sent in a batch (see :mod:`pyqode.core.backend.batch`) are
+    queued and answered individually.
+
+    A worker can be a generator that yields its results by chunks (lists),
+    e.g. to let the user see the first results of a long search. The chunks
+    are sent as partial responses if the request sets ``stream``, they are
+    concatenated otherwise::
+
+        def find_all(data):
+            chunk = []
+            for match in search(data):
+                chunk.append(match)
+                if len(chunk) == 1000:
+                    yield chunk
+                    chunk = []
+            yield chunk
+
+    Queued requests are run by order of priority (see
+    :mod:`pyqode.core.backend.scheduler`), a request that waited more than
+    ``--starvation-delay`` seconds is run first whatever its priority.
+
+    The server listens on ``127.0.0.1:port`` or, with ``--transport unix``,
+    on a unix domain socket whose path is passed instead of the port.
+
+    Workers are imported once and persistent workers keep their instance
+    between requests, see :class:`WorkerCache` (the cache is bounded by the
+    ``--worker-instances`` and ``--worker-memory`` arguments).
+
+    The results of the workers that set ``pure = True`` are cached (see
+    :mod:`pyqode.core.backend.results`), the ``--result-cache`` argument sets
+    the maximum number of cached results (0 disables the cache).
     """
+    #: Don't wait for the connection threads when shutting down.
+    daemon_threads = True
 
     class _Handler(socketserver.BaseRequestHandler):
+        def setup(self):
+            self._send_lock = threading.Lock()
+            #: Codec used to encode/decode messages, json until the client
+            #: negotiates another codec.
+            self.codec = codec.JsonCodec
+
         def read_bytes(self, size):
             """
             Read x bytes
 
             :param size: number of bytes to read.
-
+            :returns: a bytearray
             """
-            if not PY33:
-                data = ''
-            else:
-                data = bytes()
-            while len(data) < size:
-                tmp = self.request.recv(size - len(data))
-                data += tmp
-                if tmp == '':
-                    raise RuntimeError("socket connection broken")
+            # the buffer is allocated once, from the size given by the header,
+            # and the socket writes directly into it.
+            data = bytearray(size)
+            view = memoryview(data)
+            pos = 0
+            while pos < size:
+                nb_bytes = self.request.recv_into(view[pos:], size - pos)
+                if not nb_bytes:
+                    raise EOFError("socket connection broken")
+                pos += nb_bytes
             return data
 
         def get_msg_len(self):
@@ -83,76 +917,51 @@ class JsonServer(socketserver.TCPServer):
             return payload[0]
 
         def read(self):
-            """ Reads a json string from socket and load it. """
+            """ Reads a message from socket and decodes it. """
             size = self.get_msg_len()
-            data = self.read_bytes(size).decode('utf-8')
-            return json.loads(data)
+            return self.codec.loads(self.read_bytes(size))
 
         def send(self, obj):
             """
-            Sends a python obj as a json string on the socket.
+            Sends a python obj on the socket, encoded with the connection
+            codec.
 
             :param obj: The object to send, must be Json serializable.
+            :returns: the number of bytes sent
             """
-            msg = json.dumps(obj).encode('utf-8')
+            msg = self.codec.dumps(obj)
             _logger().log(1, 'sending %d bytes for the payload', len(msg))
             header = struct.pack('=I', len(msg))
-            self.request.sendall(header)
-            self.request.sendall(msg)
+            with self._send_lock:
+                self.request.sendall(header + msg)
+            return len(msg) + 4
 
         def handle(self):
             """
-            Hanlde the request and keep it alive while shutdown signal
-            has not been received
+            Handle the requests sent on the connection until the client
+            disconnects.
             """
-            self.srv.reset_heartbeat()
-            # make sure to have enough time to handle the request
-            self.srv.timeout = HEARTBEAT_DELAY * 10
-            data = self.read()
-            self._handle(data)
-            self.srv.timeout = HEARTBEAT_DELAY
-            self.srv.reset_heartbeat()
-
-        def _handle(self, data):
+            while True:
+                try:
+                    size = self.get_msg_len()
+                    data = self.codec.loads(self.read_bytes(size))
+                except (EOFError, socket.error):
+                    _logger().log(1, 'client disconnected')
+                    break
+                if data.get('worker') == codec.HANDSHAKE_WORKER:
+                    self._handshake(data)
+                    continue
+                self.srv.handle_message(data, self.send, size + 4)
+
+        def _handshake(self, data):
             """
-            Handles a work request.
+            Answers the codec handshake, then switches to the negotiated codec.
             """
-            try:
-                _logger().log(1, 'handling request %r', data)
-                assert data['worker']
-                assert data['request_id']
-                assert data['data'] is not None
-                response = {'request_id': data['request_id'], 'results': []}
-                try:
-                    worker = import_class(data['worker'])
-                except ImportError:
-                    _logger().exception('Failed to import worker class')
-                else:
-                    if inspect.isclass(worker):
-                        worker = worker()
-                    _logger().log(1, 'worker: %r', worker)
-                    _logger().log(1, 'data: %r', data['data'])
-                    try:
-                        ret_val = worker(data['data'])
-                    except Exception:
-                        _logger().exception(
-                            'something went bad with worker %r(data=%r)',
-                            worker, data['data'])
-                        ret_val = None
-                    if ret_val is None:
-                        ret_val = []
-                    response = {'request_id': data['request_id'],
-                                'results': ret_val}
-                finally:
-                    _logger().log(1, 'sending response: %r', response)
-                    try:
-                        self.send(response)
-                    except ConnectionAbortedError:
-                        pass
-            except:
-                _logger().warn('error with data=%r', data)
-                exc1, exc2, exc3 = sys.exc_info()
-                traceback.print_exception(exc1, exc2, exc3, file=sys.stderr)
+            name = codec.negotiate(data['data'])
+            _logger().log(1, 'codec: %s', name)
+            self.send({'request_id': data['request_id'],
+                       'results': {'codec': name, 'features': FEATURES}})
+            self.codec = codec.get_codec(name)
 
     def __init__(self, args=None):
         """
@@ -160,28 +969,52 @@ class JsonServer(socketserver.TCPServer):
             use its own argument parser (using
             :meth:`pyqode.core.backend.default_parser`)
         """
-        self.reset_heartbeat()
         if not args:
             args = default_parser().parse_args()
-        self.port = args.port
-        self.timeout = HEARTBEAT_DELAY
+        dispatch = self.setup_dispatcher(args)
+        if dispatch == DISPATCH_CONCURRENT:
+            self.executor = futures.ThreadPoolExecutor(
+                max_workers=getattr(args, 'threads', 4))
+        else:
+            self.executor = _SerialExecutor()
         self._Handler.srv = self
-        socketserver.TCPServer.__init__(
-            self, ('127.0.0.1', int(args.port)), self._Handler)
-        print('started on 127.0.0.1:%d' % int(args.port))
+        if self.transport == TRANSPORT_UNIX:
+            self.address_family = socket.AF_UNIX
+            address = args.port
+            if os.path.exists(address):
+                # stale socket of a previous server
+                os.remove(address)
+        else:
+            address = ('127.0.0.1', int(args.port))
+        socketserver.TCPServer.__init__(self, address, self._Handler)
+        if self.transport == TRANSPORT_UNIX:
+            print('started on %s' % address)
+        else:
+            print('started on 127.0.0.1:%d' % int(args.port))
         print('running with python %d.%d.%d' % (sys.version_info[:3]))
+        print('dispatch mode: %s' % dispatch)
         self._heartbeat_thread = threading.Thread(target=self.heartbeat)
         self._heartbeat_thread.daemon = True
         self._heartbeat_thread.start()
 
-    def reset_heartbeat(self):
-        self.last_time = time.time()
-        self.elapsed_time = 0
+    def server_close(self):
+        socketserver.TCPServer.server_close(self)
+        self.executor.shutdown(wait=False)
+        self.close_dispatcher()
+        if self.transport == TRANSPORT_UNIX:
+            try:
+                os.remove(self.port)
+            except OSError:
+                pass
 
     def heartbeat(self):
         while True:
             elapsed_time = time.time() - self.last_time
-            if elapsed_time > self.timeout:
+            timeout = self.timeout
+            if self._running:
+                # make sure to have enough time to handle the requests
+                timeout = HEARTBEAT_DELAY * 10
+            if elapsed_time > timeout:
                 self.shutdown()
                 sys.exit(1)
             time.sleep(1)
@@ -192,15 +1025,101 @@ def default_parser():
     Configures and return the default argument parser. You should use this
     parser as a base if you want to add custom arguments.
 
-    The default parser only has one argument, the tcp port used to start the
-    server socket. *(CodeEdit picks up a free port and use it to run
+    The default parser has one positional argument, the tcp port used to
+    start the server socket. *(CodeEdit picks up a free port and use it to run
     the server and connect its client socket)*
 
+    With ``--transport unix``, the positional argument is the path of the unix
+    domain socket the server listens on instead (the transport is set by
+    :meth:`pyqode.core.managers.BackendManager.start`).
+
+    The dispatch mode of the server is configured with the following
+    optional arguments (see :class:`JsonServer`):
+
+        - ``--dispatch``: ``serial`` (default) or ``concurrent``
+        - ``--threads``: size of the thread pool (concurrent mode only)
+        - ``--processes``: size of the process pool used for the cpu bound
+          workers (concurrent mode only, 0 to disable).
+        - ``--starvation-delay``: maximum time (in seconds) a request waits
+          for requests of higher priority.
+
+    The cache of persistent workers (see :class:`WorkerCache`) is bounded by:
+
+        - ``--worker-instances``: maximum number of instances
+        - ``--worker-memory``: maximum memory used by the instances (MB)
+
+    The cache of the results of the pure workers (see
+    :mod:`pyqode.core.backend.results`) is bounded by ``--result-cache``
+    (maximum number of results, 0 to disable the cache).
+
+    ``--record PATH`` records the handled messages in a trace file (see
+    :mod:`pyqode.core.backend.traces`).
+
+    The word completion of the project files (see
+    :mod:`pyqode.core.backend.workspace`) is configured with:
+
+        - ``--workspace DIR``: root directory of the project (may be
+          repeated)
+        - ``--workspace-cache PATH``: file where the index is saved between
+          sessions
+        - ``--workspace-memory``: maximum memory used by the index (MB)
+
+    ``--server`` selects the server implementation used by
+    :func:`serve_forever`: ``threads`` (:class:`JsonServer`, default) or
+    ``asyncio`` (:class:`pyqode.core.backend.asyncio_server.AsyncJsonServer`,
+    python 3.5+).
+
+    These arguments can be passed from the client using the ``args``
+    parameter of :meth:`pyqode.core.managers.BackendManager.start`.
+
     :returns: The default server argument parser.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("port", help="the local tcp port to use to run "
-                        "the server")
+                        "the server (or the socket path with the unix "
+                        "transport)")
+    parser.add_argument(
+        "--transport", choices=[TRANSPORT_TCP, TRANSPORT_UNIX],
+        default=TRANSPORT_TCP, help="listen on a local tcp port or on a unix "
+        "domain socket")
+    parser.add_argument(
+        "--dispatch", choices=[DISPATCH_SERIAL, DISPATCH_CONCURRENT],
+        default=DISPATCH_SERIAL, help="how requests are dispatched to the "
+        "workers: one at a time or concurrently")
+    parser.add_argument(
+        "--threads", type=int, default=4, help="number of threads used to "
+        "run workers in concurrent mode")
+    parser.add_argument(
+        "--processes", type=int, default=0, help="number of processes used "
+        "to run cpu bound workers in concurrent mode")
+    parser.add_argument(
+        "--starvation-delay", type=float, default=1.0, help="maximum time "
+        "(in seconds) a request waits for requests of higher priority")
+    parser.add_argument(
+        "--worker-instances", type=int, default=16, help="maximum number of "
+        "persistent worker instances kept between requests")
+    parser.add_argument(
+        "--worker-memory", type=int, default=512, help="maximum memory used "
+        "by the persistent worker instances, in MB")
+    parser.add_argument(
+        "--result-cache", type=int, default=64, help="maximum number of "
+        "results of pure workers kept in cache (0 to disable the cache)")
+    parser.add_argument(
+        "--record", metavar="PATH", help="record the requests and the "
+        "responses in a trace file")
+    parser.add_argument(
+        "--workspace", metavar="DIR", action="append", help="index the "
+        "words of the files of a project directory for word completion")
+    parser.add_argument(
+        "--workspace-cache", metavar="PATH", help="file where the workspace "
+        "index is saved between sessions")
+    parser.add_argument(
+        "--workspace-memory", type=int, default=64, help="maximum memory "
+        "used by the workspace index, in MB")
+    parser.add_argument(
+        "--server", choices=[SERVER_THREADS, SERVER_ASYNCIO],
+        default=SERVER_THREADS, help="server implementation: one thread per "
+        "connection or asyncio streams (python 3.5+)")
     return parser
 
 
@@ -208,6 +1127,9 @@ def serve_forever(args=None):
     """
     Creates the server and serves forever
 
+    The server implementation is selected by the ``--server`` argument (see
+    :func:`default_parser`).
+
     :param args: Optional args if you decided to use your own
         argument parser. Default is None to let the JsonServer setup its own
         parser and parse command line arguments.
@@ -226,6 +1148,12 @@ def serve_forever(args=None):
     sys.stdout = Unbuffered(sys.stdout)
     sys.stderr = Unbuffered(sys.stderr)
 
+    if not args:
+        args = default_parser().parse_args()
+    if getattr(args, 'server', SERVER_THREADS) == SERVER_ASYNCIO:
+        from pyqode.core.backend import asyncio_server
+        asyncio_server.serve_forever(args)
+        return
     server = JsonServer(args=args)
     server.serve_forever()
 
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the memory mapped document snapshots.
+
+When the client needs to send the full text of a very large document to the
+backend (first sync, resync,...), encoding the text into the message and
+pushing it through the socket is the dominant cost. Instead, the client
+writes the text (utf-8) into a memory mapped file and the document update
+only carries the location of the snapshot::
+
+    {
+        'id': document id,
+        'path': document path,
+        'revision': revision of the snapshot,
+        'snapshot': {
+            'path': path of the snapshot file,
+            'offset': offset of the text in the file,
+            'size': size of the encoded text
+        }
+    }
+
+The server maps the file, reads the text and removes the file: a snapshot is
+written for a single revision and is read once (see
+:func:`pyqode.core.backend.documents.update_document`).
+
+The client uses snapshots for the documents larger than
+:attr:`pyqode.core.api.client.JsonTcpClient.snapshot_threshold`, if the
+server announces the ``'snapshot'`` feature.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import mmap
+import os
+
+
+def write_snapshot(directory, doc_id, text, revision):
+    """
+    Writes a snapshot of a document.
+
+    :param directory: directory of the snapshot files.
+    :param doc_id: id of the document.
+    :param text: text of the document.
+    :param revision: revision of the document.
+    :returns: the location of the snapshot (``'snapshot'`` field of the
+        update request).
+    """
+    data = text.encode('utf-8')
+    path = os.path.join(directory, '%s-%d.snap' % (doc_id, revision))
+    with open(path, 'w+b') as f:
+        # an empty file cannot be mapped
+        f.truncate(max(len(data), 1))
+        segment = mmap.mmap(f.fileno(), 0)
+        try:
+            segment[:len(data)] = data
+        finally:
+            segment.close()
+    return {'path': path, 'offset': 0, 'size': len(data)}
+
+
+def read_snapshot(snapshot, remove=True):
+    """
+    Reads the text of a snapshot, then removes the snapshot file.
+
+    :param snapshot: location of the snapshot (see :func:`write_snapshot`).
+    :param remove: False to keep the snapshot file.
+    :returns: the text of the snapshot.
+    :raises: IOError or OSError if the snapshot cannot be read.
+    """
+    path = snapshot['path']
+    offset = snapshot['offset']
+    size = snapshot['size']
+    try:
+        with open(path, 'rb') as f:
+            if not size:
+                return u''
+            segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return segment[offset:offset + size].decode('utf-8')
+            finally:
+                segment.close()
+    finally:
+        if remove:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
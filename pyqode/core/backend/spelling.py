@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the incremental spell checking engine used by
+:func:`pyqode.core.modes.spellchecker_mode.run_spellcheck`.
+
+The verdict of the spell checker is cached per word (see :class:`Dictionary`),
+the words that are not in cache are checked in a single ``unknown()`` call.
+
+A :class:`SpellIndex` keeps the misspelled words of each line of a document.
+The index of a synced document (see :mod:`pyqode.core.backend.documents`) is
+updated from the lines changed since the previous request: after a keystroke,
+only the edited line is checked again. The index is updated to the revision
+of the request, not to the latest revision of the document::
+
+    index = spelling.document_index(doc_id, dictionary, revision)
+    messages = index.messages(ignore)
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import re
+import string
+import threading
+
+from pyqode.core.backend import documents
+
+
+#: Pattern of the checked words
+WORD_PATTERN = re.compile(r'(?P<word>\w\w\w+)')
+
+
+def split_line(line):
+    """
+    Returns the words of a line that must be spell checked, as a list of
+    ``(word, start, end)`` tuples (``start`` and ``end`` are columns).
+
+    Leading and trailing double underscores are not part of the word, words
+    that start with a digit are skipped.
+    """
+    words = []
+    for match in WORD_PATTERN.finditer(line):
+        word = match.group('word')
+        end = match.end()
+        if word.startswith('__'):
+            word = word[2:]
+        if word.endswith('__'):
+            word = word[:-2]
+            end -= 2
+        if not word or word[0] in string.digits:
+            continue
+        words.append((word, end - len(word), end))
+    return words
+
+
+class Dictionary(object):
+    """
+    Caches the verdicts of a spell checker.
+
+    :param checker: the spell checker, an object with an ``unknown(words)``
+        method that returns the set of misspelled words (lower case if the
+        checker is case insensitive), e.g. ``spellchecker.SpellChecker``.
+    """
+    def __init__(self, checker):
+        self.checker = checker
+        # word -> True if the word is misspelled
+        self._verdicts = {}
+        self._lock = threading.Lock()
+
+    def unknown(self, words):
+        """
+        Returns the set of misspelled words of a list of words. The words
+        that are not in cache are checked at once.
+        """
+        with self._lock:
+            verdicts = self._verdicts
+            new_words = [word for word in set(words) if word not in verdicts]
+            if new_words:
+                misspelled = self.checker.unknown(new_words)
+                for word in new_words:
+                    verdicts[word] = (word in misspelled or
+                                      word.lower() in misspelled)
+            return set(word for word in words if verdicts[word])
+
+    def __len__(self):
+        return len(self._verdicts)
+
+
+class SpellIndex(object):
+    """
+    Thread safe index of the misspelled words of a document.
+
+    :param dictionary: the :class:`Dictionary` used to check the words.
+    """
+    def __init__(self, dictionary, lines=None, revision=None):
+        self.dictionary = dictionary
+        #: Revision of the indexed document
+        self.revision = revision
+        # misspelled (word, start, end) of each line
+        self._lines = []
+        self._lock = threading.Lock()
+        if lines is not None:
+            self.rebuild(lines, revision)
+
+    def rebuild(self, lines, revision=None):
+        """
+        Checks a whole document.
+
+        :param lines: the lines of the document.
+        :param revision: revision of the document.
+        """
+        misspellings = self._check(lines)
+        with self._lock:
+            self._lines = misspellings
+            self.revision = revision
+
+    def apply(self, changes, revision=None):
+        """
+        Updates the index with line based changes (see
+        :meth:`pyqode.core.backend.documents.Document.apply`), only the
+        changed lines are checked.
+
+        :param changes: list of (start, count, lines) tuples.
+        :param revision: revision of the document after the changes.
+        """
+        with self._lock:
+            for start, count, lines in changes:
+                self._lines[start:start + count] = self._check(lines)
+            self.revision = revision
+
+    def messages(self, ignore=()):
+        """
+        Returns the misspelled words as a list of
+        ``(word, line, start, end)`` tuples.
+
+        :param ignore: words that are not reported.
+        """
+        ignore = set(ignore)
+        with self._lock:
+            return [(word, i, start, end)
+                    for i, misspellings in enumerate(self._lines)
+                    if misspellings
+                    for word, start, end in misspellings
+                    if word not in ignore]
+
+    def _check(self, lines):
+        line_words = [split_line(line) for line in lines]
+        unknown = self.dictionary.unknown(
+            [word for words in line_words for word, _, _ in words])
+        return [[item for item in words if item[0] in unknown]
+                for words in line_words]
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def document_index(doc_id, dictionary, revision=None):
+    """
+    Returns the up to date spell index of a synced document.
+
+    The index is created on first use (or when the dictionary changes) and
+    then updated from the changes of the document.
+
+    :param doc_id: id of the document.
+    :param dictionary: the :class:`Dictionary` used to check the words.
+    :param revision: revision of the text of the request that uses the
+        index, None for the current revision of the document.
+    :raises: pyqode.core.backend.documents.OutOfSync if the document is not
+        in the store, or if the index cannot be updated to ``revision`` (see
+        :meth:`pyqode.core.backend.documents.DocumentStore.changes`).
+    """
+    with _lock:
+        index = _indexes.get(doc_id)
+        if index is None or index.dictionary is not dictionary:
+            # forget the indexes of the closed documents
+            ids = set(doc.id for doc in documents.store.documents())
+            for key in list(_indexes.keys()):
+                if key not in ids:
+                    del _indexes[key]
+            index = _indexes[doc_id] = SpellIndex(dictionary)
+        revision, changes, lines = documents.store.changes(
+            doc_id, index.revision, revision)
+        if changes is None:
+            index.rebuild(lines, revision)
+        elif changes:
+            index.apply(changes, revision)
+    return index
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the recording and the replay of backend request traces,
+to reproduce the load an editor put on its backend.
+
+Recording
+---------
+
+A server started with ``--record trace.jsonl`` writes every message it
+receives, and a summary of every response it sends, to a trace file (one
+json object per line)::
+
+    {"t": 0.25, "conn": 1, "in": {request}}
+    {"t": 0.26, "conn": 1, "out": {"request_id": ..., "size": 1234}}
+
+``t`` is the time (in seconds) since the start of the recording and ``conn``
+identifies the client connection. Responses are recorded without their
+results (``size`` is the size of the encoded response), flags such as
+``partial`` or ``resync`` are kept. Document snapshots (see
+:mod:`pyqode.core.backend.snapshots`) are recorded as full text updates.
+
+The recording can be enabled from the editor::
+
+    editor.backend.start(server_script, args=['--record', path])
+
+Replay
+------
+
+:func:`replay` sends the requests of a trace to a server, at the original
+pace or faster, and measures the latency of each request. The command line
+tool starts a server script and prints the latency percentiles per worker::
+
+    python -m pyqode.core.backend.traces trace.jsonl server.py --speed 10
+
+Some canned traces of typical editing sessions can be found in
+``test/test_backend/traces``.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import argparse
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from pyqode.core.backend import batch
+from pyqode.core.backend import documents
+from pyqode.core.backend import metrics
+from pyqode.core.backend import snapshots
+
+
+class TraceRecorder(object):
+    """
+    Writes the messages handled by a server to a trace file (thread safe).
+    """
+    def __init__(self, path):
+        self._file = open(path, 'w')
+        self._start = time.time()
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def record_request(self, data, send):
+        """
+        Records a request received on a connection.
+
+        :param data: the decoded request.
+        :param send: the function that sends the responses on the connection.
+        :returns: a send function that records the responses.
+        """
+        # the connection object (handler or asyncio connection)
+        connection = getattr(send, '__self__', send)
+        with self._lock:
+            conn = self._connections.setdefault(
+                connection, len(self._connections) + 1)
+        if data.get('worker') == documents.UPDATE_WORKER and \
+                data['data'].get('snapshot') is not None:
+            data = dict(data)
+            data['data'] = dict(data['data'])
+            data['data']['text'] = snapshots.read_snapshot(
+                data['data'].pop('snapshot'), remove=False)
+        self._write(time.time(), {'conn': conn, 'in': data})
+
+        def record_response(response):
+            send_time = time.time()
+            size = send(response)
+            out = dict((key, value) for key, value in response.items()
+                       if key != 'results')
+            out['size'] = size
+            self._write(send_time, {'conn': conn, 'out': out})
+            return size
+        return record_response
+
+    def close(self):
+        """ Closes the trace file """
+        with self._lock:
+            self._file.close()
+
+    def _write(self, entry_time, entry):
+        line = json.dumps(entry)
+        with self._lock:
+            if self._file.closed:
+                return
+            # the time is written first, for readability
+            self._file.write('{"t": %.6f, %s\n' % (
+                entry_time - self._start, line[1:]))
+            self._file.flush()
+
+
+def load(path):
+    """
+    Loads a trace file.
+
+    :returns: the list of the trace entries (dicts), in time order.
+    """
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    entries.sort(key=lambda entry: entry['t'])
+    return entries
+
+
+def recorded_latencies(entries):
+    """
+    Returns the latencies of the requests of a trace, as they were recorded.
+
+    :returns: a :class:`pyqode.core.backend.metrics.Metrics` with the
+        round trip latency of each worker.
+    """
+    latencies = metrics.Metrics()
+    sent = {}
+    for entry in entries:
+        if 'in' in entry:
+            for request in _requests(entry['in']):
+                sent[request['request_id']] = (request['worker'], entry['t'])
+        elif not entry['out'].get('partial'):
+            try:
+                worker, start = sent.pop(entry['out']['request_id'])
+            except KeyError:
+                continue
+            latencies.record(worker, metrics.ROUND_TRIP, entry['t'] - start)
+    return latencies
+
+
+def _requests(message):
+    """
+    Returns the requests of a message: the requests of a batch or the message
+    itself.
+    """
+    if message.get('worker') == batch.BATCH_WORKER:
+        return message['data']['requests']
+    return [message]
+
+
+class _Replay(object):
+    """
+    Replays the messages of a trace on one connection per recorded
+    connection.
+    """
+    def __init__(self, address, family):
+        self.address = address
+        self.family = family
+        self.latencies = metrics.Metrics()
+        self.resyncs = 0
+        self.cancelled = 0
+        self._sockets = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._threads = []
+
+    def send(self, conn, message):
+        try:
+            sock = self._sockets[conn]
+        except KeyError:
+            sock = self._sockets[conn] = socket.socket(
+                self.family, socket.SOCK_STREAM)
+            sock.connect(self.address)
+            thread = threading.Thread(target=self._read, args=(sock, ))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        now = time.time()
+        with self._lock:
+            for request in _requests(message):
+                self._pending[request['request_id']] = (
+                    request['worker'], now)
+            if message.get('worker') == batch.BATCH_WORKER:
+                # a batch is only answered if its document is out of sync
+                self._pending.pop(message['request_id'], None)
+        msg = json.dumps(message).encode('utf-8')
+        sock.sendall(struct.pack('=I', len(msg)) + msg)
+
+    def wait(self, timeout):
+        """
+        Waits until every request has been answered.
+
+        :returns: the number of requests that were not answered.
+        """
+        deadline = time.time() + timeout
+        with self._done:
+            while self._pending and time.time() < deadline:
+                self._done.wait(0.1)
+            return len(self._pending)
+
+    def close(self):
+        for sock in self._sockets.values():
+            sock.close()
+
+    def _read(self, sock):
+        try:
+            while True:
+                size = struct.unpack('=I', _recv_bytes(sock, 4))[0]
+                response = json.loads(_recv_bytes(sock, size).decode('utf-8'))
+                if not response.get('partial'):
+                    self._on_response(response)
+        except (EOFError, socket.error, ValueError):
+            pass
+
+    def _on_response(self, response):
+        now = time.time()
+        with self._done:
+            try:
+                worker, start = self._pending.pop(response['request_id'])
+            except KeyError:
+                return
+            if response.get('resync'):
+                self.resyncs += 1
+            if response.get('cancelled'):
+                self.cancelled += 1
+            self.latencies.record(worker, metrics.ROUND_TRIP, now - start)
+            self._done.notify_all()
+
+
+def _recv_bytes(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return bytes(data)
+
+
+def replay(entries, address, speed=1.0, timeout=60, family=socket.AF_INET):
+    """
+    Sends the requests of a trace to a running server.
+
+    :param entries: the trace entries (see :func:`load`).
+    :param address: address of the server: ``('127.0.0.1', port)`` or the
+        path of a unix domain socket (with ``family=socket.AF_UNIX``).
+    :param speed: pace of the replay: 1 for the recorded pace, 10 to send
+        the requests ten times faster, 0 to send them as fast as possible.
+    :param timeout: maximum time (in seconds) to wait for the responses
+        once all the requests have been sent.
+    :returns: the replay report::
+
+        {
+            'workers': latency of the requests of each worker (see
+                       :meth:`pyqode.core.backend.metrics.Metrics.stats`),
+            'requests': number of requests sent,
+            'unanswered': number of requests left without response,
+            'resyncs': number of requests answered with a resync,
+            'cancelled': number of requests cancelled,
+            'duration': duration of the replay (s)
+        }
+    """
+    session = _Replay(address, family)
+    requests = [entry for entry in entries if 'in' in entry]
+    start = time.time()
+    try:
+        for entry in requests:
+            if speed:
+                delay = start + entry['t'] / float(speed) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            session.send(entry['conn'], entry['in'])
+        unanswered = session.wait(timeout)
+    finally:
+        session.close()
+    return {
+        'workers': session.latencies.stats(),
+        'requests': sum(len(_requests(entry['in'])) for entry in requests),
+        'unanswered': unanswered,
+        'resyncs': session.resyncs,
+        'cancelled': session.cancelled,
+        'duration': time.time() - start
+    }
+
+
+def format_report(report, recorded=None):
+    """
+    Formats a replay report as a table of the latency percentiles (ms) of
+    each worker.
+
+    :param report: the report returned by :func:`replay`.
+    :param recorded: optional recorded latencies of the trace (see
+        :func:`recorded_latencies`), their 95th percentile is added to the
+        table.
+    """
+    lines = ['%-60s %6s %8s %8s %8s %8s %8s' % (
+        'worker', 'count', 'p50', 'p95', 'p99', 'max', 'rec. p95')]
+    recorded = recorded.stats() if recorded is not None else {}
+    for worker, stats in sorted(report['workers'].items()):
+        latency = stats[metrics.ROUND_TRIP]
+        try:
+            recorded_p95 = '%8.1f' % (
+                recorded[worker][metrics.ROUND_TRIP]['p95'] * 1000)
+        except KeyError:
+            recorded_p95 = '%8s' % '-'
+        lines.append('%-60s %6d %8.1f %8.1f %8.1f %8.1f %s' % (
+            worker[-60:], latency['count'], latency['p50'] * 1000,
+            latency['p95'] * 1000, latency['p99'] * 1000,
+            latency['max'] * 1000, recorded_p95))
+    lines.append('%d requests in %.2fs: %d unanswered, %d resyncs, '
+                 '%d cancelled' % (report['requests'], report['duration'],
+                                   report['unanswered'], report['resyncs'],
+                                   report['cancelled']))
+    return '\n'.join(lines)
+
+
+def _wait_server(process, port, timeout):
+    """ Waits until the server listens """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            if process.poll() is not None:
+                raise RuntimeError('the server exited with code %d' %
+                                   process.returncode)
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main(argv=None):
+    """
+    Replays a trace with a server script started on a free port, prints the
+    report. Extra server arguments can be given after ``--``.
+    """
+    parser = argparse.ArgumentParser(
+        description='Replays a backend request trace.')
+    parser.add_argument('trace', help='path of the trace file')
+    parser.add_argument('script', help='server script')
+    parser.add_argument('--interpreter', default=sys.executable,
+                        help='python interpreter that runs the script')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='pace of the replay (1: recorded pace, 0: as '
+                        'fast as possible)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='maximum time to wait for the responses')
+    if argv is None:
+        argv = sys.argv[1:]
+    server_args = []
+    if '--' in argv:
+        # extra server arguments
+        server_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+    test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    test_socket.bind(('127.0.0.1', 0))
+    port = test_socket.getsockname()[1]
+    test_socket.close()
+    devnull = open(os.devnull, 'w')
+    process = subprocess.Popen(
+        [args.interpreter, args.script, str(port)] + server_args,
+        stdout=devnull)
+    try:
+        _wait_server(process, port, 30)
+        entries = load(args.trace)
+        report = replay(entries, ('127.0.0.1', port), speed=args.speed,
+                        timeout=args.timeout)
+        print(format_report(report, recorded_latencies(entries)))
+    finally:
+        process.kill()
+        process.wait()
+        devnull.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the word index used by
+:class:`pyqode.core.backend.workers.DocumentWordsProvider`.
+
+A :class:`WordIndex` keeps the words of each line of a document, the number
+of occurrences of each word and a sorted vocabulary. The index of a synced
+document (see :mod:`pyqode.core.backend.documents`) is updated from the lines
+changed since its last update, a completion request does not rescan the
+document::
+
+    index = words.document_index(doc_id)
+    index.complete('fo', line=12, limit=50)
+
+Words are ranked by number of occurrences, the words that appear near the
+cursor line are boosted.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import bisect
+import heapq
+import re
+import threading
+
+from pyqode.core.backend import documents
+
+
+#: Word separators
+SEPARATORS = [
+    '~', '!', '@', '#', '$', '%', '^', '&', '*', '(', ')', '+', '{',
+    '}', '|', ':', '"', "'", "<", ">", "?", ",", ".", "/", ";", '[',
+    ']', '\\', '\n', '\t', '=', '-', ' '
+]
+
+
+def word_pattern(separators):
+    """
+    Returns the compiled regular expression that matches the runs of
+    characters between separators.
+    """
+    return re.compile('[^%s]+' % ''.join(re.escape(sep) for sep in separators))
+
+
+_WORD = word_pattern(SEPARATORS)
+
+
+def split_line(line, pattern=_WORD):
+    """
+    Returns the list of words of a line (with duplicates), excluding
+    punctuations, numbers,...
+
+    :param line: the line of text.
+    :param pattern: the word pattern (see :func:`word_pattern`).
+    """
+    return [word for word in pattern.findall(line)
+            if word.replace('_', '').isalpha()]
+
+
+def prefix_matches(keys, key):
+    """
+    Returns the words that start with a prefix.
+
+    :param keys: sorted list of (lower case word, word) tuples.
+    :param key: the lower case prefix.
+    """
+    index = bisect.bisect_left(keys, (key, ))
+    words = []
+    while index < len(keys) and keys[index][0].startswith(key):
+        words.append(keys[index][1])
+        index += 1
+    return words
+
+
+class WordIndex(object):
+    """
+    Thread safe index of the words of a document.
+    """
+    #: Number of lines, above and below the cursor, in which the words are
+    #: boosted.
+    WINDOW = 100
+    #: Boost of a word found on the cursor line, it decreases linearly to 0
+    #: at :attr:`WINDOW` lines from the cursor.
+    PROXIMITY_BOOST = 4.0
+
+    def __init__(self, lines=None, revision=None):
+        #: Revision of the indexed document
+        self.revision = revision
+        #: Number of occurrences of each word
+        self.counts = {}
+        #: Total number of words
+        self.total = 0
+        # words of each line
+        self._lines = []
+        # sorted list of (lower case word, word)
+        self._keys = []
+        self._lock = threading.Lock()
+        if lines is not None:
+            self.rebuild(lines, revision)
+
+    def rebuild(self, lines, revision=None):
+        """
+        Indexes the words of a whole document.
+
+        :param lines: the lines of the document.
+        :param revision: revision of the document.
+        """
+        line_words = [split_line(line) for line in lines]
+        counts = {}
+        for words in line_words:
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+        keys = sorted((word.lower(), word) for word in counts)
+        with self._lock:
+            self._lines = line_words
+            self.counts = counts
+            self.total = sum(len(words) for words in line_words)
+            self._keys = keys
+            self.revision = revision
+
+    def apply(self, changes, revision=None):
+        """
+        Updates the index with line based changes (see
+        :meth:`pyqode.core.backend.documents.Document.apply`).
+
+        :param changes: list of (start, count, lines) tuples.
+        :param revision: revision of the document after the changes.
+        """
+        with self._lock:
+            for start, count, lines in changes:
+                for words in self._lines[start:start + count]:
+                    self._remove(words)
+                new_words = [split_line(line) for line in lines]
+                for words in new_words:
+                    self._add(words)
+                self._lines[start:start + count] = new_words
+            self.revision = revision
+
+    def complete(self, prefix, line=None, limit=None):
+        """
+        Returns the words that start with ``prefix`` (case insensitive), the
+        best ranked first.
+
+        If there are less than ``limit`` such words, the list is completed
+        with the words that contain the prefix.
+
+        :param prefix: the completion prefix, may be empty.
+        :param line: the cursor line (0 based), None to ignore the proximity
+            of the words.
+        :param limit: maximum number of words, None to return all the
+            matching words.
+        :returns: the list of words.
+        """
+        key = prefix.lower()
+        with self._lock:
+            candidates = prefix_matches(self._keys, key)
+            # the word being typed
+            if self.counts.get(prefix) == 1 and prefix in candidates:
+                candidates.remove(prefix)
+            words = self._best(candidates, line, limit)
+            if key and (limit is None or len(words) < limit):
+                others = [word for lower_word, word in self._keys
+                          if key in lower_word and
+                          not lower_word.startswith(key)]
+                words += self._best(
+                    others, line, None if limit is None
+                    else limit - len(words))
+        return words
+
+    def matches(self, prefix):
+        """
+        Returns the words that start with ``prefix`` (case insensitive), in
+        alphabetical order.
+        """
+        with self._lock:
+            return prefix_matches(self._keys, prefix.lower())
+
+    def _best(self, candidates, line, limit):
+        """
+        Returns the best ranked candidates.
+        """
+        distances = {}
+        if line is not None and candidates:
+            wanted = set(candidates)
+            first = max(0, line - self.WINDOW)
+            for i, words in enumerate(
+                    self._lines[first:line + self.WINDOW + 1], first):
+                distance = abs(i - line)
+                for word in words:
+                    if word in wanted and \
+                            distance < distances.get(word, self.WINDOW + 1):
+                        distances[word] = distance
+        counts = self.counts
+        window = float(self.WINDOW)
+        boost = self.PROXIMITY_BOOST
+
+        def score(word):
+            try:
+                distance = distances[word]
+            except KeyError:
+                return counts[word]
+            return counts[word] * (1 + boost * (window - distance) / window)
+
+        if limit is None:
+            return sorted(candidates, key=score, reverse=True)
+        return heapq.nlargest(limit, candidates, key=score)
+
+    def _add(self, words):
+        self.total += len(words)
+        counts = self.counts
+        for word in words:
+            count = counts.get(word, 0)
+            if not count:
+                bisect.insort(self._keys, (word.lower(), word))
+            counts[word] = count + 1
+
+    def _remove(self, words):
+        self.total -= len(words)
+        counts = self.counts
+        for word in words:
+            count = counts[word] - 1
+            if count:
+                counts[word] = count
+            else:
+                del counts[word]
+                key = (word.lower(), word)
+                del self._keys[bisect.bisect_left(self._keys, key)]
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def document_index(doc_id, revision=None):
+    """
+    Returns the up to date word index of a synced document.
+
+    The index is created on first use and then updated from the changes of
+    the document.
+
+    :param doc_id: id of the document.
+    :param revision: revision of the text of the request that uses the
+        index, None for the current revision of the document.
+    :raises: pyqode.core.backend.documents.OutOfSync if the document is not
+        in the store, or if the index cannot be updated to ``revision`` (see
+        :meth:`pyqode.core.backend.documents.DocumentStore.changes`).
+    """
+    # the index is updated under the lock: two requests must not apply the
+    # same changes.
+    with _lock:
+        try:
+            index = _indexes[doc_id]
+        except KeyError:
+            # forget the indexes of the closed documents
+            ids = set(doc.id for doc in documents.store.documents())
+            for key in list(_indexes.keys()):
+                if key not in ids:
+                    del _indexes[key]
+            index = _indexes[doc_id] = WordIndex()
+        revision, changes, lines = documents.store.changes(
+            doc_id, index.revision, revision)
+        if changes is None:
+            index.rebuild(lines, revision)
+        elif changes:
+            index.apply(changes, revision)
+    return index
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the workspace word index, used by
+:class:`pyqode.core.backend.workers.DocumentWordsProvider` to complete the
+words of the other open documents and of the project files.
+
+The index is enabled by passing the project roots to the server::
+
+    editor.backend.start(server_script, args=['--workspace', project_root])
+
+The project files are indexed by a background thread: the first scan indexes
+the most recently modified files first, the next scans (every
+:attr:`WorkspaceIndex.RESCAN_INTERVAL` seconds) only re-index the files whose
+modification time or size changed. The index is saved in a compressed cache
+file (``--workspace-cache``, see :func:`default_cache_path`) and loaded when
+the server starts, so that it is available immediately in the next session.
+
+The memory used by the index is capped (``--workspace-memory``, in MB): once
+the cap is reached, the least recently modified files are left out.
+
+Words are ranked by their weighted number of occurrences:
+
+    - the occurrences of a file are weighted by :meth:`WorkspaceIndex.weight`
+      so that a few very large files (e.g. generated code) do not outweigh
+      the rest of the project;
+    - the words of the documents open in the editor are taken from their up
+      to date text (see :mod:`pyqode.core.backend.words`) instead of the file
+      on disk, and weighted by :attr:`WorkspaceIndex.OPEN_WEIGHT`.
+
+.. warning:: This module runs on the server side, it must keep its
+    dependencies as low as possible and fully support python2 syntax.
+"""
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import zlib
+
+from pyqode.core.backend import documents
+from pyqode.core.backend import words
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+def default_cache_path(roots):
+    """
+    Returns the default path of the cache file of a workspace:
+    ``~/.cache/pyqode/words-<hash of the roots>.cache``.
+    """
+    digest = hashlib.md5(repr(sorted(roots)).encode('utf-8')).hexdigest()
+    return os.path.join(os.path.expanduser('~'), '.cache', 'pyqode',
+                        'words-%s.cache' % digest[:16])
+
+
+class _FileWords(object):
+    """
+    Words of an indexed file.
+    """
+    __slots__ = ['mtime', 'size', 'counts', 'weight', 'memory']
+
+    def __init__(self, mtime, size, counts, weight, memory):
+        self.mtime = mtime
+        self.size = size
+        #: number of occurrences of each word
+        self.counts = counts
+        #: weight of the occurrences
+        self.weight = weight
+        #: estimated memory used by the entry
+        self.memory = memory
+
+
+class WorkspaceIndex(object):
+    """
+    Thread safe index of the words of the files of a workspace.
+
+    :param roots: the root directories of the workspace.
+    :param cache_path: path of the cache file, None to not persist the
+        index.
+    :param max_memory: maximum memory (estimate) used by the index, in bytes.
+    """
+    #: Version of the cache file format
+    CACHE_VERSION = 1
+    #: Name of the directories that are not indexed (hidden directories are
+    #: never indexed).
+    IGNORED_DIRS = set(['__pycache__', 'node_modules', 'build', 'dist',
+                        'venv', 'env'])
+    #: Files larger than this size (bytes) are not indexed
+    MAX_FILE_SIZE = 1024 * 1024
+    #: Number of words above which the weight of a file decreases, see
+    #: :meth:`weight`.
+    FILE_WORDS = 2000
+    #: Weight of the words of the open documents
+    OPEN_WEIGHT = 2.0
+    #: Delay (in seconds) between two scans of the workspace
+    RESCAN_INTERVAL = 60
+    #: Estimated memory used by an entry of a word dict, besides the word
+    ENTRY_SIZE = 100
+
+    def __init__(self, roots, cache_path=None, max_memory=64 * 1024 * 1024):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.cache_path = cache_path
+        self.max_memory = max_memory
+        #: Indexed files: path -> _FileWords
+        self.files = {}
+        #: Number of files left out because of the memory cap
+        self.skipped = 0
+        #: Estimated memory used by the index (bytes)
+        self.memory = 0
+        # weighted occurrences of each word
+        self._scores = {}
+        # number of files that contain each word
+        self._file_counts = {}
+        # sorted list of (lower case word, word)
+        self._keys = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Loads the cache file and starts the background indexing.
+        """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background indexing (the current scan is interrupted).
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def weight(self, word_count):
+        """
+        Returns the weight of the occurrences of a file: 1 for the files of
+        up to :attr:`FILE_WORDS` words, then inversely proportional to the
+        number of words, so that the occurrences of any file weigh at most
+        :attr:`FILE_WORDS`.
+
+        :param word_count: number of words of the file.
+        """
+        return min(1.0, float(self.FILE_WORDS) / max(word_count, 1))
+
+    def complete(self, prefix, limit, path=None, exclude=()):
+        """
+        Returns the best ranked words that start with ``prefix`` (case
+        insensitive).
+
+        :param prefix: the completion prefix, no words are returned for an
+            empty prefix.
+        :param limit: maximum number of words.
+        :param path: path of the current document: its words are not
+            returned, unless they appear in other files.
+        :param exclude: words that must not be returned (e.g. the words
+            already proposed).
+        """
+        key = prefix.lower()
+        if not key or limit <= 0:
+            return []
+        # the open documents supersede their file on disk
+        open_indexes = []
+        open_paths = set([path])
+        for doc in documents.store.documents():
+            open_paths.add(doc.path)
+            if doc.path != path:
+                try:
+                    open_indexes.append(words.document_index(doc.id))
+                except documents.OutOfSync:
+                    pass
+        open_paths = set(os.path.abspath(p) for p in open_paths if p)
+        candidates = set()
+        for doc_index in open_indexes:
+            candidates.update(doc_index.matches(key))
+        scores = {}
+        with self._lock:
+            candidates.update(words.prefix_matches(self._keys, key))
+            superseded = [self.files[p] for p in open_paths
+                          if p in self.files]
+            for word in candidates:
+                if word in exclude or word == prefix:
+                    continue
+                score = self._scores.get(word, 0)
+                for entry in superseded:
+                    score -= entry.weight * entry.counts.get(word, 0)
+                for doc_index in open_indexes:
+                    count = doc_index.counts.get(word, 0)
+                    if count:
+                        score += self.OPEN_WEIGHT * count * self.weight(
+                            doc_index.total)
+                # skip the rounding errors of the words of superseded files
+                if score > 1e-6:
+                    scores[word] = score
+        return heapq.nlargest(limit, sorted(scores), key=scores.get)
+
+    def stats(self):
+        """
+        Returns the statistics of the index::
+
+            {
+                'files': number of indexed files,
+                'words': number of distinct words,
+                'memory': estimated memory used (bytes),
+                'skipped': number of files left out (memory cap)
+            }
+        """
+        with self._lock:
+            return {'files': len(self.files), 'words': len(self._scores),
+                    'memory': self.memory, 'skipped': self.skipped}
+
+    def scan(self):
+        """
+        Indexes the new and modified files of the workspace and forgets the
+        removed ones.
+
+        :returns: True if the index changed.
+        """
+        found = self._list_files()
+        changed = False
+        with self._lock:
+            for path in list(self.files):
+                entry = self.files[path]
+                if (entry.mtime, entry.size) != found.get(path):
+                    self._remove_file(path)
+                    changed = True
+        # memory used by the files kept so far (words included)
+        memory = 0
+        seen = set()
+        skipped = 0
+        # most recent files first: they are kept when the cap is reached
+        for path in sorted(found, key=lambda p: found[p][0], reverse=True):
+            if self._stop.is_set():
+                break
+            with self._lock:
+                entry = self.files.get(path)
+            if entry is None and memory < self.max_memory:
+                counts = self._read_words(path)
+                if counts is None:
+                    continue
+                mtime, size = found[path]
+                entry = self._add_file(path, mtime, size, counts)
+                changed = True
+            if entry is None:
+                skipped += 1
+                continue
+            memory += entry.memory + sum(
+                len(word) + self.ENTRY_SIZE for word in entry.counts
+                if word not in seen)
+            seen.update(entry.counts)
+            if memory > self.max_memory:
+                # over the cap: this file and the older ones are left out
+                with self._lock:
+                    self._remove_file(path)
+                changed = True
+                skipped += 1
+        self.skipped = skipped
+        return changed
+
+    def load(self):
+        """
+        Loads the cache file, if any.
+        """
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+            if data['version'] != self.CACHE_VERSION:
+                return
+            for path, (mtime, size, names, counts) in data['files'].items():
+                self._add_file(path, mtime, size,
+                               dict(zip(names.split(' '), counts)))
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                zlib.error):
+            _logger().warning('failed to load the workspace index %r',
+                              self.cache_path)
+
+    def save(self):
+        """
+        Saves the index in the cache file: a zlib compressed json object
+        that contains, for each file, its modification time, its size, its
+        words (separated by spaces) and their number of occurrences.
+        """
+        if not self.cache_path:
+            return
+        with self._lock:
+            files = {}
+            for path, entry in self.files.items():
+                names = sorted(entry.counts)
+                files[path] = [entry.mtime, entry.size, ' '.join(names),
+                               [entry.counts[name] for name in names]]
+        data = json.dumps({'version': self.CACHE_VERSION, 'files': files})
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            directory = os.path.dirname(self.cache_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(data.encode('utf-8')))
+            if os.path.exists(self.cache_path):
+                os.remove(self.cache_path)
+            os.rename(tmp_path, self.cache_path)
+        except (IOError, OSError):
+            _logger().warning('failed to save the workspace index %r',
+                              self.cache_path)
+
+    def _run(self):
+        self.load()
+        while not self._stop.is_set():
+            try:
+                if self.scan() and not self._stop.is_set():
+                    self.save()
+            except Exception:
+                _logger().exception('failed to index the workspace')
+            self._stop.wait(self.RESCAN_INTERVAL)
+
+    def _list_files(self):
+        """
+        Returns the files of the workspace: path -> (mtime, size).
+        """
+        found = {}
+        for root in self.roots:
+            for directory, dirs, files in os.walk(root):
+                dirs[:] = [name for name in dirs if not name.startswith('.')
+                           and name not in self.IGNORED_DIRS]
+                for name in files:
+                    if name.startswith('.'):
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if stat.st_size <= self.MAX_FILE_SIZE:
+                        found[path] = (stat.st_mtime, stat.st_size)
+        return found
+
+    def _read_words(self, path):
+        """
+        Returns the number of occurrences of the words of a file, None if the
+        file cannot be read or is not a text file.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read(self.MAX_FILE_SIZE + 1)
+        except (IOError, OSError):
+            return None
+        if b'\0' in data[:8192]:
+            return None
+        counts = {}
+        for word in words.split_line(data.decode('utf-8', 'replace')):
+            counts[word] = counts.get(word, 0) + 1
+        return counts
+
+    def _add_file(self, path, mtime, size, counts):
+        """
+        Adds the words of a file to the index (must be called without the
+        lock).
+        """
+        weight = self.weight(sum(counts.values()))
+        memory = sum(len(word) + self.ENTRY_SIZE for word in counts)
+        entry = _FileWords(mtime, size, counts, weight, memory)
+        with self._lock:
+            if path in self.files:
+                self._remove_file(path)
+            self.files[path] = entry
+            self.memory += memory
+            scores = self._scores
+            file_counts = self._file_counts
+            for word, count in counts.items():
+                try:
+                    file_counts[word] += 1
+                except KeyError:
+                    file_counts[word] = 1
+                    scores[word] = 0
+                    bisect.insort(self._keys, (word.lower(), word))
+                    self.memory += len(word) + self.ENTRY_SIZE
+                scores[word] += weight * count
+        return entry
+
+    def _remove_file(self, path):
+        """
+        Removes the words of a file from the index (must be called with the
+        lock).
+        """
+        entry = self.files.pop(path)
+        self.memory -= entry.memory
+        scores = self._scores
+        file_counts = self._file_counts
+        for word, count in entry.counts.items():
+            file_counts[word] -= 1
+            if file_counts[word]:
+                scores[word] -= entry.weight * count
+            else:
+                del file_counts[word]
+                del scores[word]
+                key = (word.lower(), word)
+                del self._keys[bisect.bisect_left(self._keys, key)]
+                self.memory -= len(word) + self.ENTRY_SIZE
+
+
+#: The workspace index of the backend process, None if the server was not
+#: started with ``--workspace``.
+index = None
+
+
+def start(roots, cache_path=None, max_memory=64 * 1024 * 1024):
+    """
+    Creates and starts the workspace index of the backend process.
+
+    :param roots: the root directories of the workspace.
+    :param cache_path: path of the cache file, None to use
+        :func:`default_cache_path`.
+    :param max_memory: maximum memory used by the index, in bytes.
+    :returns: the :class:`WorkspaceIndex`
+    """
+    global index
+    if cache_path is None:
+        cache_path = default_cache_path(roots)
+    index = WorkspaceIndex(roots, cache_path, max_memory)
+    index.start()
+    return index
+
+
+def stop():
+    """
+    Stops the workspace index of the backend process, if any.
+    """
+    global index
+    if index is not None:
+        index.stop()
+        index = None
@@ -1,14 +1,22 @@
 """
 This module contains the backend controller
 """
+import collections
 import logging
+import os
+import shutil
 import socket
 import sys
 import string
 from qtpy import QtCore
-from pyqode.core.api.client import JsonTcpClient, BackendProcess
+from pyqode.core.api.client import (
+    JsonTcpClient, JsonLocalClient, BackendProcess, DocumentSync,
+    local_sockets_supported)
 from pyqode.core.api.manager import Manager
 from pyqode.core.backend import NotRunning, echo_worker
+from pyqode.core.backend import metrics
+from pyqode.core.backend import results as result_cache
+from pyqode.core.backend.server import TRANSPORT_TCP, TRANSPORT_UNIX
 
 
 def _logger():
@@ -34,10 +42,16 @@ class BackendManager(Manager):
         - start
         - stop
         - send_request
+        - send_batch
+        - stats
+
+    Editors can share backend processes (see the ``reuse``, ``share_id`` and
+    ``balance`` parameters of :meth:`start`).
 
     """
     LAST_PORT = {}
     LAST_PROCESS = {}
+    LAST_CLIENT = {}
     SHARE_COUNT = {}
     MAX_SHARE_COUNT = 10
     share_id_count = 0
@@ -46,12 +60,19 @@ class BackendManager(Manager):
     def __init__(self, editor):
         super(BackendManager, self).__init__(editor)
         self._process = None
-        self._sockets = []
+        self._client = None
         self.server_script = None
         self.interpreter = None
         self.args = None
+        #: Transport used to communicate with the backend process
+        self.transport = TRANSPORT_TCP
         self._shared = False
         self._share_id = None
+        #: Callbacks waiting for the statistics of the server
+        self._stats_callbacks = []
+        #: BackendGroup of the editor, if the backend load is balanced
+        self._group = None
+        self._balance = False
         self._heartbeat_timer = QtCore.QTimer()
         self._heartbeat_timer.setInterval(BackendManager.HEARTBEAT_INTERVAL)
         self._heartbeat_timer.timeout.connect(self._send_heartbeat)
@@ -67,7 +88,8 @@ class BackendManager(Manager):
         return free_port
 
     def start(self, script, interpreter=sys.executable, args=None,
-              error_callback=None, reuse=False, share_id=None):
+              error_callback=None, reuse=False, share_id=None,
+              transport=TRANSPORT_TCP, balance=False):
         """
         Starts the backend process.
 
@@ -86,7 +108,9 @@ class BackendManager(Manager):
             script. If None, sys.executable is used unless we are in a frozen
             application (frozen backends do not require an interpreter).
         :param args: list of additional command line args to use to start
-            the backend process.
+            the backend process, e.g. ``['--dispatch', 'concurrent']`` to run
+            the workers in a thread pool (the backend runs one request at a
+            time by default, see :class:`pyqode.core.backend.JsonServer`).
         :param reuse: True to reuse an existing backend process. WARNING: to
             use this, your application must have one single server script. If
             you're creating an app which supports multiple programming
@@ -96,7 +120,22 @@ class BackendManager(Manager):
             be shared, for example for example for different languages. When
             the maximum number of shares is exceeded, a new backend process is
             started automatically.
+        :param transport: ``'tcp'`` (default) to communicate with the backend
+            on a local tcp port, ``'unix'`` to use a unix domain socket,
+            which is faster and does not need to find a free port. Falls back
+            to tcp on platforms that do not support unix domain sockets.
+            Ignored when an existing backend process is reused.
+        :param balance: True to share a group of backend processes between
+            the editors started with the same ``share_id`` (implies
+            ``reuse``): each request is sent to the least busy process and
+            processes are spawned or retired depending on the sustained load
+            instead of the number of editors (see :class:`BackendGroup`).
         """
+        self._balance = balance
+        if balance:
+            self._start_group(script, interpreter, args, error_callback,
+                              share_id, transport)
+            return
         # If no share id is specified, we generate a new unique share id.
         if share_id is None:
             share_id = 'unique{}'.format(BackendManager.share_id_count)
@@ -135,6 +174,9 @@ class BackendManager(Manager):
         if reuse and BackendManager.SHARE_COUNT[self._share_id]:
             self._port = BackendManager.LAST_PORT[self._share_id]
             self._process = BackendManager.LAST_PROCESS[self._share_id]
+            self._client = BackendManager.LAST_CLIENT[self._share_id]
+            self.transport = (TRANSPORT_UNIX if isinstance(
+                self._client, JsonLocalClient) else TRANSPORT_TCP)
             BackendManager.SHARE_COUNT[self._share_id].append(self._editor)
             comm('re-using share_id: {} ({})'.format(
                 self._share_id,
@@ -144,31 +186,114 @@ class BackendManager(Manager):
         if self.running:
             comm('stopping share_id: {}'.format(self._share_id))
             self.stop()
-        backend_script = script.replace('.pyc', '.py')
-        self._port = self.pick_free_port()
-        if hasattr(sys, "frozen") and not backend_script.endswith('.py'):
-            # frozen backend script on windows/mac does not need an
-            # interpreter
-            program = backend_script
-            pgm_args = [str(self._port)]
+        if (self._client is not None and
+                self._client not in BackendManager.LAST_CLIENT.values()):
+            self._client.shutdown()
+        error_callbacks = [error_callback] if error_callback else []
+        backend = BackendPool.take(script, interpreter, args, transport)
+        if backend is None:
+            backend = self._launch(self.editor, script, interpreter, args,
+                                   transport, error_callbacks)
         else:
-            program = interpreter
-            pgm_args = [backend_script, str(self._port)]
-        if args:
-            pgm_args += args
-        self._process = BackendProcess(self.editor)
-        if error_callback:
-            self._process.error.connect(error_callback)
-        self._process.start(program, pgm_args)
+            backend[0].setParent(self.editor)
+            for callback in error_callbacks:
+                backend[0].error.connect(callback)
+        self._process, self._client, self._port, self.transport = backend
         if reuse:
             BackendManager.LAST_PROCESS[self._share_id] = self._process
             BackendManager.LAST_PORT[self._share_id] = self._port
+            BackendManager.LAST_CLIENT[self._share_id] = self._client
             BackendManager.SHARE_COUNT[self._share_id].append(self._editor)
         comm('starting share_id: {} (PID={})'.format(
             self._share_id, self._process.processId()
         ))
         self._heartbeat_timer.start()
 
+    def _start_group(self, script, interpreter, args, error_callback,
+                     share_id, transport):
+        """
+        Starts the backend as a member of a :class:`BackendGroup`.
+        """
+        if share_id is None:
+            share_id = 'unique{}'.format(BackendManager.share_id_count)
+            BackendManager.share_id_count += 1
+        if self.running:
+            self.stop()
+        self._share_id = share_id
+        self._shared = True
+        self.server_script = script
+        self.interpreter = interpreter
+        self.args = args
+        self._group = BackendGroup.join(self, share_id, script, interpreter,
+                                        args, transport, error_callback)
+        self._process, self._client, self._port, self.transport = \
+            self._group.pick()
+        comm('joined backend group: {}'.format(share_id))
+        self._heartbeat_timer.start()
+
+    def _pick_backend(self, *supersede):
+        """
+        Routes the next request of a balanced backend to the least busy
+        process of the group.
+
+        :param supersede: supersede keys of the request(s).
+        """
+        if self._group is None:
+            return
+        for key in supersede:
+            if key is None:
+                continue
+            # the superseded requests may have been sent to another process
+            for process, client, port, transport in self._group.backends:
+                client.supersede(self, key)
+        self._process, self._client, self._port, self.transport = \
+            self._group.pick()
+
+    @staticmethod
+    def _launch(parent, script, interpreter, args, transport,
+                error_callbacks=()):
+        """
+        Starts a backend process and its client.
+
+        :param error_callbacks: callbacks connected to the error signal of
+            the process before it is started, so that they are called if the
+            process fails to start.
+        :returns: a (process, client, port, transport) tuple. The port is the
+            socket path with the unix transport.
+        """
+        backend_script = script.replace('.pyc', '.py')
+        if transport == TRANSPORT_UNIX and not local_sockets_supported():
+            comm('unix domain sockets not supported, falling back to tcp')
+            transport = TRANSPORT_TCP
+        if transport == TRANSPORT_UNIX:
+            # the socket path is passed to the server instead of the port
+            port = JsonLocalClient.pick_socket_path()
+        else:
+            port = BackendManager.pick_free_port()
+        if hasattr(sys, "frozen") and not backend_script.endswith('.py'):
+            # frozen backend script on windows/mac does not need an
+            # interpreter
+            program = backend_script
+            pgm_args = [str(port)]
+        else:
+            program = interpreter
+            pgm_args = [backend_script, str(port)]
+        if transport == TRANSPORT_UNIX:
+            pgm_args += ['--transport', TRANSPORT_UNIX]
+        if args:
+            pgm_args += args
+        process = BackendProcess(parent)
+        for callback in error_callbacks:
+            process.error.connect(callback)
+        process.start(program, pgm_args)
+        # the client connects as soon as the server is listening, requests
+        # sent in the meantime are queued.
+        if transport == TRANSPORT_UNIX:
+            client = JsonLocalClient(process, port)
+        else:
+            client = JsonTcpClient(process, port)
+        return process, client, port, transport
+
     def suspend(self):
         """
         Stops the backend process in such a way that it can be restarted with
@@ -187,13 +312,25 @@ class BackendManager(Manager):
             interpreter=self.interpreter,
             args=self.args,
             reuse=self._shared,
-            share_id=self._share_id
+            share_id=self._share_id,
+            transport=self.transport,
+            balance=self._balance
         )
 
     def stop(self):
         """
         Stops the backend process.
         """
+        self._stats_callbacks[:] = []
+        if self._group is not None:
+            comm('leaving backend group: {}'.format(self._share_id))
+            self._group.leave(self)
+            self._group = None
+            # the processes belong to the group
+            self._process = None
+            self._client = None
+            self._heartbeat_timer.stop()
+            return
         if self._process is None:
             comm('no process to stop for share_id: {}'.format(self._share_id))
             return
@@ -202,6 +339,15 @@ class BackendManager(Manager):
             # this shared backend
             if self._editor in BackendManager.SHARE_COUNT[self._share_id]:
                 BackendManager.SHARE_COUNT[self._share_id].remove(self._editor)
+            # Results of our pending requests must not reach the editor anymore
+            if self._client is not None:
+                self._client.forget(self)
+                try:
+                    self._client.close_document(
+                        DocumentSync.get(self.editor.document()))
+                except (AttributeError, RuntimeError):
+                    # editor already deleted
+                    pass
             # There are still editors using this backend, don't close
             if BackendManager.SHARE_COUNT[self._share_id]:
                 comm('not yet stopping share_id: {} ({})'.format(
@@ -213,11 +359,9 @@ class BackendManager(Manager):
             self._share_id,
             len(BackendManager.SHARE_COUNT[self._share_id])
         ))
-        # close all sockets
-        for s in self._sockets:
-            s._callback = None
-            s.close()
-        self._sockets[:] = []
+        # close the client socket
+        if self._client is not None:
+            self._client.shutdown()
         # prevent crash logs from being written if we are busy killing
         # the process
         self._process._prevent_logs = True
@@ -240,66 +384,232 @@ class BackendManager(Manager):
             else:
                 self._process.terminate()
         self._process._prevent_logs = False
+        if self.transport == TRANSPORT_UNIX:
+            # remove the private directory of the socket
+            shutil.rmtree(os.path.dirname(self._port), ignore_errors=True)
         self._heartbeat_timer.stop()
         comm('stopped share_id: {}'.format(self._share_id))
 
-    def send_request(self, worker_class_or_function, args, on_receive=None):
+    def send_request(self, worker_class_or_function, args, on_receive=None,
+                     document=None, supersede=None, priority=None,
+                     on_partial=None):
         """
         Requests some work to be done by the backend. You can get notified of
         the work results by passing a callback (on_receive).
 
+        The results of the workers that declare themselves pure (``pure =
+        True``) are cached: a request made again for the same text and the
+        same args is answered without reaching the backend (see
+        :mod:`pyqode.core.backend.results` and :meth:`result_cache_stats`).
+
         :param worker_class_or_function: Worker class or function
         :param args: worker args, any Json serializable objects
         :param on_receive: an optional callback executed when we receive the
             worker's results. The callback will be called with one arguments:
             the results of the worker (object)
+        :param document: name of the ``args`` key the worker expects to
+            contain the editor text (e.g. ``'code'``). Instead of sending the
+            whole text with every request, the backend keeps a copy of the
+            document that is updated with the edits made since the previous
+            request. ``args`` must be a dict.
+        :param supersede: an optional key (e.g. the mode that sends the
+            request): the pending requests of the editor that were sent with
+            the same key are cancelled. Use it for requests whose results
+            are outdated as soon as a new request is made (code completion,
+            search,...), the backend does not waste time computing them.
+        :param priority: an optional priority: ``'interactive'`` for the
+            requests the user is waiting for, ``'background'`` for the
+            requests whose results can wait (e.g. checkers). Default is
+            ``'normal'``. See :mod:`pyqode.core.backend.scheduler`.
+        :param on_partial: an optional callback called with each chunk of
+            results of a generator worker as soon as it is available, e.g. to
+            show the first results of a long search. ``on_receive`` is still
+            called with all the results once the worker is done.
         """
         if not self.running:
-            if not BackendManager.SHARE_COUNT.get(self._share_id, []):
-                comm('not restarting unused share_id: {}'.format(
-                    self._share_id)
-                )
-                self._heartbeat_timer.stop()
-                return
-            comm('restarting share_id: {}'.format(self._share_id))
-            try:
-                # try to restart the backend if it crashed.
-                self.start(
-                    self.server_script,
-                    interpreter=self.interpreter,
-                    args=self.args,
-                    reuse=self._shared,
-                    share_id=self._share_id
-                )
-            except AttributeError as e:
-                comm('failed to restart share_id: {}, Exception: {}'.format(
-                    self._share_id, e
-                ))
+            self._restart()
+            return
+        self._pick_backend(supersede)
+        if document is not None:
+            sync = DocumentSync.get(self.editor.document())
+            sync.path = self.editor.file.path
+            document = (sync, document)
+        # the request is multiplexed on the persistent client connection, it
+        # will be written as soon as the client is connected.
+        self._client.request(worker_class_or_function, args,
+                             on_receive=on_receive, owner=self,
+                             document=document, supersede=supersede,
+                             priority=priority, on_partial=on_partial)
+        # restart heartbeat timer
+        self._heartbeat_timer.start()
+
+    def cancel(self, supersede):
+        """
+        Cancels the pending requests of the editor that were sent with a
+        supersede key (see :meth:`send_request`), e.g. a search whose results
+        are not wanted anymore. Their callbacks won't be called.
+
+        :param supersede: the supersede key of the requests.
+        """
+        if self._group is not None:
+            clients = [backend[1] for backend in self._group.backends]
+        else:
+            clients = [self._client] if self._client is not None else []
+        for client in clients:
+            client.supersede(self, supersede)
+
+    def send_batch(self, requests, on_receive=None, priority=None):
+        """
+        Sends several requests in a single round trip, e.g. the requests of
+        the modes that analyse the document after a pause in typing. The
+        editor text is shipped once for all the requests that need it and
+        each request is still answered (and its callback called) as soon as
+        its worker has run.
+
+        E.g.::
+
+            editor.backend.send_batch([
+                {'worker': checker_worker, 'args': {'path': path},
+                 'document': 'code', 'on_receive': self._on_checked},
+                {'worker': findall, 'args': {'sub': word, ...},
+                 'document': 'string', 'on_receive': self._on_found,
+                 'priority': 'interactive'}
+            ], priority='background')
+
+        :param requests: list of dicts, one per request. The dicts have the
+            keys ``worker`` and ``args`` and may have the keys
+            ``on_receive``, ``document``, ``supersede``, ``priority`` and
+            ``on_partial``, which have the same meaning as the corresponding
+            arguments of :meth:`send_request`.
+        :param on_receive: an optional callback called with the list of the
+            results (in the order of ``requests``) once all the requests have
+            been answered. It is not called if one of the requests is
+            cancelled.
+        :param priority: default priority of the requests.
+        """
+        if not self.running:
+            self._restart()
             return
-        # create a socket, the request will be send as soon as the socket
-        # has connected
-        socket = JsonTcpClient(
-            self.editor, self._port, worker_class_or_function, args,
-            on_receive=on_receive)
-        socket.finished.connect(self._rm_socket)
-        self._sockets.append(socket)
+        self._pick_backend(*[entry.get('supersede') for entry in requests])
+        sync = None
+        if any(entry.get('document') is not None for entry in requests):
+            sync = DocumentSync.get(self.editor.document())
+            sync.path = self.editor.file.path
+        self._client.request_batch(requests, on_receive=on_receive,
+                                   owner=self, sync=sync, priority=priority)
         # restart heartbeat timer
         self._heartbeat_timer.start()
 
+    def _restart(self):
+        """
+        Restarts the backend if it crashed and if it is still used.
+        """
+        if self._group is not None:
+            comm('restarting a process of backend group: {}'.format(
+                self._share_id))
+            self._group.spawn()
+            return
+        if not BackendManager.SHARE_COUNT.get(self._share_id, []):
+            comm('not restarting unused share_id: {}'.format(
+                self._share_id)
+            )
+            self._heartbeat_timer.stop()
+            return
+        comm('restarting share_id: {}'.format(self._share_id))
+        try:
+            # try to restart the backend if it crashed.
+            self.start(
+                self.server_script,
+                interpreter=self.interpreter,
+                args=self.args,
+                reuse=self._shared,
+                share_id=self._share_id,
+                transport=self.transport
+            )
+        except AttributeError as e:
+            comm('failed to restart share_id: {}, Exception: {}'.format(
+                self._share_id, e
+            ))
+
+    def result_cache_stats(self):
+        """
+        Returns the statistics of the client cache of the results of the pure
+        workers (see :meth:`pyqode.core.backend.results.ResultCache.stats`),
+        None if the backend is not started.
+
+        The statistics of the backend cache can be requested with::
+
+            from pyqode.core.backend import results
+
+            editor.backend.send_request(results.STATS_WORKER, {},
+                                        on_receive=callback)
+        """
+        if self._client is None:
+            return None
+        return self._client.result_cache.stats()
+
+    def stats(self, on_receive=None):
+        """
+        Returns the statistics of the client::
+
+            {
+                'workers': round trip latency of the requests, per worker
+                           (see :mod:`pyqode.core.backend.metrics`),
+                'result_cache': statistics of the result cache (see
+                                :meth:`result_cache_stats`),
+                'pending': number of requests waiting for their results
+            }
+
+        or None if the backend is not started. If the load is balanced
+        between several processes, the ``'group'`` key gives the statistics
+        of the processes (see :meth:`BackendGroup.stats`) and the server
+        statistics are those of the least busy process.
+
+        The round trip latency is measured from the moment a request is sent
+        to the moment its callback is called (requests answered from the
+        result cache are not recorded).
+
+        :param on_receive: an optional callback, the statistics of the
+            server are requested (see
+            :meth:`pyqode.core.backend.server.RequestDispatcher.stats`) and
+            the callback is called with the statistics of both sides:
+            ``{'client': client stats, 'server': server stats}``.
+            Contrary to the callbacks of :meth:`send_request`, a strong
+            reference to the callback is kept until it is called.
+        """
+        if self._client is None:
+            return None
+        stats = {
+            'workers': self._client.metrics.stats(),
+            'result_cache': self._client.result_cache.stats(),
+            'pending': self._client.pending_count
+        }
+        if self._group is not None:
+            stats['pending'] = sum(
+                client.pending_count for process, client, port, transport
+                in self._group.backends)
+            stats['group'] = self._group.stats()
+        if on_receive is not None:
+            self._stats_callbacks.append(on_receive)
+            self.send_request(metrics.METRICS_WORKER, {},
+                              on_receive=self._on_server_stats)
+        return stats
+
+    def _on_server_stats(self, server_stats):
+        if not self._stats_callbacks:
+            # backend stopped
+            return
+        callback = self._stats_callbacks.pop(0)
+        client_stats = self.stats()
+        if client_stats is not None:
+            callback({'client': client_stats, 'server': server_stats})
+
     def _send_heartbeat(self):
         try:
             self.send_request(echo_worker, {'heartbeat': True})
         except NotRunning:
             self._heartbeat_timer.stop()
 
-    def _rm_socket(self, socket):
-        try:
-            socket.close()
-            self._sockets.remove(socket)
-            socket.deleteLater()
-        except ValueError:
-            pass
-
     @property
     def running(self):
         """
@@ -307,6 +617,8 @@ class BackendManager(Manager):
 
         :return: True if the process is running, otherwise False
         """
+        if self._group is not None:
+            return self._group.running
         try:
             return (self._process is not None and
                     self._process.state() != self._process.NotRunning)
@@ -318,9 +630,9 @@ class BackendManager(Manager):
         """
         Checks if the client socket is connected to the backend.
 
-        .. deprecated: Since v2.3, a socket is created per request. Checking
-            for global connection status does not make any sense anymore. This
-            property now returns ``running``. This will be removed in v2.5
+        .. deprecated: Since v2.3, checking for global connection status does
+            not make any sense anymore. This property now returns ``running``.
+            This will be removed in v2.5
         """
         return self.running
 
@@ -334,4 +646,421 @@ class BackendManager(Manager):
         if self.running:
             return None
         else:
-            return self._process.exitCode()
\ No newline at end of file
+            return self._process.exitCode()
+
+
+class BackendPool(object):
+    """
+    Process wide pool of backend processes started ahead of time.
+
+    Starting a backend takes time: the interpreter has to start and to
+    import pyqode and the workers before the first request can be answered.
+    The pool starts backend processes in advance (e.g. while the application
+    is restoring its session), :meth:`BackendManager.start` then picks a
+    ready process from the pool instead of launching a new one, and the pool
+    is refilled in the background. E.g.::
+
+        BackendPool.prewarm(server_script, count=4)
+        ...
+        editor.backend.start(server_script)  # instant
+
+    A pooled process is only used by a start request with the same script,
+    interpreter, args and transport. Idle pooled processes are kept alive
+    with heartbeats, they are stopped by :meth:`clear` (called automatically
+    when the application quits).
+
+    Use :meth:`stats` to check the efficiency of the pool.
+    """
+    #: Number of start requests served by the pool
+    hits = 0
+    #: Number of start requests of a prewarmed configuration that found the
+    #: pool empty
+    misses = 0
+    #: Delay between two processes started to refill the pool (ms), so that
+    #: the refill does not compete with the editors for the cpu.
+    REFILL_DELAY = 500
+    _sizes = {}
+    _ready = {}
+    _refilling = set()
+    _heartbeat_timer = None
+
+    @staticmethod
+    def _key(script, interpreter, args, transport):
+        return script, interpreter, tuple(args or []), transport
+
+    @classmethod
+    def prewarm(cls, script, count=2, interpreter=sys.executable, args=None,
+                transport=TRANSPORT_TCP):
+        """
+        Starts ``count`` backend processes and keeps the pool filled with
+        ``count`` processes for this configuration.
+
+        The parameters are the same as the parameters of
+        :meth:`BackendManager.start`.
+        """
+        key = cls._key(script, interpreter, args, transport)
+        cls._sizes[key] = count
+        if cls._heartbeat_timer is None:
+            cls._heartbeat_timer = QtCore.QTimer()
+            cls._heartbeat_timer.setInterval(
+                BackendManager.HEARTBEAT_INTERVAL)
+            cls._heartbeat_timer.timeout.connect(cls._send_heartbeats)
+            app = QtCore.QCoreApplication.instance()
+            if app is not None:
+                app.aboutToQuit.connect(cls.clear)
+        cls._heartbeat_timer.start()
+        ready = cls._ready.setdefault(key, [])
+        while len(ready) < count:
+            ready.append(cls._launch(key))
+
+    @classmethod
+    def take(cls, script, interpreter, args, transport):
+        """
+        Takes a ready backend out of the pool.
+
+        :returns: a (process, client, port, transport) tuple or None if the
+            pool has no process for this configuration.
+        """
+        key = cls._key(script, interpreter, args, transport)
+        if key not in cls._sizes:
+            return None
+        ready = cls._ready.get(key, [])
+        while ready:
+            backend = ready.pop(0)
+            process = backend[0]
+            if process.state() == process.NotRunning:
+                # failed to start, crashed or killed while waiting in the
+                # pool
+                _logger().warning(
+                    'pooled backend process is not running (%s, exit code '
+                    '%d), discarding it', process.errorString(),
+                    process.exitCode())
+                cls._discard(backend)
+                continue
+            cls.hits += 1
+            comm('backend pool hit (PID=%d)', process.processId())
+            cls._schedule_refill(key)
+            return backend
+        cls.misses += 1
+        comm('backend pool miss')
+        cls._schedule_refill(key)
+        return None
+
+    @classmethod
+    def clear(cls):
+        """
+        Stops all the idle processes of the pool and stops prewarming.
+        """
+        cls._sizes.clear()
+        cls._refilling.clear()
+        for ready in cls._ready.values():
+            for backend in ready:
+                cls._discard(backend)
+        cls._ready.clear()
+        if cls._heartbeat_timer is not None:
+            cls._heartbeat_timer.stop()
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns the pool statistics::
+
+            {
+                'hits': number of start requests served by the pool,
+                'misses': number of start requests that found the pool empty,
+                'ready': number of idle processes in the pool
+            }
+        """
+        return {'hits': cls.hits, 'misses': cls.misses,
+                'ready': sum(len(r) for r in cls._ready.values())}
+
+    @staticmethod
+    def _launch(key):
+        script, interpreter, args, transport = key
+        return BackendManager._launch(
+            None, script, interpreter, list(args), transport)
+
+    @classmethod
+    def _schedule_refill(cls, key):
+        if key not in cls._refilling:
+            cls._refilling.add(key)
+            QtCore.QTimer.singleShot(cls.REFILL_DELAY,
+                                     lambda: cls._refill(key))
+
+    @classmethod
+    def _refill(cls, key):
+        """ Starts one process, then schedules the next one if needed. """
+        cls._refilling.discard(key)
+        ready = cls._ready.setdefault(key, [])
+        if len(ready) < cls._sizes.get(key, 0):
+            ready.append(cls._launch(key))
+            cls._schedule_refill(key)
+
+    @classmethod
+    def _send_heartbeats(cls):
+        for ready in cls._ready.values():
+            for process, client, port, transport in ready:
+                client.request(echo_worker, {'heartbeat': True})
+
+    @staticmethod
+    def _discard(backend):
+        process, client, port, transport = backend
+        client.shutdown()
+        process._prevent_logs = True
+        process.terminate()
+        process.waitForFinished(1000)
+        if transport == TRANSPORT_UNIX:
+            shutil.rmtree(os.path.dirname(port), ignore_errors=True)
+
+
+class BackendGroup(object):
+    """
+    Backend processes shared by the editors of a share group, with a load
+    aware dispatch (see the ``balance`` parameter of
+    :meth:`BackendManager.start`).
+
+    Every request is routed to the least busy process of the group: the
+    process with the lowest load score, ``(in flight requests + 1) * recent
+    round trip latency``. The group also adapts its number of processes to
+    the sustained load, the average number of in flight requests per
+    process, sampled every :attr:`SAMPLE_INTERVAL` ms:
+
+        - a process is spawned when the load stayed above :attr:`SPAWN_LOAD`
+          for :attr:`SUSTAINED_SAMPLES` samples (up to
+          :attr:`MAX_PROCESSES`);
+        - a process is retired when the load stayed below
+          :attr:`RETIRE_LOAD` (down to :attr:`MIN_PROCESSES`). A retired
+          process does not receive new requests, it is stopped once its
+          pending requests have been answered.
+
+    The processes of a group share the result cache of the pure workers and
+    the metrics of the client. The editor documents are synced with a process
+    the first time it receives a request for them.
+    """
+    #: Groups by share id
+    GROUPS = {}
+    #: Minimum number of processes of a group
+    MIN_PROCESSES = 1
+    #: Maximum number of processes of a group
+    MAX_PROCESSES = 4
+    #: Interval between two samples of the load (ms)
+    SAMPLE_INTERVAL = 1000
+    #: Number of consecutive samples needed to spawn or retire a process
+    SUSTAINED_SAMPLES = 5
+    #: Load (in flight requests per process) above which a process is spawned
+    SPAWN_LOAD = 2.0
+    #: Load below which a process is retired
+    RETIRE_LOAD = 0.25
+    #: Latency used in the load score of the processes that did not answer
+    #: any request yet (s)
+    MIN_LATENCY = 0.001
+
+    def __init__(self, share_id, script, interpreter, args, transport):
+        self.share_id = share_id
+        self._key = BackendPool._key(script, interpreter, args, transport)
+        #: (process, client, port, transport) of the processes that receive
+        #: requests
+        self.backends = []
+        #: BackendManager of the editors of the group
+        self.members = []
+        #: Number of processes spawned and retired because of the load
+        self.spawned = 0
+        self.retired = 0
+        self._retiring = []
+        self._samples = collections.deque(maxlen=self.SUSTAINED_SAMPLES)
+        self._error_callbacks = []
+        self.result_cache = result_cache.ResultCache(
+            JsonTcpClient.result_cache_size)
+        self.metrics = metrics.Metrics()
+        self._sample_timer = QtCore.QTimer()
+        self._sample_timer.setInterval(self.SAMPLE_INTERVAL)
+        self._sample_timer.timeout.connect(self._sample)
+        self._heartbeat_timer = QtCore.QTimer()
+        self._heartbeat_timer.setInterval(BackendManager.HEARTBEAT_INTERVAL)
+        self._heartbeat_timer.timeout.connect(self._send_heartbeats)
+
+    @classmethod
+    def join(cls, manager, share_id, script, interpreter, args, transport,
+             error_callback=None):
+        """
+        Adds an editor to a group, creates the group (and starts its
+        processes) if needed.
+
+        :param manager: the BackendManager of the editor.
+        :returns: the group
+        """
+        try:
+            group = cls.GROUPS[share_id]
+        except KeyError:
+            group = cls(share_id, script, interpreter, args, transport)
+            cls.GROUPS[share_id] = group
+            comm('new backend group: {}'.format(share_id))
+        if error_callback:
+            group._error_callbacks.append(error_callback)
+            for process, client, port, transport in group.backends:
+                process.error.connect(error_callback)
+        group.members.append(manager)
+        while len(group.backends) < group.MIN_PROCESSES:
+            group.spawn()
+        group._sample_timer.start()
+        group._heartbeat_timer.start()
+        return group
+
+    def leave(self, manager):
+        """
+        Removes an editor from the group, stops the processes of the group
+        if it was the last one.
+        """
+        if manager in self.members:
+            self.members.remove(manager)
+        for process, client, port, transport in self.backends + \
+                self._retiring:
+            # results of the pending requests must not reach the editor
+            client.forget(manager)
+            try:
+                client.close_document(
+                    DocumentSync.get(manager.editor.document()))
+            except (AttributeError, RuntimeError):
+                # editor already deleted
+                pass
+        if not self.members:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        Stops all the processes of the group.
+        """
+        comm('stopping backend group: {}'.format(self.share_id))
+        self._sample_timer.stop()
+        self._heartbeat_timer.stop()
+        for backend in self.backends + self._retiring:
+            BackendPool._discard(backend)
+        self.backends[:] = []
+        self._retiring[:] = []
+        if BackendGroup.GROUPS.get(self.share_id) is self:
+            del BackendGroup.GROUPS[self.share_id]
+
+    @property
+    def running(self):
+        """ Tells whether one of the processes of the group is running """
+        self._discard_dead()
+        return bool(self.backends)
+
+    def pick(self):
+        """
+        Returns the least busy process of the group, as a (process, client,
+        port, transport) tuple, None if no process is running.
+        """
+        self._discard_dead()
+        if not self.backends:
+            return None
+        return min(self.backends, key=self._score)
+
+    def spawn(self):
+        """
+        Adds a process to the group (taken from the :class:`BackendPool` if
+        possible).
+        """
+        backend = BackendPool.take(*self._key)
+        if backend is None:
+            script, interpreter, args, transport = self._key
+            backend = BackendManager._launch(
+                None, script, interpreter, list(args), transport,
+                self._error_callbacks)
+        else:
+            for callback in self._error_callbacks:
+                backend[0].error.connect(callback)
+        process, client = backend[:2]
+        client.result_cache = self.result_cache
+        client.metrics = self.metrics
+        self.backends.append(backend)
+        self.spawned += 1
+        comm('backend group {}: {} processes'.format(
+            self.share_id, len(self.backends)))
+
+    def retire(self):
+        """
+        Stops sending requests to the least busy process of the group, it is
+        stopped once its pending requests have been answered.
+        """
+        # prefer the most recent processes
+        backend = min(reversed(self.backends),
+                      key=lambda b: b[1].pending_count)
+        self.backends.remove(backend)
+        self._retiring.append(backend)
+        self.retired += 1
+        comm('backend group {}: {} processes'.format(
+            self.share_id, len(self.backends)))
+
+    def stats(self):
+        """
+        Returns the statistics of the group::
+
+            {
+                'processes': [{'pid': process id,
+                               'pending': number of in flight requests,
+                               'latency': recent round trip latency}, ...],
+                'retiring': number of processes waiting to be stopped,
+                'spawned': number of processes spawned,
+                'retired': number of processes retired
+            }
+        """
+        return {
+            'processes': [{'pid': process.processId(),
+                           'pending': client.pending_count,
+                           'latency': client.latency}
+                          for process, client, port, transport in
+                          self.backends],
+            'retiring': len(self._retiring),
+            'spawned': self.spawned,
+            'retired': self.retired
+        }
+
+    def _score(self, backend):
+        client = backend[1]
+        return (client.pending_count + 1) * max(client.latency,
+                                                self.MIN_LATENCY)
+
+    def _discard_dead(self):
+        for backend in list(self.backends):
+            process = backend[0]
+            try:
+                dead = process.state() == process.NotRunning
+            except RuntimeError:
+                dead = True
+            if dead:
+                comm('backend group {}: process crashed'.format(
+                    self.share_id))
+                self.backends.remove(backend)
+                BackendPool._discard(backend)
+
+    def _sample(self):
+        """
+        Samples the load, spawns or retires a process if the load is
+        sustained.
+        """
+        for backend in list(self._retiring):
+            if not backend[1].pending_count:
+                self._retiring.remove(backend)
+                BackendPool._discard(backend)
+        self._discard_dead()
+        if not self.backends:
+            return
+        load = sum(client.pending_count for process, client, port,
+                   transport in self.backends) / float(len(self.backends))
+        self._samples.append(load)
+        if len(self._samples) < self._samples.maxlen:
+            return
+        if (min(self._samples) >= self.SPAWN_LOAD and
+                len(self.backends) < self.MAX_PROCESSES):
+            self.spawn()
+            self._samples.clear()
+        elif (max(self._samples) <= self.RETIRE_LOAD and
+                len(self.backends) > self.MIN_PROCESSES):
+            self.retire()
+            self._samples.clear()
+
+    def _send_heartbeats(self):
+        for process, client, port, transport in self.backends + \
+                self._retiring:
+            client.request(echo_worker, {'heartbeat': True})
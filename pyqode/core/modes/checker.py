@@ -398,7 +398,6 @@ class CheckerMode(Mode, QtCore.QObject):
         except KeyError:
             max_line_length = 79
         request_data = {
-            'code': self.editor.toPlainText(),
             'path': self.editor.file.path,
             'encoding': self.editor.file.encoding,
             'ignore_rules': self.ignore_rules,
@@ -407,7 +406,8 @@ class CheckerMode(Mode, QtCore.QObject):
         request_data.update(self._extra_info)
         try:
             self.editor.backend.send_request(
-                self._worker, request_data, on_receive=self._on_work_finished)
+                self._worker, request_data, on_receive=self._on_work_finished,
+                document='code', priority='background')
             self._finished = False
         except NotRunning:
             # retry later
@@ -173,6 +173,11 @@ class CodeCompletionMode(Mode, QtCore.QObject):
     #: powerful filter mode but also the SLOWEST.
     FILTER_FUZZY = 2
 
+    #: Time (seconds) the completion providers have to return their
+    #: completions before the popup is shown. The completions of the slower
+    #: providers are added to the popup when they arrive.
+    DEADLINE = 0.2
+
     @property
     def filter_mode(self):
         """
@@ -313,7 +318,9 @@ class CodeCompletionMode(Mode, QtCore.QObject):
         self._char_width = None
         self._show_tooltips = False
         self._request_id = self._last_request_id = 0
-        self._working = False
+        # id of the last request whose results were streamed
+        self._partial_request_id = None
+        self._partial_context = None
         self._stylesheet_initialized = False
 
     def clone_settings(self, original):
@@ -474,7 +481,6 @@ class CodeCompletionMode(Mode, QtCore.QObject):
         self.editor.setTextCursor(cursor)
 
     def _on_results_available(self, results):
-        self._working = False
         debug("completion results (completions=%r), prefix=%s",
                         results, self.completion_prefix)
         context = results[0]
@@ -484,17 +490,61 @@ class CodeCompletionMode(Mode, QtCore.QObject):
         debug('latest context: %r', (self._last_cursor_line,
                                                self._last_cursor_column,
                                                self._request_id))
+        if request_id == self._partial_request_id:
+            # the completions have already been shown chunk by chunk
+            return
         self._last_request_id = request_id
         if (line == self._last_cursor_line and
                 column == self._last_cursor_column):
             if self.editor:
-                all_results = []
-                for res in results:
-                    all_results += res
-                self._show_completions(all_results)
+                self._show_completions(self._merge([], results))
         else:
             debug('outdated request, dropping')
 
+    def _on_partial_results(self, results):
+        if self._is_late_chunk(results):
+            # completions of a provider that missed the deadline
+            if self._partial_context is None:
+                return
+            line, column, request_id = self._partial_context
+            if (request_id == self._request_id - 1 and
+                    line == self._last_cursor_line and
+                    column == self._last_cursor_column and self.editor):
+                debug('late completions: %r', results)
+                self._show_completions(
+                    self._merge(self._completions or [], results))
+            return
+        self._partial_request_id = None
+        self._on_results_available(results)
+        self._partial_context = results[0]
+        self._partial_request_id = results[0][2]
+
+    @staticmethod
+    def _is_late_chunk(results):
+        """
+        Checks if a chunk of results contains late completions: the first
+        chunk starts with the request context (line, column, request id),
+        the next chunks only contain lists of completions.
+        """
+        return all(isinstance(item, list) and
+                   all(isinstance(completion, dict) for completion in item)
+                   for item in results)
+
+    @staticmethod
+    def _merge(completions, groups):
+        """
+        Returns the completions followed by the completions of each group,
+        without duplicate names.
+        """
+        names = set(completion['name'] for completion in completions)
+        completions = list(completions)
+        for group in groups:
+            for completion in group:
+                if completion['name'] not in names:
+                    names.add(completion['name'])
+                    completions.append(completion)
+        return completions
+
     #
     # Helper methods
     #
@@ -509,9 +559,6 @@ class CodeCompletionMode(Mode, QtCore.QObject):
         self._hide_popup()
 
     def request_completion(self, triggered_by_symbol=False):
-        if self._working:
-            return
-        self._working = True
         line = self._helper.current_line_nbr()
         column = self._helper.current_column_nbr() - \
             len(self.completion_prefix)
@@ -529,19 +576,21 @@ class CodeCompletionMode(Mode, QtCore.QObject):
             return True
         debug('requesting completion')
         data = {
-            'code': self.editor.toPlainText(),
             'line': line,
             'column': column,
             'path': self.editor.file.path,
             'encoding': self.editor.file.encoding,
             'prefix': self.completion_prefix,
             'request_id': self._request_id,
-            'triggered_by_symbol': triggered_by_symbol
+            'triggered_by_symbol': triggered_by_symbol,
+            'deadline': self.DEADLINE
         }
         try:
             self.editor.backend.send_request(
                 backend.CodeCompletionWorker, args=data,
-                on_receive=self._on_results_available)
+                on_receive=self._on_results_available, document='code',
+                supersede=self, priority='interactive',
+                on_partial=self._on_partial_results)
         except NotRunning:
             _logger().exception('failed to send the completion request')
             return False
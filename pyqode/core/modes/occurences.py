@@ -4,6 +4,7 @@ This module contains the occurrences highlighter mode.
 from qtpy import QtGui
 from pyqode.core.api import Mode, DelayJobRunner, TextHelper, TextDecoration
 from pyqode.core.backend import NotRunning
+from pyqode.core.backend import search
 from pyqode.core.backend.workers import findall
 
 
@@ -12,6 +13,9 @@ class OccurrencesHighlighterMode(Mode):
 
     The ``delay`` before searching for occurrences is configurable.
     """
+    #: Maximum number of highlighted occurrences
+    MAX_RESULTS = 500
+
     @property
     def delay(self):
         """
@@ -140,25 +144,26 @@ class OccurrencesHighlighterMode(Mode):
             select_whole_word=True).selectedText()
         if not cursor.hasSelection() or cursor.selectedText() == self._sub:
             request_data = {
-                'string': self.editor.toPlainText(),
                 'sub': self._sub,
                 'regex': False,
                 'whole_word': True,
-                'case_sensitive': self.case_sensitive
+                'case_sensitive': self.case_sensitive,
+                'packed': True,
+                'max_results': self.MAX_RESULTS
             }
             try:
-                self.editor.backend.send_request(findall, request_data,
-                                                 self._on_results_available)
+                self.editor.backend.send_request(
+                    findall, request_data, self._on_results_available,
+                    document='string', supersede=self)
             except NotRunning:
                 self._request_highlight()
 
     def _on_results_available(self, results):
-        if len(results) > 500:
-            # limit number of results (on very big file where a lots of
-            # occurrences can be found, this would totally freeze the editor
-            # during a few seconds, with a limit of 500 we can make sure
-            # the editor will always remain responsive).
-            results = results[:500]
+        # the number of results is limited by the backend (on very big file
+        # where a lots of occurrences can be found, this would totally freeze
+        # the editor during a few seconds, with a limit of 500 we can make
+        # sure the editor will always remain responsive).
+        results = search.unpack(results)[:self.MAX_RESULTS]
         current = self.editor.textCursor().position()
         if len(results) > 1:
             for start, end in results:
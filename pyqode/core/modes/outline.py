@@ -61,14 +61,14 @@ class OutlineMode(Mode, QtCore.QObject):
             return
         if self.enabled:
             request_data = {
-                'code': self.editor.toPlainText(),
                 'path': self.editor.file.path,
                 'encoding': self.editor.file.encoding
             }
             try:
                 self.editor.backend.send_request(
                     self._worker, request_data,
-                    on_receive=self._on_results_available)
+                    on_receive=self._on_results_available, document='code',
+                    priority='background')
             except NotRunning:
                 QtCore.QTimer.singleShot(100, self._run_analysis)
         else:
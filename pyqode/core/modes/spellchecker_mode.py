@@ -7,53 +7,47 @@ from pyqode.core.modes import CheckerMode
 
 
 WARNING = 1
-WORD_PATTERN = r'(?P<word>\w\w\w+)'
 
 
 def run_spellcheck(request_data):
+    """
+    Spell checks a document, see :mod:`pyqode.core.backend.spelling`.
 
-    import re
-    import string
+    The verdicts of the spell checker are cached across requests, and only
+    the lines changed since the previous request of a synced document are
+    checked.
+    """
+    from pyqode.core.backend import documents
+    from pyqode.core.backend import spelling
 
-    global sc
+    global dictionary
     try:
-        sc
+        dictionary
     except NameError:
         print('initializing spellchecker')
         import spellchecker
-        sc = spellchecker.SpellChecker(request_data.get('language', 'en'))
+        dictionary = spelling.Dictionary(spellchecker.SpellChecker(
+            request_data.get('language', 'en')))
     ignore = request_data.get('ignore', [])
-    messages = []
-    code = request_data['code']
-    for group in re.finditer(WORD_PATTERN, code):
-        # Strip off starting and trailing underscores. This could probably
-        # be included in the regular expression, but this is easier.
-        word = group.group('word')
-        end = group.end()
-        if word.startswith('__'):
-            word = word[2:]
-        if word.endswith('__'):
-            word = word[:-2]
-            end -= 2
-        # Ignore words that start with a digit, that are in the ignore list, or
-        # that are part of the dictionary
-        if (
-            word[0] in string.digits or
-            word in ignore or
-            not sc.unknown([word])
-        ):
-            continue
-        # Convert the position to a line number and a start and end position
-        # in the line.
-        line_nr = code[:end].count('\n')
-        line_pos = code[:end].rfind('\n') + 1
-        messages.append((
-            '[spellcheck] {}'.format(word),
-            WARNING,
-            line_nr,
-            (end - len(word) - line_pos, end - line_pos)
-        ))
-    return messages
+    messages = None
+    try:
+        handle = request_data['document']
+        # the index is checked at the revision of the request text
+        index = spelling.document_index(
+            handle['id'], dictionary, handle['revision'])
+        messages = index.messages(ignore)
+        if index.revision != handle['revision']:
+            # updated for a newer request meanwhile
+            messages = None
+    except (KeyError, TypeError, documents.OutOfSync):
+        pass
+    if messages is None:
+        messages = spelling.SpellIndex(
+            dictionary, request_data['code'].split('\n')).messages(ignore)
+    return [
+        ('[spellcheck] {}'.format(word), WARNING, line_nr, (start, end))
+        for word, line_nr, start, end in messages
+    ]
 
 
 class SpellCheckerMode(CheckerMode):
@@ -12,7 +12,8 @@ from pyqode.core.api.decoration import TextDecoration
 from pyqode.core.api.panel import Panel
 from pyqode.core.api.utils import DelayJobRunner, TextHelper
 from pyqode.core.backend import NotRunning
-from pyqode.core.backend.workers import findall
+from pyqode.core.backend import search
+from pyqode.core.backend.workers import findall, findall_chunks
 
 NAVIGATION_KEYS = (
     QtCore.Qt.Key_Up,
@@ -155,6 +156,10 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         self._bg = None
         self._fg = None
         self._working = False
+        #: Number of occurrences received so far for the current search
+        self._nb_partial = 0
+        # end of the last occurrence received (to unpack the next chunk)
+        self._packed_end = 0
         self._update_buttons(txt="")
         self.lineEditSearch.installEventFilter(self)
         self.lineEditReplace.installEventFilter(self)
@@ -600,30 +605,69 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         regex, case_sensitive, whole_word, in_selection = flags
         tc = self.editor.textCursor()
         assert isinstance(tc, QtGui.QTextCursor)
-        if in_selection and tc.hasSelection():
-            text = tc.selectedText()
-            self._offset = tc.selectionStart()
-        else:
-            text = self.editor.toPlainText()
-            self._offset = 0
         request_data = {
-            'string': text,
             'sub': sub,
             'regex': regex,
             'whole_word': whole_word,
-            'case_sensitive': case_sensitive
+            'case_sensitive': case_sensitive,
+            'packed': True
         }
+        if in_selection and tc.hasSelection():
+            # the selection is sent as is, the whole document is synced
+            request_data['string'] = tc.selectedText()
+            self._offset = tc.selectionStart()
+            document = None
+        else:
+            self._offset = 0
+            document = 'string'
+        self._nb_partial = 0
         try:
-            self.editor.backend.send_request(findall, request_data,
-                                             self._on_results_available)
+            # the occurrences are streamed, the first ones are shown before
+            # the whole document has been scanned.
+            self.editor.backend.send_request(
+                findall_chunks, request_data, self._on_results_available,
+                document=document, supersede=self, priority='interactive',
+                on_partial=self._on_partial_results)
         except AttributeError:
+            request_data['string'] = self.editor.toPlainText()
             self._on_results_available(findall(request_data))
         except NotRunning:
             QtCore.QTimer.singleShot(100, self.request_search)
 
+    def _on_partial_results(self, results):
+        if not self._nb_partial:
+            # first chunk of a new search
+            self._clear_decorations()
+            self._occurrences = []
+            self._packed_end = 0
+        spans = search.unpack(results, self._packed_end)
+        if spans:
+            self._packed_end = spans[-1][1]
+        occurrences = [(start + self._offset, end + self._offset)
+                       for start, end in spans]
+        self._occurrences.extend(occurrences)
+        self._nb_partial = len(self._occurrences)
+        for start, end in occurrences[:self.MAX_HIGHLIGHTED_OCCURENCES -
+                                      len(self._decorations)]:
+            deco = self._create_decoration(start, end)
+            self._decorations.append(deco)
+            self.editor.decorations.append(deco)
+        self.cpt_occurences = len(self._occurrences)
+        self._update_label_matches()
+
     def _on_results_available(self, results):
+        # the results are packed: two integers per occurrence
+        if self._nb_partial and 2 * self._nb_partial == len(results):
+            # the occurrences have already been received chunk by chunk
+            self._nb_partial = 0
+            self._working = False
+            self._current_occurrence_index = -1
+            self._update_label_matches()
+            self._update_buttons(txt=self.lineEditReplace.text())
+            return
+        self._nb_partial = 0
         self._occurrences = [(start + self._offset, end + self._offset)
-                             for start, end in results]
+                             for start, end in search.unpack(results)]
         self._on_search_finished()
 
     def _update_label_matches(self):
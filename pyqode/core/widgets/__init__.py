@@ -13,6 +13,8 @@ pyqode applications:
       any other object that have the same interface).
     - ErrorsTable: a QTableWidget specialised to show CheckerMessage.
     - OutlineTreeWidget: a widget that show the outline of an editor.
+    - FindInFilesWidget: a widget that searches the files of a project
+      directory and opens the occurrences in a SplittableCodeEditTabWidget.
 
 
 """
@@ -21,6 +23,7 @@ from pyqode.core.widgets.encodings import (EncodingsComboBox, EncodingsMenu,
                                            EncodingsContextMenu)
 from pyqode.core.widgets.errors_table import ErrorsTable
 from pyqode.core.widgets.file_icons_provider import FileIconProvider
+from pyqode.core.widgets.find_in_files import FindInFilesWidget
 from pyqode.core.widgets.interactive import InteractiveConsole  # Deprecated
 from pyqode.core.widgets.menu_recents import MenuRecentFiles
 from pyqode.core.widgets.menu_recents import RecentFilesManager
@@ -44,6 +47,7 @@ __all__ = [
     'FileSystemTreeView',
     'InteractiveConsole',
     'FileIconProvider',
+    'FindInFilesWidget',
     'FileSystemHelper',
     'MenuRecentFiles',
     'RecentFilesManager',
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Contains a widget that searches the files of a project directory and shows
+the occurrences, grouped by file.
+"""
+import logging
+import os
+
+from qtpy import QtCore, QtWidgets
+
+from pyqode.core.api import TextHelper
+from pyqode.core.backend import NotRunning
+from pyqode.core.backend.find_in_files import find_in_files
+
+
+def _logger():
+    return logging.getLogger(__name__)
+
+
+class FindInFilesWidget(QtWidgets.QWidget):
+    """
+    Searches the files of :attr:`root_path` in the backend (see
+    :mod:`pyqode.core.backend.find_in_files`) and shows the occurrences as
+    they are found.
+
+    Activating an occurrence opens the file in :attr:`tab_widget` (a
+    :class:`pyqode.core.widgets.SplittableCodeEditTabWidget`) and moves the
+    cursor to the occurrence.
+
+    The search is run by :attr:`backend`, the backend manager of the
+    current editor of the tab widget by default. The server runs it in a
+    background thread, the requests of the editor are not delayed. A new
+    search cancels the previous one, even if :attr:`backend` has changed
+    (e.g. the user switched to another editor).
+    """
+    #: Signal emitted when a search is finished, with the number of
+    #: occurrences.
+    search_finished = QtCore.Signal(int)
+
+    #: Maximum number of occurrences of a search.
+    MAX_RESULTS = 10000
+
+    def __init__(self, parent=None):
+        super(FindInFilesWidget, self).__init__(parent)
+        #: The SplittableCodeEditTabWidget used to open the occurrences
+        self.tab_widget = None
+        #: The searched directory
+        self.root_path = ''
+        #: gitwildmatch patterns of the files and directories to skip, e.g.
+        #: the patterns of a :class:`FileSystemTreeView`.
+        self.ignore_patterns = []
+        self._backend = None
+        self._files = {}
+        self._count = 0
+        # backend running the current search
+        self._search_backend = None
+
+        self.line_edit = QtWidgets.QLineEdit(self)
+        self.line_edit.setPlaceholderText(_('Find in files'))
+        self.line_edit.returnPressed.connect(self.search)
+        self.check_box_regex = QtWidgets.QCheckBox(_('Regex'), self)
+        self.check_box_case = QtWidgets.QCheckBox(_('Match case'), self)
+        self.check_box_whole_words = QtWidgets.QCheckBox(
+            _('Whole words'), self)
+        self.label_count = QtWidgets.QLabel(self)
+        self.tree = QtWidgets.QTreeWidget(self)
+        self.tree.setHeaderHidden(True)
+        self.tree.itemActivated.connect(self._on_item_activated)
+
+        options = QtWidgets.QHBoxLayout()
+        options.addWidget(self.check_box_regex)
+        options.addWidget(self.check_box_case)
+        options.addWidget(self.check_box_whole_words)
+        options.addStretch()
+        options.addWidget(self.label_count)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.line_edit)
+        layout.addLayout(options)
+        layout.addWidget(self.tree)
+
+    @property
+    def backend(self):
+        """
+        The backend manager that runs the searches. Defaults to the backend
+        of the current editor of :attr:`tab_widget`.
+        """
+        if self._backend is not None:
+            return self._backend
+        try:
+            return self.tab_widget.current_widget().backend
+        except AttributeError:
+            return None
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    def search(self, text=None):
+        """
+        Starts a new search, the occurrences of the previous search are
+        cleared.
+
+        :param text: the searched text, defaults to the text of the line
+            edit.
+        """
+        if text is None:
+            text = self.line_edit.text()
+        else:
+            self.line_edit.setText(text)
+        self.clear()
+        backend = self.backend
+        if not text or not self.root_path or backend is None:
+            return
+        request_data = {
+            'root': self.root_path,
+            'sub': text,
+            'regex': self.check_box_regex.isChecked(),
+            'case_sensitive': self.check_box_case.isChecked(),
+            'whole_word': self.check_box_whole_words.isChecked(),
+            'ignore_patterns': self.ignore_patterns,
+            'max_results': self.MAX_RESULTS
+        }
+        try:
+            backend.send_request(
+                find_in_files, request_data, self._on_search_finished,
+                supersede=self, priority='interactive',
+                on_partial=self._on_partial_results)
+        except NotRunning:
+            _logger().warning('cannot search %r, the backend is not running',
+                              text)
+        else:
+            self._search_backend = backend
+            self.label_count.setText(_('Searching...'))
+
+    def clear(self):
+        """
+        Cancels the running search and clears the occurrences.
+        """
+        if self._search_backend is not None:
+            self._search_backend.cancel(self)
+            self._search_backend = None
+        self.tree.clear()
+        self._files.clear()
+        self._count = 0
+        self.label_count.clear()
+
+    def _on_partial_results(self, hits):
+        self._add_hits(hits)
+        self.label_count.setText(_('%d occurrences...') % self._count)
+
+    def _on_search_finished(self, hits):
+        self._search_backend = None
+        if not self._count:
+            # the results were not streamed
+            self._add_hits(hits or [])
+        self.label_count.setText(_('%d occurrences') % self._count)
+        self.search_finished.emit(self._count)
+
+    def _add_hits(self, hits):
+        updated = set()
+        for path, line, column, preview in hits:
+            try:
+                file_item = self._files[path]
+            except KeyError:
+                file_item = QtWidgets.QTreeWidgetItem(self.tree)
+                file_item.setToolTip(0, path)
+                file_item.setExpanded(True)
+                self._files[path] = file_item
+            item = QtWidgets.QTreeWidgetItem(
+                file_item, ['%d: %s' % (line + 1, preview.strip())])
+            item.setData(0, QtCore.Qt.UserRole, [path, line, column])
+            updated.add(path)
+            self._count += 1
+        for path in updated:
+            file_item = self._files[path]
+            name = path
+            if self.root_path:
+                name = os.path.relpath(path, self.root_path)
+            file_item.setText(0, '%s (%d)' % (name, file_item.childCount()))
+
+    def _on_item_activated(self, item, _column):
+        data = item.data(0, QtCore.Qt.UserRole)
+        if not data or self.tab_widget is None:
+            return
+        path, line, column = data
+        editor = self.tab_widget.open_document(path)
+        if editor is not None:
+            TextHelper(editor).goto_line(line, column)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the backend message codecs (see pyqode.core.backend.codec) on
+payloads typical of the CodeCompletionWorker and findall workers.
+
+Usage::
+
+    python test/benchmarks/bench_codecs.py
+
+For each payload and each codec available on the interpreter, the script
+prints the encoded size and the time needed to encode and decode it.
+"""
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..')))
+from pyqode.core.backend import codec
+
+
+def _word(rnd):
+    return ''.join(rnd.choice(string.ascii_letters + '_')
+                   for _ in range(rnd.randint(3, 20)))
+
+
+def payloads():
+    rnd = random.Random(0)
+    code = '\n'.join(' '.join(_word(rnd) for _ in range(8))
+                     for _ in range(50000))
+    completions = [(12, 4, 1), [{'name': _word(rnd),
+                                 'icon': 'code-variable',
+                                 'tooltip': _word(rnd)}
+                                for _ in range(5000)]]
+    matches = [(i * 20, i * 20 + 6) for i in range(100000)]
+    return [
+        ('completion request (%d kB code)' % (len(code) // 1024), {
+            'request_id': 'a97285af-cc88-48a4-ac69-7459b9c7fa66',
+            'worker': 'pyqode.core.backend.workers.CodeCompletionWorker',
+            'data': {'code': code, 'line': 12, 'column': 4, 'path': '',
+                     'encoding': 'utf-8', 'prefix': 'foo', 'request_id': 1,
+                     'triggered_by_symbol': False}}),
+        ('completion response (5000 items)', {
+            'request_id': 'a97285af-cc88-48a4-ac69-7459b9c7fa66',
+            'results': completions}),
+        ('findall response (100k matches)', {
+            'request_id': 'a97285af-cc88-48a4-ac69-7459b9c7fa66',
+            'results': matches}),
+    ]
+
+
+def main(number=5):
+    for title, obj in payloads():
+        print(title)
+        for c in codec.CODECS:
+            data = c.dumps(obj)
+            dumps = min(timeit.repeat(lambda: c.dumps(obj), number=number,
+                                      repeat=3)) / number
+            loads = min(timeit.repeat(lambda: c.loads(data), number=number,
+                                      repeat=3)) / number
+            print('    %-14s %10d bytes  dumps %7.2f ms  loads %7.2f ms' % (
+                c.name, len(data), dumps * 1000, loads * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the time needed to receive a framed message (4 bytes header +
+payload) for payloads of 1 MB to 100 MB:
+
+    - server side: JsonServer._Handler.read_bytes, reading from a socket
+      pair fed by a writer thread;
+    - client side: the JsonTcpClient reading code, fed with 64 kB chunks
+      (the size of the chunks Qt usually delivers).
+
+Both are compared with the previous implementations, which grew an
+immutable bytes object.
+
+Usage::
+
+    python test/benchmarks/bench_framing.py [size_in_MB ...]
+"""
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..')))
+from pyqode.core.api.client import JsonTcpClient
+from pyqode.core.backend.server import JsonServer
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def legacy_read_bytes(self, size):
+    data = bytes()
+    while len(data) < size:
+        tmp = self.request.recv(size - len(data))
+        if not tmp:
+            raise EOFError("socket connection broken")
+        data += tmp
+    return data
+
+
+def legacy_read_header(self):
+    self._header_buf += self.read(4 - len(self._header_buf))
+    if len(self._header_buf) == 4:
+        self._header_complete = True
+        self._to_read = struct.unpack('=I', self._header_buf)[0]
+        self._header_buf = bytes()
+
+
+def legacy_read_payload(self):
+    data_read = self.read(self._to_read)
+    self._data_buf += data_read
+    self._to_read -= len(data_read)
+    if self._to_read <= 0:
+        data = bytes(self._data_buf)
+        self._header_complete = False
+        self._data_buf = bytes()
+        self._dispatch(self.codec.loads(data))
+
+
+class ServerReader(object):
+    read_bytes = JsonServer._Handler.read_bytes
+
+    def __init__(self, sock):
+        self.request = sock
+
+
+class LegacyServerReader(ServerReader):
+    read_bytes = legacy_read_bytes
+
+
+class _Codec(object):
+    @staticmethod
+    def loads(data):
+        return len(data)
+
+
+class ClientReader(object):
+    """ Feeds the client reading code with chunks of a message """
+    _read_header = JsonTcpClient._read_header
+    _read_payload = JsonTcpClient._read_payload
+    _on_ready_read = JsonTcpClient._on_ready_read
+    codec = _Codec
+
+    def __init__(self, message):
+        self._message = message
+        self._pos = 0
+        self._header_complete = False
+        self._header_buf = bytes()
+        self._to_read = 0
+        self._data_buf = bytearray()
+        self._data_pos = 0
+        self.received = None
+
+    def bytesAvailable(self):
+        return len(self._message) - self._pos
+
+    def read(self, size):
+        size = min(size, CHUNK_SIZE)
+        data = self._message[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def _dispatch(self, obj):
+        self.received = obj
+
+
+class LegacyClientReader(ClientReader):
+    _read_header = legacy_read_header
+    _read_payload = legacy_read_payload
+
+    def __init__(self, message):
+        super(LegacyClientReader, self).__init__(message)
+        self._data_buf = bytes()
+
+
+def bench_server(reader_class, size):
+    sock_a, sock_b = socket.socketpair()
+    payload = b'x' * size
+
+    def write():
+        sock_a.sendall(struct.pack('=I', size) + payload)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    reader = reader_class(sock_b)
+    t = time.time()
+    length = struct.unpack('=I', reader.read_bytes(4))[0]
+    assert len(reader.read_bytes(length)) == size
+    elapsed = time.time() - t
+    thread.join()
+    sock_a.close()
+    sock_b.close()
+    return elapsed
+
+
+def bench_client(reader_class, size):
+    reader = reader_class(struct.pack('=I', size) + b'x' * size)
+    t = time.time()
+    while reader.bytesAvailable():
+        reader._on_ready_read()
+    elapsed = time.time() - t
+    assert reader.received == size
+    return elapsed
+
+
+def main(sizes):
+    print('%8s  %12s  %12s  %12s  %12s' % (
+        'MB', 'server old', 'server new', 'client old', 'client new'))
+    for size in sizes:
+        nb_bytes = size * 1024 * 1024
+        print('%8d  %10.1fms  %10.1fms  %10.1fms  %10.1fms' % (
+            size,
+            bench_server(LegacyServerReader, nb_bytes) * 1000,
+            bench_server(ServerReader, nb_bytes) * 1000,
+            bench_client(LegacyClientReader, nb_bytes) * 1000,
+            bench_client(ClientReader, nb_bytes) * 1000))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10, 50, 100])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the throughput of the two backend server implementations:
+JsonServer (one thread per connection) and AsyncJsonServer (asyncio
+streams), for 1 to 100 concurrent editors.
+
+Each editor has its own connection and sends echo requests one after the
+other, as an editor waiting for its results would. The server runs in its
+own process.
+
+Usage::
+
+    python test/benchmarks/bench_servers.py [nb_editors ...]
+
+Extra server arguments (e.g. ``--dispatch concurrent``) can be given after
+``--``.
+"""
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+from pyqode.core.api.client import JsonTcpClient
+
+
+#: Number of requests sent by each editor
+REQUESTS = 200
+PAYLOAD = {'code': 'x = 1\n' * 100, 'line': 1, 'column': 1}
+SCRIPT = 'from pyqode.core.backend import server; server.serve_forever()'
+
+
+def _recv_bytes(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def _request(sock, request_id):
+    msg = json.dumps({'request_id': request_id,
+                      'worker': 'pyqode.core.backend.echo_worker',
+                      'data': PAYLOAD}).encode('utf-8')
+    sock.sendall(struct.pack('=I', len(msg)) + msg)
+    size = struct.unpack('=I', _recv_bytes(sock, 4))[0]
+    _recv_bytes(sock, size)
+
+
+def _editor(port, barrier):
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        barrier.wait()
+        for i in range(REQUESTS):
+            _request(sock, str(i))
+    finally:
+        sock.close()
+
+
+def _start(server, extra_args):
+    port = JsonTcpClient.pick_free_port()
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen(
+        [sys.executable, '-c', SCRIPT, str(port), '--server', server] +
+        extra_args, env=env, stdout=subprocess.PIPE)
+    # wait until the server listens
+    process.stdout.readline()
+    return process, port
+
+
+def bench(server, nb_editors, extra_args):
+    """ Returns the number of requests handled per second """
+    process, port = _start(server, extra_args)
+    try:
+        barrier = threading.Barrier(nb_editors + 1)
+        threads = [threading.Thread(target=_editor, args=(port, barrier))
+                   for _ in range(nb_editors)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        t = time.time()
+        for thread in threads:
+            thread.join()
+        return nb_editors * REQUESTS / (time.time() - t)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main(editors, extra_args):
+    print('%8s  %14s  %14s' % ('editors', 'threads', 'asyncio'))
+    for nb_editors in editors:
+        print('%8d  %10.0f r/s  %10.0f r/s' % (
+            nb_editors, bench('threads', nb_editors, extra_args),
+            bench('asyncio', nb_editors, extra_args)))
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    extra = []
+    if '--' in argv:
+        extra = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    main([int(arg) for arg in argv] or [1, 10, 50, 100], extra)
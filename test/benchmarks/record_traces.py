@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Records the canned request traces of test/test_backend/traces by driving an
+editor (code completion, occurrences and search) through typical editing
+sessions, with a backend started with ``--record``.
+
+See :mod:`pyqode.core.backend.traces` to replay them.
+
+Usage::
+
+    python test/benchmarks/record_traces.py [output directory]
+"""
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+from qtpy import QtCore, QtWidgets
+from qtpy.QtTest import QTest
+
+from pyqode.core import modes, panels
+from pyqode.core.api import CodeEdit
+
+SERVER = os.path.join(ROOT, 'test', 'server.py')
+
+
+def make_editor(trace):
+    editor = CodeEdit()
+    editor.modes.append(modes.CodeCompletionMode())
+    editor.modes.append(modes.OccurrencesHighlighterMode()).delay = 200
+    editor.modes.append(modes.PygmentsSyntaxHighlighter(editor.document()))
+    editor.panels.append(panels.SearchAndReplacePanel(),
+                         panels.SearchAndReplacePanel.Position.TOP)
+    editor.resize(800, 600)
+    editor.show()
+    editor.backend.start(SERVER, args=['--record', trace])
+    while not editor.backend.running:
+        QTest.qWait(50)
+    QTest.qWait(1500)
+    return editor
+
+
+def type_text(editor, text, delay=70):
+    for char in text:
+        if char == '\n':
+            QTest.keyClick(editor, QtCore.Qt.Key_Return)
+        else:
+            QTest.keyClicks(editor, char)
+        QTest.qWait(delay)
+
+
+def finish(editor):
+    QTest.qWait(1500)
+    editor.backend.stop()
+    editor.close()
+    del editor
+
+
+def typing_session(trace):
+    editor = make_editor(trace)
+    type_text(editor, '''import os
+
+
+def list_python_files(directory):
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith('.py'):
+            files.append(os.path.join(directory, name))
+    return files
+
+
+def count_lines(path):
+    with open(path) as f:
+        return len(f.readlines())
+
+''')
+    # explicit completion requests
+    for prefix in ['list_', 'count_', 'dir']:
+        type_text(editor, prefix)
+        QTest.keyClick(editor, QtCore.Qt.Key_Space,
+                       QtCore.Qt.ControlModifier)
+        QTest.qWait(400)
+        QTest.keyClick(editor, QtCore.Qt.Key_Escape)
+        for _ in prefix:
+            QTest.keyClick(editor, QtCore.Qt.Key_Backspace)
+            QTest.qWait(50)
+    finish(editor)
+
+
+def navigation_session(trace):
+    editor = make_editor(trace)
+    path = os.path.join(ROOT, 'pyqode', 'core', 'backend', 'documents.py')
+    with open(path) as f:
+        editor.setPlainText(f.read(), 'text/x-python', 'utf-8')
+    QTest.qWait(500)
+    # move around: occurrences of the word under the cursor
+    for i in range(40):
+        QTest.keyClick(editor, QtCore.Qt.Key_Down)
+        QTest.qWait(40)
+        if i % 4 == 0:
+            QTest.keyClick(editor, QtCore.Qt.Key_Right,
+                           QtCore.Qt.ControlModifier)
+            QTest.qWait(300)
+    # search
+    panel = editor.panels.get(panels.SearchAndReplacePanel)
+    panel.on_search()
+    QTest.qWait(200)
+    for word in ['doc', 'revision', 'self', 'data']:
+        panel.lineEditSearch.clear()
+        QTest.keyClicks(panel.lineEditSearch, word, delay=80)
+        QTest.qWait(600)
+    panel.close_panel()
+    # small edits
+    type_text(editor, '\n# a comment\n')
+    finish(editor)
+
+
+def large_file_session(trace):
+    editor = make_editor(trace)
+    path = os.path.join(ROOT, 'pyqode', 'core', 'api', 'code_edit.py')
+    with open(path) as f:
+        editor.setPlainText(f.read(), 'text/x-python', 'utf-8')
+    QTest.qWait(500)
+    cursor = editor.textCursor()
+    cursor.movePosition(cursor.End)
+    editor.setTextCursor(cursor)
+    type_text(editor, '''
+
+def visible_lines(editor):
+    return [line for line, block in editor.visible_blocks]
+''')
+    finish(editor)
+
+
+if __name__ == '__main__':
+    app = QtWidgets.QApplication(sys.argv)
+    # the completion filter model recurses deeply with the many words of
+    # the large file
+    sys.setrecursionlimit(100000)
+    if len(sys.argv) > 1:
+        out = sys.argv[1]
+    else:
+        out = os.path.join(ROOT, 'test', 'test_backend', 'traces')
+    large_file_session(os.path.join(out, 'large_file.jsonl'))
+    typing_session(os.path.join(out, 'typing.jsonl'))
+    navigation_session(os.path.join(out, 'navigation.jsonl'))
@@ -2,3 +2,258 @@
 """
 Test the client/server API
 """
+import os
+import random
+import pytest
+from qtpy import QtGui
+from qtpy.QtTest import QTest
+from pyqode.core.api.client import DocumentSync, local_sockets_supported
+from pyqode.core.backend import documents
+
+
+def pure_worker(data):
+    pure_worker.calls += 1
+    return data
+
+
+pure_worker.pure = True
+pure_worker.calls = 0
+
+
+def _apply(doc, sync, revision):
+    update = sync.update(revision)
+    if update is not None:
+        documents.store.update(update)
+    return documents.store.get(sync.id, sync.revision).text
+
+
+def test_document_sync():
+    doc = QtGui.QTextDocument()
+    doc.setPlainText('hello\nworld\n')
+    sync = DocumentSync.get(doc)
+    assert DocumentSync.get(doc) is sync
+    assert 'text' in sync.update(None)
+    assert sync.update(sync.revision) is None
+    rnd = random.Random(0)
+    revision = None
+    for i in range(200):
+        cursor = QtGui.QTextCursor(doc)
+        start = rnd.randint(0, len(doc.toPlainText()))
+        cursor.setPosition(start)
+        cursor.setPosition(min(start + rnd.randint(0, 10),
+                               len(doc.toPlainText())), cursor.KeepAnchor)
+        cursor.insertText(rnd.choice(['', 'a', '\n', 'b\nc', '\xa0']))
+        if i % 5 == 0:
+            assert _apply(doc, sync, revision) == doc.toPlainText()
+            revision = sync.revision
+    documents.store.close(sync.id)
+
+
+def test_document_sync_log_overflow():
+    doc = QtGui.QTextDocument()
+    sync = DocumentSync.get(doc)
+    revision = sync.revision
+    for i in range(DocumentSync.MAX_CHANGES + 1):
+        QtGui.QTextCursor(doc).insertText('a')
+    # too old to be updated from the log of changes
+    assert sync.update(revision)['text'] == doc.toPlainText()
+    assert 'changes' in sync.update(sync.revision - 1)
+
+
+def test_supersede_queued_request():
+    from pyqode.core.api.client import JsonTcpClient
+    # no server is listening: requests are queued until the client connects
+    client = JsonTcpClient(None, JsonTcpClient.pick_free_port())
+    try:
+        owner = object()
+        first = client.request('foo', {}, owner=owner, supersede='search')
+        other = client.request('foo', {}, owner=owner, supersede='complete')
+        second = client.request('foo', {}, owner=owner, supersede='search')
+        assert client.pending_count == 2
+        assert first not in client._pending
+        assert [r.id for r in client._queue] == [other, second]
+        client.forget(owner)
+        assert client.pending_count == 0
+        assert client._queue == []
+    finally:
+        client.close()
+
+
+@pytest.mark.skipif(not local_sockets_supported(),
+                    reason='unix domain sockets not supported')
+def test_local_client_retries(tmpdir):
+    from pyqode.core.api.client import JsonLocalClient
+    client = JsonLocalClient(None, str(tmpdir.join('backend')))
+    try:
+        client.request('foo', {})
+        QTest.qWait(300)
+        # the client keeps trying to connect until the server is listening
+        assert not client._closed
+        assert client.pending_count == 1
+    finally:
+        client.shutdown()
+
+
+def test_request_batch():
+    import threading
+    from pyqode.core.api.client import JsonTcpClient
+    from pyqode.core.backend import server
+    port = JsonTcpClient.pick_free_port()
+    srv = server.JsonServer(
+        args=server.default_parser().parse_args([str(port)]))
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = JsonTcpClient(None, port)
+    doc = QtGui.QTextDocument()
+    doc.setPlainText('hello')
+    sync = DocumentSync.get(doc)
+    results = []
+
+    def on_receive(res):
+        results.append(res)
+
+    try:
+        client.request_batch([
+            {'worker': 'pyqode.core.backend.echo_worker', 'args': {},
+             'document': 'code', 'on_receive': on_receive},
+            {'worker': 'pyqode.core.backend.echo_worker', 'args': 1}
+        ], on_receive=on_receive, sync=sync)
+        for _ in range(50):
+            if len(results) == 2:
+                break
+            QTest.qWait(100)
+        assert 'batch' in client.features
+        assert results == [{'code': 'hello'}, [{'code': 'hello'}, 1]]
+        assert client.pending_count == 0
+        assert client._batches == {}
+    finally:
+        client.shutdown()
+        srv.shutdown()
+        srv.server_close()
+        documents.store.close(sync.id)
+
+
+def test_stream_results():
+    import threading
+    from pyqode.core.api.client import JsonTcpClient
+    from pyqode.core.backend import server
+    port = JsonTcpClient.pick_free_port()
+    srv = server.JsonServer(
+        args=server.default_parser().parse_args([str(port)]))
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = JsonTcpClient(None, port)
+    chunks = []
+    results = []
+
+    def on_partial(chunk):
+        chunks.append(chunk)
+
+    def on_receive(res):
+        results.append(res)
+
+    try:
+        client.request('pyqode.core.backend.workers.findall_chunks',
+                       {'string': 'a' * 500, 'sub': 'a', 'regex': False,
+                        'whole_word': False, 'case_sensitive': True},
+                       on_receive=on_receive, on_partial=on_partial)
+        for _ in range(50):
+            if results:
+                break
+            QTest.qWait(100)
+        assert [len(chunk) for chunk in chunks] == [100, 200, 200]
+        assert len(results[0]) == 500
+    finally:
+        client.shutdown()
+        srv.shutdown()
+        srv.server_close()
+
+
+def test_result_cache():
+    import threading
+    from pyqode.core.api.client import JsonTcpClient
+    from pyqode.core.backend import server
+    port = JsonTcpClient.pick_free_port()
+    srv = server.JsonServer(args=server.default_parser().parse_args(
+        [str(port), '--result-cache', '0']))
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = JsonTcpClient(None, port)
+    doc = QtGui.QTextDocument()
+    doc.setPlainText('hello')
+    sync = DocumentSync.get(doc)
+    results = []
+
+    def on_receive(res):
+        results.append(res)
+
+    def wait_results(count):
+        for _ in range(50):
+            if len(results) == count:
+                break
+            QTest.qWait(100)
+        assert len(results) == count
+
+    pure_worker.calls = 0
+    try:
+        for i in range(2):
+            client.request(pure_worker, {'x': 1}, on_receive,
+                           document=(sync, 'code'))
+            wait_results(i + 1)
+        # the second request did not reach the server
+        assert pure_worker.calls == 1
+        assert results[0] is results[1]
+        assert results[0]['code'] == 'hello'
+        QtGui.QTextCursor(doc).insertText('a')
+        client.request(pure_worker, {'x': 1}, on_receive,
+                       document=(sync, 'code'))
+        wait_results(3)
+        assert results[2]['code'] == 'ahello'
+        assert pure_worker.calls == 2
+        stats = client.result_cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 2)
+    finally:
+        client.shutdown()
+        srv.shutdown()
+        srv.server_close()
+        documents.store.close(sync.id)
+
+
+def test_document_snapshot():
+    import threading
+    from pyqode.core.api.client import JsonTcpClient
+    from pyqode.core.backend import server
+    port = JsonTcpClient.pick_free_port()
+    srv = server.JsonServer(
+        args=server.default_parser().parse_args([str(port)]))
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = JsonTcpClient(None, port)
+    client.snapshot_threshold = 100
+    doc = QtGui.QTextDocument()
+    doc.setPlainText('x = 1\n' * 100)
+    sync = DocumentSync.get(doc)
+    results = []
+
+    def on_receive(res):
+        results.append(res)
+
+    try:
+        client.request('pyqode.core.backend.workers.echo_worker', {},
+                       on_receive, document=(sync, 'code'))
+        for _ in range(50):
+            if results:
+                break
+            QTest.qWait(100)
+        assert results[0]['code'] == doc.toPlainText()
+        # the snapshot has been read and removed by the server
+        assert os.listdir(client._snapshot_dir) == []
+    finally:
+        client.shutdown()
+        srv.shutdown()
+        srv.server_close()
+        documents.store.close(sync.id)
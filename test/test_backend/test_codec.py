@@ -0,0 +1,28 @@
+import pytest
+from pyqode.core.backend import codec
+
+
+@pytest.mark.parametrize('c', codec.CODECS)
+def test_round_trip(c):
+    obj = {'request_id': 'a97285af', 'results': [
+        [0, 1], {'name': 'foo', 'icon': None}, u'caf\xe9', 3.5, True]}
+    assert codec.JsonCodec.dumps(c.loads(c.dumps(obj))) == \
+        codec.JsonCodec.dumps(obj)
+
+
+def test_json_always_available():
+    assert codec.available_codecs()[-1] == 'json'
+
+
+def test_negotiate():
+    assert codec.negotiate({'codecs': ['foo', 'json']}) == 'json'
+    assert codec.negotiate({'codecs': ['foo']}) == 'json'
+    assert codec.negotiate({}) == 'json'
+    name = codec.available_codecs()[0]
+    assert codec.negotiate({'codecs': ['foo', name, 'json']}) == name
+
+
+def test_get_codec():
+    assert codec.get_codec('foo') is codec.JsonCodec
+    for c in codec.CODECS:
+        assert codec.get_codec(c.name) is c
@@ -0,0 +1,100 @@
+import pytest
+from pyqode.core.backend import documents
+
+
+def test_update_full_text():
+    store = documents.DocumentStore()
+    assert store.update({'id': 'doc', 'path': 'foo.py', 'revision': 3,
+                         'text': 'a\nb\nc'}) == 3
+    doc = store.get('doc', 3)
+    assert doc.text == 'a\nb\nc'
+    assert doc.path == 'foo.py'
+    assert store.find('foo.py') == [doc]
+
+
+def test_update_changes():
+    store = documents.DocumentStore()
+    store.update({'id': 'doc', 'revision': 1, 'text': 'a\nb\nc'})
+    assert store.update({
+        'id': 'doc', 'revision': 3, 'base_revision': 1,
+        'changes': [(1, 1, ['x', 'y']), (0, 2, ['z'])],
+        'line_count': 3}) == 3
+    assert store.get('doc', 3).text == 'z\ny\nc'
+
+
+def test_out_of_sync():
+    store = documents.DocumentStore()
+    with pytest.raises(documents.OutOfSync):
+        store.get('doc')
+    store.update({'id': 'doc', 'revision': 1, 'text': 'a'})
+    with pytest.raises(documents.OutOfSync):
+        store.get('doc', 2)
+    # changes that do not apply to the stored revision
+    assert store.update({'id': 'doc', 'revision': 3, 'base_revision': 2,
+                         'changes': [(0, 1, ['b'])], 'line_count': 1}) is None
+    with pytest.raises(documents.OutOfSync):
+        store.get('doc')
+    # line count mismatch
+    store.update({'id': 'doc', 'revision': 1, 'text': 'a'})
+    assert store.update({'id': 'doc', 'revision': 2, 'base_revision': 1,
+                         'changes': [(0, 1, ['b'])], 'line_count': 2}) is None
+    # the full text always resyncs the document
+    store.update({'id': 'doc', 'revision': 4, 'text': 'c'})
+    assert store.get('doc', 4).text == 'c'
+    store.close('doc')
+    with pytest.raises(documents.OutOfSync):
+        store.get('doc')
+
+
+def test_resolve():
+    documents.update_document({'id': 'test_resolve', 'revision': 1,
+                               'text': 'some code'})
+    data = {'document': {'id': 'test_resolve', 'revision': 1,
+                         'field': 'string'}}
+    documents.resolve(data)
+    assert data['string'] == 'some code'
+    # no handle: nothing to do
+    data = ['some', 'data']
+    documents.resolve(data)
+    assert data == ['some', 'data']
+    documents.close_document({'id': 'test_resolve'})
+
+
+def test_update_from_snapshot(tmpdir):
+    from pyqode.core.backend import snapshots
+    store = documents.DocumentStore()
+    text = u'caf\xe9\n' * 1000
+    snapshot = snapshots.write_snapshot(str(tmpdir), 'doc', text, 2)
+    assert store.update({'id': 'doc', 'revision': 2,
+                         'snapshot': snapshot}) == 2
+    assert store.get('doc', 2).text == text
+    # the snapshot is read once
+    assert not tmpdir.listdir()
+    assert store.update({'id': 'doc', 'revision': 3,
+                         'snapshot': snapshot}) is None
+    with pytest.raises(documents.OutOfSync):
+        store.get('doc')
+
+
+def test_changes():
+    store = documents.DocumentStore()
+    store.update({'id': 'doc', 'revision': 1, 'text': 'a\nb\nc'})
+    store.update({'id': 'doc', 'revision': 2, 'base_revision': 1,
+                  'changes': [(1, 1, ['x'])], 'line_count': 3})
+    store.update({'id': 'doc', 'revision': 3, 'base_revision': 2,
+                  'changes': [(0, 1, [])], 'line_count': 2})
+    assert store.changes('doc', 3) == (3, [], None)
+    assert store.changes('doc', 1) == (3, [(1, 1, ['x']), (0, 1, [])], None)
+    # unknown revision: the lines are returned instead
+    assert store.changes('doc', None) == (3, None, ['x', 'c'])
+    # changes up to the revision of a request
+    assert store.changes('doc', 1, 2) == (2, [(1, 1, ['x'])], None)
+    assert store.changes('doc', 2, 2) == (2, [], None)
+    with pytest.raises(documents.OutOfSync):
+        # the index is more recent than the request
+        store.changes('doc', 3, 2)
+    with pytest.raises(documents.OutOfSync):
+        # only the lines of the current revision are available
+        store.changes('doc', None, 2)
+    store.update({'id': 'doc', 'revision': 4, 'text': 'y'})
+    assert store.changes('doc', 3) == (4, None, ['y'])
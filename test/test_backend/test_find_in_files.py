@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import io
+import re
+from collections import OrderedDict
+
+import pytest
+
+from pyqode.core.backend import find_in_files
+
+
+def _write(path, text):
+    with io.open(str(path), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def project(tmpdir):
+    _write(tmpdir.join('a.py'), u'foo bar\nxfoo\n  Foo = 1\n')
+    _write(tmpdir.mkdir('sub').join('b.txt'), u'h\xe9llo foo')
+    _write(tmpdir.mkdir('build').join('c.py'), u'foo\n')
+    _write(tmpdir.join('d.pyc'), u'foo\n')
+    tmpdir.join('e.bin').write_binary(b'foo\0')
+    return tmpdir
+
+
+def _search(root, processes, **data):
+    default, find_in_files.PROCESSES = find_in_files.PROCESSES, processes
+    data['root'] = str(root)
+    data.setdefault('ignore_patterns', ['build/', '*.pyc'])
+    try:
+        hits = []
+        for chunk in find_in_files.find_in_files(data):
+            hits += chunk
+    finally:
+        find_in_files.PROCESSES = default
+    return sorted((p[len(str(root)) + 1:].replace('\\', '/'), line, column,
+                   preview) for p, line, column, preview in hits)
+
+
+def test_list_files(project):
+    files = sorted(f[len(str(project)) + 1:].replace('\\', '/')
+                   for f in find_in_files.list_files(
+                       str(project), ['build/', '*.pyc', '', 'e.*']))
+    assert files == ['a.py', 'sub/b.txt']
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_find_in_files(project, processes):
+    assert _search(project, processes, sub='foo', whole_word=True) == [
+        ('a.py', 0, 0, 'foo bar'), ('a.py', 2, 2, '  Foo = 1'),
+        ('sub/b.txt', 0, 6, u'h\xe9llo foo')]
+    assert _search(project, processes, sub='F.o', regex=True,
+                   case_sensitive=True) == [('a.py', 2, 2, '  Foo = 1')]
+    assert len(_search(project, processes, sub='foo', max_results=2)) == 2
+    assert _search(project, processes, sub='') == []
+
+
+def test_invalid_regex(project):
+    with pytest.raises(re.error):
+        _search(project, 0, sub='(', regex=True)
+
+
+def test_whole_word_crlf(tmpdir):
+    tmpdir.join('a.py').write_binary(b'x = foo\r\nfoo\r\n')
+    assert _search(tmpdir, 0, sub='foo', whole_word=True) == [
+        ('a.py', 0, 4, 'x = foo'), ('a.py', 1, 0, 'foo')]
+
+
+def test_multiline_regex(tmpdir):
+    tmpdir.join('a.py').write_binary(b'foo\nbar foo\nbar x\nfoo\n')
+    assert _search(tmpdir, 0, sub=r'foo\s+bar|x', regex=True) == [
+        ('a.py', 0, 0, 'foo'), ('a.py', 1, 4, 'bar foo'),
+        ('a.py', 2, 4, 'bar x')]
+    assert _search(tmpdir, 0, sub=r'o\nb|\nf', regex=True) == [
+        ('a.py', 0, 2, 'foo'), ('a.py', 1, 6, 'bar foo'),
+        ('a.py', 2, 5, 'bar x')]
+
+
+def test_pattern_cache(monkeypatch):
+    monkeypatch.setattr(find_in_files, 'CACHE_SIZE', 2)
+    monkeypatch.setattr(find_in_files, '_patterns', OrderedDict())
+    first = find_in_files.compile_pattern('a')
+    find_in_files.compile_pattern('b')
+    assert find_in_files.compile_pattern('a') is first
+    find_in_files.compile_pattern('c')
+    # 'b' is the least recently used pattern
+    assert list(find_in_files._patterns) == [
+        ('a', False, False, False), ('c', False, False, False)]
@@ -0,0 +1,13 @@
+from pyqode.core.backend import lines
+
+
+def test_line_index():
+    text = 'foo\n\nbar baz\n'
+    index = lines.LineIndex(text)
+    assert index.starts == [0, 4, 5, 13]
+    for offset in range(len(text) + 1):
+        line = text[:offset].count('\n')
+        column = offset - (text[:offset].rfind('\n') + 1)
+        assert index.position(offset) == (line, column)
+        assert index.line(offset) == line
+    assert lines.LineIndex('').position(0) == (0, 0)
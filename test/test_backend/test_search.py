@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pyqode.core.backend import search
+
+
+@pytest.mark.parametrize('sub, kwargs, expected', [
+    ('foo', {}, [(0, 3), (4, 7), (9, 12), (13, 16)]),
+    ('FOO', {'case_sensitive': True}, [(9, 12)]),
+    ('foo', {'whole_word': True}, [(0, 3), (9, 12), (13, 16)]),
+    ('aa', {}, [(17, 19), (18, 20)]),
+    ('f[o]+', {'regex': True}, [(0, 3), (4, 7), (9, 12), (13, 16)]),
+    ('f[o]+', {'regex': True, 'whole_word': True},
+     [(0, 3), (9, 12), (13, 16)]),
+    ('', {}, []),
+])
+def test_finditer(sub, kwargs, expected):
+    assert list(search.finditer('foo foox FOO.foo aaa', sub,
+                                **kwargs)) == expected
+
+
+def test_lower_case_length():
+    # the lower case of u'İ' is two characters long
+    text = u'İx foo'
+    assert list(search.finditer(text, 'FOO')) == [(3, 6)]
+    assert list(search.finditer(text, u'İx', whole_word=True)) == [
+        (0, 2)]
+
+
+def test_cache():
+    matcher = search.compile_search('foo', whole_word=True)
+    assert search.compile_search('foo', whole_word=True) is matcher
+    assert search.compile_search('foo') is not matcher
+    for i in range(search.CACHE_SIZE):
+        search.compile_search('foo%d' % i)
+    assert search.compile_search('foo', whole_word=True) is not matcher
+
+
+def test_pack():
+    spans = [(2, 5), (10, 13), (12, 15)]
+    assert search.pack(spans) == [2, 3, 5, 3, -1, 3]
+    assert search.pack_starts([2, 10, 12], 3) == [2, 3, 5, 3, -1, 3]
+    assert search.pack_starts([20], 3, end=15) == [5, 3]
+    assert search.unpack(search.pack(spans)) == spans
+    # chunks continue the gaps of the previous chunks
+    assert search.unpack(search.pack(spans[1:], 5), 5) == spans[1:]
+    # unpacked results are accepted too
+    assert search.unpack([[2, 5], [10, 13]]) == [(2, 5), (10, 13)]
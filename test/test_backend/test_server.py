@@ -0,0 +1,609 @@
+"""
+Tests the json server, using a plain python socket as the client.
+"""
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+
+import pytest
+
+from pyqode.core.api.client import JsonTcpClient
+from pyqode.core.backend import (
+    batch, cancellation, codec, documents, metrics, results, scheduler,
+    server)
+
+#: Server implementations, they must pass the same protocol tests.
+SERVERS = [server.JsonServer]
+if sys.version_info >= (3, 5):
+    from pyqode.core.backend import asyncio_server
+    SERVERS.append(asyncio_server.AsyncJsonServer)
+
+
+def _send(sock, obj):
+    msg = json.dumps(obj).encode('utf-8')
+    sock.sendall(struct.pack('=I', len(msg)) + msg)
+
+
+def _recv_bytes(sock, size):
+    data = bytes()
+    while len(data) < size:
+        data += sock.recv(size - len(data))
+    return data
+
+
+def _recv(sock):
+    size = struct.unpack('=I', _recv_bytes(sock, 4))[0]
+    return json.loads(_recv_bytes(sock, size).decode('utf-8'))
+
+
+def slow_worker(data):
+    time.sleep(data)
+    return data
+
+
+def pid_worker(data):
+    import os
+    return os.getpid()
+
+
+pid_worker.cpu_bound = True
+
+
+def background_worker(data):
+    time.sleep(data)
+    return data
+
+
+background_worker.background = True
+
+
+def cancellable_worker(data):
+    token = cancellation.current_token()
+    end = time.time() + data
+    while time.time() < end:
+        token.raise_if_cancelled()
+        time.sleep(0.01)
+    return data
+
+
+def pure_worker(data):
+    pure_worker.calls += 1
+    return pure_worker.calls
+
+
+pure_worker.pure = True
+pure_worker.calls = 0
+
+
+def chunked_worker(data):
+    for i in range(data):
+        yield [i, i]
+
+
+class PersistentWorker(object):
+    persistent = True
+    setups = 0
+    teardowns = 0
+    memory = 0
+
+    def setup(self):
+        PersistentWorker.setups += 1
+        self.calls = 0
+
+    def __call__(self, data):
+        self.calls += 1
+        return self.calls
+
+    def teardown(self):
+        PersistentWorker.teardowns += 1
+
+    def memory_usage(self):
+        return self.memory
+
+
+class OtherPersistentWorker(PersistentWorker):
+    pass
+
+
+def _start_server(server_class, *args):
+    port = JsonTcpClient.pick_free_port()
+    args = server.default_parser().parse_args([str(port)] + list(args))
+    srv = server_class(args=args)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return srv, port
+
+
+@pytest.fixture(params=SERVERS)
+def json_server(request):
+    srv, port = _start_server(request.param)
+    yield port
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(params=SERVERS)
+def concurrent_server(request):
+    srv, port = _start_server(request.param, '--dispatch', 'concurrent',
+                              '--processes', '1')
+    yield port
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_persistent_connection(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        for i in range(10):
+            _send(sock, {'request_id': str(i),
+                         'worker': 'pyqode.core.backend.echo_worker',
+                         'data': 'data %d' % i})
+        for i in range(10):
+            response = _recv(sock)
+            assert response == {'request_id': str(i),
+                                'results': 'data %d' % i}
+    finally:
+        sock.close()
+
+
+def test_multiple_connections(json_server):
+    socks = [socket.create_connection(('127.0.0.1', json_server))
+             for _ in range(3)]
+    try:
+        for i, sock in enumerate(socks):
+            _send(sock, {'request_id': str(i),
+                         'worker': 'pyqode.core.backend.echo_worker',
+                         'data': i})
+        for i, sock in enumerate(socks):
+            assert _recv(sock)['results'] == i
+    finally:
+        for sock in socks:
+            sock.close()
+
+
+def _request(sock, request_id, worker, data):
+    _send(sock, {'request_id': request_id,
+                 'worker': 'test.test_backend.test_server.%s' % worker,
+                 'data': data})
+
+
+def test_default_dispatch_is_serial(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        _request(sock, 'slow', 'slow_worker', 0.5)
+        _request(sock, 'fast', 'slow_worker', 0)
+        assert _recv(sock)['request_id'] == 'slow'
+        assert _recv(sock)['request_id'] == 'fast'
+    finally:
+        sock.close()
+
+
+def test_concurrent_dispatch(concurrent_server):
+    sock = socket.create_connection(('127.0.0.1', concurrent_server))
+    try:
+        t = time.time()
+        _request(sock, 'slow', 'slow_worker', 1)
+        _send(sock, {'request_id': 'fast',
+                     'worker': 'pyqode.core.backend.echo_worker',
+                     'data': 'data'})
+        # the echo request is not delayed by the slow worker
+        assert _recv(sock)['request_id'] == 'fast'
+        assert time.time() - t < 1
+        assert _recv(sock)['request_id'] == 'slow'
+    finally:
+        sock.close()
+
+
+def test_max_concurrency(concurrent_server):
+    sock = socket.create_connection(('127.0.0.1', concurrent_server))
+    try:
+        t = time.time()
+        _request(sock, '1', 'slow_worker', 0.3)
+        _request(sock, '2', 'slow_worker', 0.3)
+        _recv(sock)
+        _recv(sock)
+        # slow_worker.max_concurrency defaults to 1
+        assert time.time() - t >= 0.6
+    finally:
+        sock.close()
+
+
+def test_max_concurrency_does_not_hold_threads(concurrent_server):
+    sock = socket.create_connection(('127.0.0.1', concurrent_server))
+    try:
+        t = time.time()
+        # more requests of a single worker than threads
+        for i in range(4):
+            _request(sock, str(i), 'slow_worker', 0.5)
+        _send(sock, {'request_id': 'fast',
+                     'worker': 'pyqode.core.backend.echo_worker',
+                     'data': 'data'})
+        # the waiting requests do not take the threads of the pool
+        assert _recv(sock)['request_id'] == 'fast'
+        assert time.time() - t < 0.4
+        assert [_recv(sock)['request_id'] for _ in range(4)] == [
+            '0', '1', '2', '3']
+        assert time.time() - t >= 2
+    finally:
+        sock.close()
+
+
+def test_background_worker(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        t = time.time()
+        _request(sock, 'background', 'background_worker', 0.5)
+        _request(sock, 'fast', 'slow_worker', 0)
+        # the background request does not hold the serial executor
+        assert _recv(sock)['request_id'] == 'fast'
+        assert time.time() - t < 0.4
+        assert _recv(sock)['request_id'] == 'background'
+    finally:
+        sock.close()
+
+
+def test_cpu_bound_worker(concurrent_server):
+    import os
+    sock = socket.create_connection(('127.0.0.1', concurrent_server))
+    try:
+        _request(sock, '1', 'pid_worker', 0)
+        assert _recv(sock)['results'] != os.getpid()
+    finally:
+        sock.close()
+
+
+def test_codec_handshake(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        _send(sock, {'request_id': 'handshake',
+                     'worker': codec.HANDSHAKE_WORKER,
+                     'data': {'codecs': ['foo', codec.MarshalCodec.name]}})
+        results = _recv(sock)['results']
+        assert results['codec'] == codec.MarshalCodec.name
+        assert 'documents' in results['features']
+        msg = codec.MarshalCodec.dumps({
+            'request_id': '1', 'worker': 'pyqode.core.backend.echo_worker',
+            'data': (1, 2)})
+        sock.sendall(struct.pack('=I', len(msg)) + msg)
+        size = struct.unpack('=I', _recv_bytes(sock, 4))[0]
+        response = codec.MarshalCodec.loads(_recv_bytes(sock, size))
+        assert response == {'request_id': '1', 'results': (1, 2)}
+    finally:
+        sock.close()
+
+
+def test_document_handle(concurrent_server):
+    sock = socket.create_connection(('127.0.0.1', concurrent_server))
+    handle = {'id': 'test_document_handle', 'revision': 1, 'field': 'code'}
+    try:
+        # unknown document: resync requested
+        _send(sock, {'request_id': '1',
+                     'worker': 'pyqode.core.backend.echo_worker',
+                     'data': {'document': handle}})
+        assert _recv(sock) == {'request_id': '1', 'results': [],
+                               'resync': True}
+        _send(sock, {'request_id': '2', 'worker': documents.UPDATE_WORKER,
+                     'data': {'id': handle['id'], 'revision': 1,
+                              'text': 'a\nb'}})
+        _send(sock, {'request_id': '3',
+                     'worker': 'pyqode.core.backend.echo_worker',
+                     'data': {'document': handle}})
+        # the update is applied before the work request is dispatched
+        _send(sock, {'request_id': '4', 'worker': documents.UPDATE_WORKER,
+                     'data': {'id': handle['id'], 'revision': 2,
+                              'base_revision': 1, 'line_count': 2,
+                              'changes': [(0, 1, ['c'])]}})
+        assert _recv(sock)['results'] == 1
+        assert _recv(sock)['results']['code'] == 'a\nb'
+        assert _recv(sock)['results'] == 2
+    finally:
+        _send(sock, {'request_id': '5', 'worker': documents.CLOSE_WORKER,
+                     'data': {'id': handle['id']}})
+        sock.close()
+
+
+def _cancel(sock, *request_ids):
+    _send(sock, {'request_id': 'cancel-%s' % request_ids[0],
+                 'worker': cancellation.CANCEL_WORKER,
+                 'data': {'request_ids': list(request_ids)}})
+
+
+def test_cancel_queued_request(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        t = time.time()
+        _request(sock, 'slow', 'slow_worker', 0.5)
+        _request(sock, 'stale', 'slow_worker', 1)
+        _cancel(sock, 'stale', 'unknown')
+        # the cancel request is handled while the slow worker runs
+        assert _recv(sock) == {'request_id': 'cancel-stale', 'results': 1}
+        assert _recv(sock)['request_id'] == 'slow'
+        assert _recv(sock) == {'request_id': 'stale', 'results': [],
+                               'cancelled': True}
+        assert time.time() - t < 1
+    finally:
+        sock.close()
+
+
+def test_cancel_running_request(concurrent_server):
+    sock = socket.create_connection(('127.0.0.1', concurrent_server))
+    try:
+        t = time.time()
+        _request(sock, 'running', 'cancellable_worker', 5)
+        time.sleep(0.2)
+        _cancel(sock, 'running')
+        assert _recv(sock)['request_id'] == 'cancel-running'
+        assert _recv(sock) == {'request_id': 'running', 'results': [],
+                               'cancelled': True}
+        assert time.time() - t < 1
+    finally:
+        sock.close()
+
+
+def test_current_token_outside_request():
+    token = cancellation.current_token()
+    assert not token.cancelled
+    token.raise_if_cancelled()
+    assert cancellable_worker(0) == 0
+
+
+def test_persistent_worker(json_server):
+    PersistentWorker.setups = 0
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        for i in range(3):
+            _request(sock, str(i), 'PersistentWorker', 0)
+            assert _recv(sock)['results'] == i + 1
+        assert PersistentWorker.setups == 1
+    finally:
+        sock.close()
+
+
+def test_worker_cache_eviction():
+    PersistentWorker.setups = PersistentWorker.teardowns = 0
+    cache = server.WorkerCache(max_instances=1, max_memory=100)
+    name = 'test.test_backend.test_server.PersistentWorker'
+    other = 'test.test_backend.test_server.OtherPersistentWorker'
+    with cache.instance(name) as worker:
+        assert worker(None) == 1
+        # instances in use are not evicted
+        with cache.instance(other):
+            pass
+        assert cache.instances() == [name]
+    with cache.instance(other):
+        pass
+    assert cache.instances() == [other]
+    assert PersistentWorker.teardowns == 2
+    # memory bound
+    with cache.instance(other) as worker:
+        worker.memory = 101
+    assert cache.instances() == []
+    assert PersistentWorker.teardowns == 3
+    # functions and regular classes are not cached
+    with cache.instance('pyqode.core.backend.echo_worker') as worker:
+        assert worker(1) == 1
+    assert cache.instances() == []
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason='unix domain sockets not supported')
+@pytest.mark.parametrize('server_class', SERVERS)
+def test_unix_transport(tmpdir, server_class):
+    path = str(tmpdir.join('backend'))
+    args = server.default_parser().parse_args([path, '--transport', 'unix'])
+    srv = server_class(args=args)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        _send(sock, {'request_id': '1',
+                     'worker': 'pyqode.core.backend.echo_worker',
+                     'data': 'x' * 1000000})
+        assert _recv(sock)['results'] == 'x' * 1000000
+    finally:
+        sock.close()
+        srv.shutdown()
+        srv.server_close()
+    assert not tmpdir.join('backend').exists()
+
+
+def test_priorities(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        _request(sock, 'busy', 'slow_worker', 0.3)
+        time.sleep(0.1)
+        for priority in ['background', 'normal', 'interactive']:
+            _send(sock, {'request_id': priority,
+                         'worker': 'test.test_backend.test_server.slow_worker',
+                         'data': 0, 'priority': priority})
+        time.sleep(0.1)
+        _send(sock, {'request_id': 'stats',
+                     'worker': scheduler.STATS_WORKER, 'data': {}})
+        stats = _recv(sock)['results']
+        assert stats['background']['depth'] == 1
+        assert [_recv(sock)['request_id'] for _ in range(4)] == [
+            'busy', 'interactive', 'normal', 'background']
+    finally:
+        sock.close()
+
+
+def test_starvation_protection():
+    queue = scheduler.RequestQueue(starvation_delay=0.1)
+    queue.put('background', 'old')
+    time.sleep(0.2)
+    queue.put('interactive', 'new')
+    queue.put('unknown', 'normal')
+    assert queue.pop() == 'old'
+    assert queue.pop() == 'new'
+    assert queue.pop() == 'normal'
+    stats = queue.stats()
+    assert stats['background']['promoted'] == 1
+    assert stats['normal']['dispatched'] == 1
+    with pytest.raises(IndexError):
+        queue.pop()
+
+
+def test_pop_accept():
+    queue = scheduler.RequestQueue()
+    queue.put('interactive', 'busy')
+    queue.put('background', 'free')
+    assert queue.pop(lambda item: item != 'busy') == 'free'
+    with pytest.raises(IndexError):
+        queue.pop(lambda item: item != 'busy')
+    assert len(queue) == 1
+    assert queue.pop() == 'busy'
+
+
+def test_batch(concurrent_server):
+    sock = socket.create_connection(('127.0.0.1', concurrent_server))
+    handle = {'id': 'test_batch', 'revision': 1}
+    echo = 'pyqode.core.backend.echo_worker'
+    try:
+        _send(sock, {'request_id': 'update', 'worker': documents.UPDATE_WORKER,
+                     'data': {'id': handle['id'], 'revision': 1,
+                              'text': 'a\nb'}})
+        assert _recv(sock)['results'] == 1
+        _send(sock, {'request_id': 'batch', 'worker': batch.BATCH_WORKER,
+                     'data': {'document': handle, 'requests': [
+                         {'request_id': '1', 'worker': echo,
+                          'data': {'x': 1}, 'field': 'code'},
+                         {'request_id': '2', 'worker': echo,
+                          'data': {'y': 2}}]}})
+        responses = dict((r['request_id'], r['results'])
+                         for r in [_recv(sock), _recv(sock)])
+        assert responses == {'1': {'x': 1, 'code': 'a\nb'}, '2': {'y': 2}}
+        # outdated document: none of the requests is run
+        handle['revision'] = 2
+        _send(sock, {'request_id': 'outdated', 'worker': batch.BATCH_WORKER,
+                     'data': {'document': handle, 'requests': [
+                         {'request_id': '3', 'worker': echo, 'data': {},
+                          'field': 'code'}]}})
+        assert _recv(sock) == {'request_id': 'outdated', 'results': [],
+                               'resync': True}
+    finally:
+        _send(sock, {'request_id': 'close', 'worker': documents.CLOSE_WORKER,
+                     'data': {'id': handle['id']}})
+        sock.close()
+
+
+def test_stream_results(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    worker = 'test.test_backend.test_server.chunked_worker'
+    try:
+        _send(sock, {'request_id': '1', 'worker': worker, 'data': 3,
+                     'stream': True})
+        for i in range(3):
+            assert _recv(sock) == {'request_id': '1', 'results': [i, i],
+                                   'partial': True}
+        assert _recv(sock) == {'request_id': '1', 'results': []}
+        # the chunks are concatenated if the client does not stream them
+        _request(sock, '2', 'chunked_worker', 2)
+        assert _recv(sock) == {'request_id': '2', 'results': [0, 0, 1, 1]}
+    finally:
+        sock.close()
+
+
+def test_result_cache(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    pure_worker.calls = 0
+    try:
+        for i, data in enumerate([{'code': 'a'}, {'code': 'a'},
+                                  {'code': 'b'}]):
+            _request(sock, str(i), 'pure_worker', data)
+        assert [_recv(sock)['results'] for _ in range(3)] == [1, 1, 2]
+        _send(sock, {'request_id': 'stats', 'worker': results.STATS_WORKER,
+                     'data': {}})
+        stats = _recv(sock)['results']
+        assert (stats['hits'], stats['misses'], stats['size']) == (1, 2, 2)
+    finally:
+        sock.close()
+
+
+def test_result_cache_eviction():
+    cache = results.ResultCache(max_size=2)
+    keys = [results.content_key('worker', {'code': str(i)})
+            for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, i)
+    with pytest.raises(KeyError):
+        cache.get(keys[0])
+    assert cache.get(keys[2]) == 2
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+def test_result_cache_document_key():
+    handle = {'id': 'doc', 'revision': 3, 'field': 'code'}
+    key = results.content_key('worker', {'code': 'a', 'x': 1,
+                                         'document': handle})
+    # the text of a synced document is identified by its revision
+    assert key == results.content_key('worker', {'x': 1, 'document': handle})
+    assert key != results.content_key('worker', {
+        'code': 'a', 'x': 1, 'document': dict(handle, revision=4)})
+    assert key != results.content_key('worker', {
+        'code': 'a', 'x': 2, 'document': handle})
+    # without a revision, the text is hashed
+    assert results.content_key('worker', {'code': 'a', 'document': {
+        'id': 'doc'}}) == results.content_key('worker', {'code': 'a'})
+
+
+def test_metrics(json_server):
+    sock = socket.create_connection(('127.0.0.1', json_server))
+    try:
+        for i in range(3):
+            _request(sock, str(i), 'slow_worker', 0.05)
+        for i in range(3):
+            _recv(sock)
+        # the size of a response is recorded once it has been sent: the
+        # metrics of the last response may arrive shortly after it.
+        name = 'test.test_backend.test_server.slow_worker'
+        for i in range(50):
+            _send(sock, {'request_id': 'metrics',
+                         'worker': metrics.METRICS_WORKER, 'data': {}})
+            worker = _recv(sock)['results']['workers'][name]
+            if worker[metrics.RESPONSE_SIZE]['count'] == 3:
+                break
+            time.sleep(0.01)
+        _send(sock, {'request_id': 'metrics',
+                     'worker': metrics.METRICS_WORKER,
+                     'data': {'reset': True}})
+        stats = _recv(sock)['results']
+        worker = stats['workers'][name]
+        assert worker['calls'] == 3
+        for metric in [metrics.QUEUE_WAIT, metrics.EXEC_TIME,
+                       metrics.REQUEST_SIZE, metrics.RESPONSE_SIZE]:
+            assert worker[metric]['count'] == 3
+        assert worker[metrics.EXEC_TIME]['min'] >= 0.05
+        # serial dispatch: the last request waited for the first two
+        assert worker[metrics.QUEUE_WAIT]['max'] >= 0.1
+        assert worker[metrics.REQUEST_SIZE]['min'] > 0
+        assert 'queue' in stats and 'result_cache' in stats
+        _send(sock, {'request_id': 'metrics',
+                     'worker': metrics.METRICS_WORKER, 'data': {}})
+        assert _recv(sock)['results']['workers'] == {}
+    finally:
+        sock.close()
+
+
+def test_histogram():
+    histogram = metrics.Histogram(metrics.TIME_BUCKETS)
+    assert histogram.percentile(95) is None
+    for i in range(1, 101):
+        histogram.record(i / 1000.0)
+    stats = histogram.to_dict()
+    assert stats['count'] == 100
+    assert (stats['min'], stats['max']) == (0.001, 0.1)
+    # estimates are the upper bound of the bucket of the percentile
+    assert 0.05 <= stats['p50'] <= 0.1
+    assert 0.095 <= stats['p95'] <= 0.1
+    assert stats['p99'] == 0.1
+    assert sum(count for _, count in stats['buckets']) == 100
+    histogram.record(1e9)
+    assert histogram.to_dict()['buckets'][-1] == [None, 1]
@@ -0,0 +1,82 @@
+import pytest
+
+from pyqode.core.backend import documents
+from pyqode.core.backend import spelling
+
+
+class Checker(object):
+    """ Case insensitive spell checker that knows a few words """
+    known = set(['the', 'quick', 'brown', 'fox', 'def'])
+
+    def __init__(self):
+        self.calls = []
+
+    def unknown(self, words):
+        self.calls.append(sorted(words))
+        return set(w.lower() for w in words if w.lower() not in self.known)
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    monkeypatch.setattr(documents, 'store', documents.DocumentStore())
+
+
+def test_split_line():
+    assert spelling.split_line('def __init__(self, 2nd, ab, __spam):') == [
+        ('def', 0, 3), ('init', 6, 10), ('self', 13, 17), ('spam', 30, 34)]
+
+
+def test_dictionary():
+    checker = Checker()
+    dictionary = spelling.Dictionary(checker)
+    assert dictionary.unknown(['The', 'quikc', 'fox', 'quikc']) == set(
+        ['quikc'])
+    assert dictionary.unknown(['fox', 'quikc', 'brwon']) == set(
+        ['quikc', 'brwon'])
+    # each word is checked once, the new words in one call
+    assert checker.calls == [['The', 'fox', 'quikc'], ['brwon']]
+    assert len(dictionary) == 4
+
+
+def test_document_index():
+    checker = Checker()
+    dictionary = spelling.Dictionary(checker)
+    documents.store.update({'id': 'doc', 'path': 'a.py', 'revision': 1,
+                            'text': 'the quikc\nbrown fox\ndef jmups'})
+    index = spelling.document_index('doc', dictionary)
+    assert index.messages() == [('quikc', 0, 4, 9), ('jmups', 2, 4, 9)]
+    assert index.messages(['jmups']) == [('quikc', 0, 4, 9)]
+    checker.calls[:] = []
+    documents.store.update({'id': 'doc', 'path': 'a.py', 'revision': 2,
+                            'base_revision': 1, 'line_count': 3,
+                            'changes': [[1, 1, ['brown foxx fox']]]})
+    index = spelling.document_index('doc', dictionary)
+    assert index.messages() == [('quikc', 0, 4, 9), ('foxx', 1, 6, 10),
+                                ('jmups', 2, 4, 9)]
+    # only the new word of the changed line is checked
+    assert checker.calls == [['foxx']]
+    # a new dictionary (e.g. another language) checks the document again
+    assert spelling.document_index('doc', spelling.Dictionary(
+        Checker())).messages() == index.messages()
+
+
+def test_document_index_revision():
+    dictionary = spelling.Dictionary(Checker())
+    documents.store.update({'id': 'rev', 'path': 'b.py', 'revision': 1,
+                            'text': 'the quikc\nbrown fox'})
+    spelling.document_index('rev', dictionary)
+    documents.store.update({'id': 'rev', 'path': 'b.py', 'revision': 2,
+                            'base_revision': 1, 'line_count': 2,
+                            'changes': [[1, 1, ['brwon fox']]]})
+    documents.store.update({'id': 'rev', 'path': 'b.py', 'revision': 3,
+                            'base_revision': 2, 'line_count': 2,
+                            'changes': [[0, 1, ['xx the quikc']]]})
+    # a request made for revision 2 gets the misspellings of revision 2
+    index = spelling.document_index('rev', dictionary, 2)
+    assert index.revision == 2
+    assert index.messages() == [('quikc', 0, 4, 9), ('brwon', 1, 0, 5)]
+    with pytest.raises(documents.OutOfSync):
+        spelling.document_index('rev', dictionary, 1)
+    assert spelling.document_index('rev', dictionary).messages() == [
+        ('quikc', 0, 7, 12), ('brwon', 1, 0, 5)]
+    documents.store.close('rev')
@@ -0,0 +1,73 @@
+"""
+Tests the recording and the replay of request traces.
+"""
+import glob
+import os
+import socket
+import threading
+
+import pytest
+
+from pyqode.core.api.client import JsonTcpClient
+from pyqode.core.backend import metrics, server, traces
+
+from .test_server import _recv, _request
+
+
+TRACES = sorted(glob.glob(os.path.join(
+    os.path.dirname(__file__), 'traces', '*.jsonl')))
+
+
+def _start_server(*args):
+    port = JsonTcpClient.pick_free_port()
+    srv = server.JsonServer(args=server.default_parser().parse_args(
+        [str(port)] + list(args)))
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return srv, port
+
+
+def test_record(tmpdir):
+    path = str(tmpdir.join('trace.jsonl'))
+    srv, port = _start_server('--record', path)
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        for i in range(3):
+            _request(sock, str(i), 'pure_worker', {'code': str(i)})
+            _recv(sock)
+    finally:
+        sock.close()
+        srv.shutdown()
+        srv.server_close()
+    entries = traces.load(path)
+    assert [sorted(entry) for entry in entries] == [
+        ['conn', 'in', 't'], ['conn', 'out', 't']] * 3
+    assert entries[0]['in']['data'] == {'code': '0'}
+    assert entries[1]['out']['request_id'] == '0'
+    assert entries[1]['out']['size'] > 0
+    assert 'results' not in entries[1]['out']
+    recorded = traces.recorded_latencies(entries).stats()
+    assert recorded['test.test_backend.test_server.pure_worker'][
+        'calls'] == 3
+
+
+@pytest.mark.parametrize('path', TRACES,
+                         ids=[os.path.basename(path) for path in TRACES])
+def test_replay(path):
+    entries = traces.load(path)
+    srv, port = _start_server()
+    try:
+        report = traces.replay(entries, ('127.0.0.1', port), speed=0,
+                               timeout=30)
+    finally:
+        srv.shutdown()
+        srv.server_close()
+    assert report['requests'] == len([e for e in entries if 'in' in e])
+    assert report['unanswered'] == 0
+    assert report['resyncs'] == 0
+    count = sum(stats[metrics.ROUND_TRIP]['count']
+                for stats in report['workers'].values())
+    assert count == report['requests']
+    assert 'CodeCompletionWorker' in traces.format_report(
+        report, traces.recorded_latencies(entries))
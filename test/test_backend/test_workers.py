@@ -1,5 +1,5 @@
 import pytest
-from pyqode.core.backend import workers
+from pyqode.core.backend import cancellation, workers
 
 
 def test_echo_worker():
@@ -114,3 +114,177 @@ with open('test/files/foo.py', 'r') as f:
 def test_find_all(data, nb_expected):
     results = workers.findall(data)
     assert len(results) == nb_expected
+
+
+def test_find_all_chunks():
+    data = {'string': 'a ' * 1000, 'sub': 'a', 'regex': False,
+            'whole_word': False, 'case_sensitive': False}
+    chunks = list(workers.findall_chunks(data))
+    # the size of the chunks doubles, starting with a small one
+    assert [len(chunk) for chunk in chunks] == [100, 200, 400, 300]
+    assert sum(chunks, []) == workers.findall(data)
+
+
+def test_word_index():
+    from pyqode.core.backend import words
+    index = words.WordIndex(['foo = bar(foobar)', 'food.foo', '', 'x2 = Foz'])
+    assert index.counts == {'foo': 2, 'bar': 1, 'foobar': 1, 'food': 1,
+                            'Foz': 1}
+    # foo is the most frequent word, Foz matches case insensitively
+    assert index.complete('fo')[0] == 'foo'
+    assert set(index.complete('fo')) == {'foo', 'foobar', 'food', 'Foz'}
+    assert index.complete('fo', limit=2) == ['foo', 'foobar']
+    # the words near the cursor come first
+    assert index.complete('foo', line=3)[:2] == ['foo', 'food']
+    # words that contain the prefix come after the prefix matches
+    assert index.complete('ba') == ['bar', 'foobar']
+    index.apply([(1, 1, ['']), (2, 0, ['barbaz'])], 2)
+    assert 'food' not in index.counts
+    assert index.counts['barbaz'] == 1
+    assert index.complete('fo') == ['foo', 'foobar', 'Foz']
+    assert index.complete('barb') == ['barbaz']
+    assert index.revision == 2
+
+
+def test_document_words_provider():
+    from pyqode.core.backend import documents, words
+    documents.store.update({'id': 'words', 'path': 'words.py',
+                            'revision': 1, 'text': 'spam eggs\nspam'})
+    code = documents.get_document({'id': 'words'}).text
+    provider = workers.DocumentWordsProvider()
+    assert provider.complete(code, 0, 0, 'words.py', 'utf-8', 'sp') == [
+        {'name': 'spam'}]
+    documents.store.update({'id': 'words', 'path': 'words.py', 'revision': 2,
+                            'base_revision': 1,
+                            'changes': [(1, 1, ['spawn'])], 'line_count': 2})
+    code = documents.get_document({'id': 'words'}).text
+    assert provider.complete(code, 0, 0, 'words.py', 'utf-8', 'sp') == [
+        {'name': 'spam'}, {'name': 'spawn'}]
+    # the document is updated while the request runs: the words are the
+    # words of the request text
+    documents.store.update({'id': 'words', 'path': 'words.py', 'revision': 3,
+                            'base_revision': 2,
+                            'changes': [(1, 1, ['spare'])], 'line_count': 2})
+    assert provider.complete(code, 0, 0, 'words.py', 'utf-8', 'sp') == [
+        {'name': 'spam'}, {'name': 'spawn'}]
+    documents.store.update({'id': 'words', 'path': 'words.py', 'revision': 4,
+                            'base_revision': 3,
+                            'changes': [(0, 1, ['spin'])], 'line_count': 2})
+    index = words.document_index('words', 3)
+    assert index.revision == 3
+    assert index.complete('sp') == ['spam', 'spare']
+    with pytest.raises(documents.OutOfSync):
+        # the index cannot go back to an older revision
+        words.document_index('words', 2)
+    assert words.document_index('words').complete('sp') == ['spare', 'spin']
+    documents.store.close('words')
+    # documents that are not synced are indexed on the fly
+    assert provider.complete('eggs spam', 0, 0, '', 'utf-8', '') == [
+        {'name': 'eggs'}, {'name': 'spam'}]
+    assert workers.DocumentWordsProvider.split('a.b c1 d_e', [' ', '.']) == [
+        'a', 'b', 'd_e']
+
+
+def test_find_all_packed():
+    from pyqode.core.backend import search
+    data = {'string': 'ab ' * 1000, 'sub': 'b', 'regex': False,
+            'whole_word': False, 'case_sensitive': False}
+    spans = workers.findall(data)
+    data['packed'] = True
+    chunks = list(workers.findall_chunks(data))
+    assert chunks[0][:4] == [1, 1, 2, 1]
+    assert search.unpack(sum(chunks, [])) == spans
+    assert search.unpack(workers.findall(data)) == spans
+    data['max_results'] = 150
+    assert search.unpack(workers.findall(data)) == spans[:150]
+    data['regex'] = True
+    assert search.unpack(workers.findall(data)) == spans[:150]
+
+
+def test_image_annotations(tmpdir):
+    image = str(tmpdir.join('plot.png'))
+    tmpdir.join('plot.png').write_binary(b'')
+    code = 'import os\n\nplot(x)  # comment\nprint(1)\nplot(x)\n'
+    workers.set_image_annotations({'a.py': {'plot(x) # old comment': [image],
+                                            'missing()': [image]}})
+    try:
+        assert workers.image_annotations({'code': code, 'path': 'a.py'}) == [
+            ('Image', 0, 2, None, None, None, image),
+            ('Image', 0, 4, None, None, None, image)]
+        assert workers.image_annotations({'code': code, 'path': 'b.py'}) == []
+    finally:
+        workers.set_image_annotations({})
+
+
+class _Provider(object):
+    def __init__(self, names, delay=0):
+        self.names = names
+        self.delay = delay
+        self.calls = 0
+
+    def complete(self, *args):
+        import time
+        self.calls += 1
+        time.sleep(self.delay)
+        return [{'name': name} for name in self.names]
+
+
+def test_code_completion_providers(monkeypatch):
+    monkeypatch.setattr(workers.CodeCompletionWorker, 'providers', [
+        _Provider(['slow', 'both'], delay=0.3), _Provider(['fast', 'both']),
+        _Provider(['faster'])])
+    data = {'code': '', 'line': 1, 'column': 0, 'path': '',
+            'encoding': 'utf-8', 'prefix': '', 'request_id': 3}
+    # without a deadline, the completions of all the providers are merged
+    assert workers.CodeCompletionWorker()(data) == [
+        (1, 0, 3), [{'name': 'slow'}, {'name': 'both'}, {'name': 'fast'},
+                    {'name': 'faster'}]]
+    # the slow provider misses the deadline, its completions come later
+    data['deadline'] = 0.2
+    chunks = list(workers.CodeCompletionWorker()(data))
+    assert chunks == [
+        [(1, 0, 3), [{'name': 'fast'}, {'name': 'both'}, {'name': 'faster'}]],
+        [[{'name': 'slow'}]]]
+
+
+def test_code_completion_late_timeout(monkeypatch):
+    import time
+    slow = _Provider(['slow'], delay=0.5)
+    monkeypatch.setattr(workers.CodeCompletionWorker, 'providers', [
+        slow, _Provider(['fast'])])
+    monkeypatch.setattr(workers.CodeCompletionWorker, 'late_timeout', 0.1)
+    data = {'code': '', 'line': 1, 'column': 0, 'path': '',
+            'encoding': 'utf-8', 'prefix': '', 'request_id': 3,
+            'deadline': 0.1}
+    t = time.time()
+    # the slow provider misses the deadline and the late timeout
+    assert list(workers.CodeCompletionWorker()(data)) == [
+        [(1, 0, 3), [{'name': 'fast'}]]]
+    assert time.time() - t < 0.4
+    # the next request is queued behind the slow provider: it is dropped
+    # since the worker does not wait for it anymore
+    assert list(workers.CodeCompletionWorker()(data)) == [
+        [(1, 0, 3), [{'name': 'fast'}]]]
+    time.sleep(0.5)
+    assert slow.calls == 1
+
+
+def test_code_completion_cancelled_request(monkeypatch):
+    import time
+    slow = _Provider(['slow'], delay=0.3)
+    monkeypatch.setattr(workers.CodeCompletionWorker, 'providers', [slow])
+    data = {'code': '', 'line': 1, 'column': 0, 'path': '',
+            'encoding': 'utf-8', 'prefix': '', 'request_id': 3,
+            'deadline': 0.1}
+    assert list(workers.CodeCompletionWorker()(data)) == [[(1, 0, 3), []],
+                                                          [[{'name': 'slow'}]]]
+    token = cancellation.CancellationToken()
+    token.cancel()
+    cancellation.set_current_token(token)
+    try:
+        with pytest.raises(cancellation.Cancelled):
+            list(workers.CodeCompletionWorker()(data))
+    finally:
+        cancellation.set_current_token(None)
+    time.sleep(0.1)
+    assert slow.calls == 1
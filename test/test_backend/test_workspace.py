@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from pyqode.core.backend import documents
+from pyqode.core.backend import workers
+from pyqode.core.backend import workspace
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    # the open documents of the other tests must not be completed
+    monkeypatch.setattr(documents, 'store', documents.DocumentStore())
+
+
+def _write(path, text, mtime=None):
+    with open(str(path), 'w') as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(str(path), (mtime, mtime))
+
+
+def test_scan(tmpdir):
+    _write(tmpdir.join('a.py'), 'spam = spam_eggs(spam)')
+    _write(tmpdir.join('b.txt'), 'spammer')
+    tmpdir.mkdir('.git').join('config').write('spamalot')
+    tmpdir.join('data.bin').write_binary(b'spambin\0')
+    index = workspace.WorkspaceIndex([str(tmpdir)])
+    assert index.scan()
+    assert index.stats()['files'] == 2
+    assert index.complete('sp', 10) == ['spam', 'spam_eggs', 'spammer']
+    assert index.complete('SPAM_', 10) == ['spam_eggs']
+    assert index.complete('', 10) == []
+    # no change
+    assert not index.scan()
+    # modified and removed files
+    _write(tmpdir.join('b.txt'), 'spanner', mtime=1)
+    tmpdir.join('a.py').remove()
+    assert index.scan()
+    assert index.complete('sp', 10) == ['spanner']
+    assert index.stats()['words'] == 1
+
+
+def test_weight(tmpdir):
+    # a large (generated) file, with more occurrences of foo_big
+    _write(tmpdir.join('big.py'), ' '.join(['foo_big'] * 50 +
+                                           ['filler'] * 9950))
+    _write(tmpdir.join('small.py'), 'foo_small foo_small')
+    index = workspace.WorkspaceIndex([str(tmpdir)])
+    index.FILE_WORDS = 100
+    assert index.weight(10) == 1
+    assert index.weight(10000) == 0.01
+    index.scan()
+    assert index.complete('foo', 10) == ['foo_small', 'foo_big']
+
+
+def test_memory_cap(tmpdir):
+    _write(tmpdir.join('old.py'), 'old_word', mtime=1000)
+    _write(tmpdir.join('new.py'), 'new_word', mtime=2000)
+    index = workspace.WorkspaceIndex([str(tmpdir)], max_memory=300)
+    index.scan()
+    # only the most recent file fits
+    assert list(index.files) == [str(tmpdir.join('new.py'))]
+    assert index.stats()['skipped'] == 1
+    assert index.memory <= 300
+
+
+def test_cache(tmpdir):
+    project = tmpdir.mkdir('project')
+    _write(project.join('a.py'), 'cached_word other_word')
+    cache = str(tmpdir.join('cache', 'words.cache'))
+    index = workspace.WorkspaceIndex([str(project)], cache)
+    index.scan()
+    index.save()
+    loaded = workspace.WorkspaceIndex([str(project)], cache)
+    loaded.load()
+    assert loaded.complete('cach', 10) == ['cached_word']
+    assert loaded.memory == index.memory
+    # unchanged files are not read again
+    assert not loaded.scan()
+    # a corrupted cache is ignored
+    tmpdir.join('cache', 'words.cache').write_binary(b'garbage')
+    loaded = workspace.WorkspaceIndex([str(project)], cache)
+    loaded.load()
+    assert loaded.files == {}
+
+
+def test_open_documents(tmpdir):
+    path = str(tmpdir.join('a.py'))
+    _write(path, 'disk_word')
+    _write(tmpdir.join('b.py'), 'disk_other')
+    index = workspace.WorkspaceIndex([str(tmpdir)])
+    index.scan()
+    documents.store.update({'id': 'open', 'path': path, 'revision': 1,
+                            'text': 'disk_edited'})
+    try:
+        # the open document supersedes its file
+        assert index.complete('disk', 10) == ['disk_edited', 'disk_other']
+        # ... but not for the document itself
+        assert index.complete('disk', 10, path=path) == ['disk_other']
+        workspace.index = index
+        documents.store.update({'id': 'current', 'path': 'c.py',
+                                'revision': 1, 'text': 'disk_current'})
+        code = documents.get_document({'id': 'current'}).text
+        provider = workers.DocumentWordsProvider()
+        assert provider.complete(code, 0, 0, 'c.py', 'utf-8', 'disk') == [
+            {'name': 'disk_current'}, {'name': 'disk_edited'},
+            {'name': 'disk_other'}]
+    finally:
+        workspace.index = None
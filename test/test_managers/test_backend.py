@@ -6,7 +6,8 @@ from qtpy import QtWidgets
 import pytest
 from qtpy.QtTest import QTest
 from pyqode.core import backend
-from pyqode.core.managers.backend import BackendManager
+from pyqode.core.managers.backend import (
+    BackendGroup, BackendManager, BackendPool)
 from ..helpers import cwd_at, python2_path, server_path, wait_for_connected
 
 
@@ -94,4 +95,124 @@ def test_frozen_server():
     with pytest.raises(NotRunning):
         backend_manager.send_request(
             backend.echo_worker, 'some data', on_receive=_on_receive)
-    backend_manager.start('server.exe')
\ No newline at end of file
+    backend_manager.start('server.exe')
+
+
+def test_backend_pool():
+    win = QtWidgets.QMainWindow()
+    manager = BackendManager(win)
+    BackendPool.prewarm(server_path(), count=1)
+    try:
+        stats = BackendPool.stats()
+        assert stats['ready'] == 1
+        manager.start(server_path())
+        assert manager.running
+        assert BackendPool.stats()['hits'] == stats['hits'] + 1
+        assert BackendPool.stats()['ready'] == 0
+        manager.stop()
+        # the pool is refilled in the background
+        QTest.qWait(BackendPool.REFILL_DELAY + 200)
+        assert BackendPool.stats()['ready'] == 1
+        # other configurations are not served by the pool
+        manager.start(server_path(), args=['--dispatch', 'concurrent'])
+        assert BackendPool.stats()['hits'] == stats['hits'] + 1
+    finally:
+        manager.stop()
+        BackendPool.clear()
+    assert BackendPool.stats()['ready'] == 0
+
+
+def test_start_error_callback():
+    win = QtWidgets.QMainWindow()
+    manager = BackendManager(win)
+    errors = []
+    interpreter = os.path.join(os.path.dirname(__file__), 'no_python')
+    # the dead pooled process is discarded, the new process fails to start
+    hits = BackendPool.stats()['hits']
+    BackendPool.prewarm(server_path(), count=1, interpreter=interpreter)
+    try:
+        QTest.qWait(200)
+        manager.start(server_path(), interpreter=interpreter,
+                      error_callback=errors.append)
+        QTest.qWait(200)
+        assert errors
+        assert BackendPool.stats()['hits'] == hits
+    finally:
+        manager.stop()
+        BackendPool.clear()
+
+def test_stats():
+    win = QtWidgets.QMainWindow()
+    manager = BackendManager(win)
+    assert manager.stats() is None
+    manager.start(server_path())
+    received = []
+
+    def on_receive(results):
+        received.append(results)
+
+    def on_stats(stats):
+        received.append(stats)
+
+    try:
+        manager.send_request(backend.echo_worker, 'some data',
+                             on_receive=on_receive)
+        manager.stats(on_receive=on_stats)
+        for _ in range(50):
+            if len(received) == 2:
+                break
+            QTest.qWait(100)
+        assert received[0] == 'some data'
+        stats = received[1]
+        name = 'pyqode.core.backend.workers.echo_worker'
+        assert stats['client']['workers'][name]['calls'] == 1
+        assert stats['client']['workers'][name]['round_trip']['p95'] > 0
+        assert stats['server']['workers'][name]['calls'] == 1
+        assert manager.stats()['pending'] == 0
+    finally:
+        manager.stop()
+
+
+def test_balanced_backends(monkeypatch):
+    monkeypatch.setattr(BackendGroup, 'SUSTAINED_SAMPLES', 1)
+    monkeypatch.setattr(BackendGroup, 'SPAWN_LOAD', 1)
+    win = QtWidgets.QMainWindow()
+    managers = [BackendManager(win) for _ in range(2)]
+    received = []
+
+    def on_receive(results):
+        received.append(results)
+
+    try:
+        for manager in managers:
+            manager.start(server_path(), share_id='balanced', balance=True)
+        group = BackendGroup.GROUPS['balanced']
+        assert len(group.backends) == 1
+        assert group.members == managers
+        for i in range(4):
+            managers[i % 2].send_request(backend.echo_worker, i,
+                                         on_receive=on_receive)
+        # sustained load: a process is spawned...
+        group._sample()
+        assert len(group.backends) == 2
+        # ...and receives the next request
+        managers[0].send_request(backend.echo_worker, 4,
+                                 on_receive=on_receive)
+        assert group.backends[1][1].pending_count == 1
+        for _ in range(50):
+            if len(received) == 5:
+                break
+            QTest.qWait(100)
+        assert sorted(received) == list(range(5))
+        # no load anymore: the process is retired, then stopped
+        group._sample()
+        assert len(group.backends) == 1
+        group._sample()
+        assert group.stats()['retiring'] == 0
+        assert (group.spawned, group.retired) == (2, 1)
+        managers[0].stop()
+        assert managers[1].running
+    finally:
+        for manager in managers:
+            manager.stop()
+    assert 'balanced' not in BackendGroup.GROUPS
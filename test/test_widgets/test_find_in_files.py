@@ -0,0 +1,63 @@
+import os
+
+from pyqode.core.api.client import JsonTcpClient
+from pyqode.core.widgets.find_in_files import FindInFilesWidget
+
+
+class _Backend(object):
+    """
+    Backend manager whose client is not connected, the responses of the
+    server are simulated.
+    """
+    def __init__(self):
+        self.client = JsonTcpClient(None, JsonTcpClient.pick_free_port())
+
+    def send_request(self, worker, args, on_receive=None, supersede=None,
+                     priority=None, on_partial=None):
+        self.client.request(worker, args, on_receive, owner=self,
+                            supersede=supersede, priority=priority,
+                            on_partial=on_partial)
+
+    def cancel(self, supersede):
+        self.client.supersede(self, supersede)
+
+    def last_request(self):
+        return self.client._queue[-1].id
+
+    def respond(self, request_id, hits, partial=False):
+        self.client._dispatch({'request_id': request_id, 'results': hits,
+                               'partial': partial})
+
+
+def test_switch_backend_during_search(tmpdir):
+    path = os.path.join(str(tmpdir), 'a.py')
+    widget = FindInFilesWidget()
+    widget.root_path = str(tmpdir)
+    totals = []
+    widget.search_finished.connect(totals.append)
+    first, second = _Backend(), _Backend()
+    try:
+        widget.backend = first
+        widget.search('foo')
+        old = first.last_request()
+        first.respond(old, [[path, 0, 0, 'foo']], partial=True)
+        assert widget.tree.topLevelItemCount() == 1
+        # e.g. the user switched to another editor
+        widget.backend = second
+        widget.search('bar')
+        assert first.client.pending_count == 0
+        assert widget.tree.topLevelItemCount() == 0
+        # the results of the previous search are dropped
+        first.respond(old, [[path, 1, 0, 'foo']], partial=True)
+        first.respond(old, [])
+        assert widget.tree.topLevelItemCount() == 0
+        assert totals == []
+        second.respond(second.last_request(), [[path, 2, 0, 'bar']])
+        assert totals == [1]
+        widget.search('bar')
+        # an empty search cancels the running search
+        widget.search('')
+        assert second.client.pending_count == 0
+    finally:
+        first.client.close()
+        second.client.close()